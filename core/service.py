@@ -32,7 +32,7 @@ class ContextCore:
         Args:
             mcp_request: 从AI Talk的MCP Call中传入的请求。
         """
-        res = self.storage.search(text)
+        res = await self.storage.search_async(text)
         # 根据score阈值筛选res列表中的对象
         
         threshold = 0.7  # 可以根据实际需求调整阈值
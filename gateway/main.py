@@ -1,4 +1,7 @@
 from fastmcp import FastMCP  # 修正导入语句
+import asyncio
+import os
+from typing import List
 from mem0 import MemoryClient
 from dotenv import load_dotenv
 import json
@@ -19,6 +22,12 @@ import uvicorn
 load_dotenv()
 
 storage_service = StorageService(websocket_manager)
+# 启用本地降级预热时，启动即在后台加载本地存储和编码器，首次降级无需等待模型加载
+if os.getenv("LOCAL_FALLBACK_PREWARM", "false").lower() in ("1", "true", "yes"):
+    storage_service.prewarm_local_storage()
+# 启动时回放上次运行中降级写入本地、尚未同步到 Mem0 的记忆
+if os.getenv("MEM0_REPLAY_ON_START", "false").lower() in ("1", "true", "yes"):
+    storage_service.replay_fallback_writes_in_background()
 
 # Initialize FastMCP server for mem0 tools
 mcp = FastMCP("AD-Context")
@@ -26,6 +35,8 @@ mcp = FastMCP("AD-Context")
 # Initialize mem0 client and set default user
 mem0_client = MemoryClient()
 DEFAULT_USER_ID = "trae_user"
+# 批量导入时同时进行的隐私分级请求数
+BULK_CLASSIFY_CONCURRENCY = 8
 
 # 更新项目自定义指令
 mem0_client.update_project(custom_instructions=CUSTOM_INSTRUCTIONS)
@@ -64,8 +75,8 @@ async def add_memory(text: str) -> str:
         from schemas.common import Metadata
         from schemas.privacy import PrivacyLevel
         
-        # 创建默认的元数据
-        privacy_label = PrivacyClassifier().classify(text)
+        # 创建默认的元数据（隐私分级是同步的模型调用，放到线程中执行，不阻塞事件循环）
+        privacy_label = await asyncio.to_thread(PrivacyClassifier().classify, text)
         metadata = Metadata(
             privacy_level=privacy_label.level,
             source="user_input"
@@ -77,6 +88,46 @@ async def add_memory(text: str) -> str:
         return f"Error adding memory: {str(e)}"
 
 
+@mcp.tool(
+    description="""**批量导入记忆：**
+当需要一次性导入大量内容（例如用户提供的完整聊天记录、笔记或历史对话导出）时调用此工具，
+而不是逐条调用 add_memory。每个元素是一条独立的记忆，会分别进行隐私分级后批量存储。
+    """
+)
+async def add_memories(texts: List[str]) -> str:
+    """向 AD-Context 批量添加记忆
+    
+    对每条内容做隐私分级（有界并发），然后通过 StorageService.add_many 批量存储。
+    
+    参数：
+        texts: 要存储的记忆内容列表，每个元素为一条记忆。
+    
+    返回：
+        str: 操作结果消息，包含成功或失败信息。
+    """
+    try:
+        from schemas.common import Metadata
+        
+        classifier = PrivacyClassifier()
+        semaphore = asyncio.Semaphore(BULK_CLASSIFY_CONCURRENCY)
+        
+        async def classify(text: str):
+            async with semaphore:
+                return await asyncio.to_thread(classifier.classify, text)
+        
+        privacy_labels = await asyncio.gather(*[classify(text) for text in texts])
+        metadatas = [
+            Metadata(privacy_level=label.level, source="user_import")
+            for label in privacy_labels
+        ]
+        
+        return await storage_service.add_many(
+            texts, metadatas, [label.brief for label in privacy_labels]
+        )
+    except Exception as e:
+        return f"Error adding memories: {str(e)}"
+
+
 @mcp.tool(
     description="""**核心指令：**
 在你与用户进行任何对话之前或之中，当你需要回忆用户的历史信息、偏好或过往共识以构建上下文时，你**必须**主动调用此工具进行查询。
@@ -116,7 +167,7 @@ async def search_memory(query_text: str, top_k: int = 5) -> str:
         # <time>:search_start - 开始搜索记忆
         print(f"<time>:search_start - 开始搜索记忆，查询: {query_text}")
         
-        results = storage_service.search(query_text, top_k=top_k)
+        results = await storage_service.search_async(query_text, top_k=top_k)
         
         # <time>:search_complete - 搜索完成
         print(f"<time>:search_complete - 搜索完成，找到 {len(results)} 个结果")
@@ -158,7 +209,9 @@ async def search_memory(query_text: str, top_k: int = 5) -> str:
             try:
                 from services.filter.filter_service import FilterService
                 filter_service = FilterService()
-                filtered_content = filter_service.filter_contexts(query_text, candidate_contexts)
+                filtered_content = await asyncio.to_thread(
+                    filter_service.filter_contexts, query_text, candidate_contexts
+                )
                 
                 # <time>:filter_complete - 过滤完成
                 print(f"<time>:filter_complete - 过滤完成，过滤后内容长度: {len(filtered_content)}")
@@ -212,8 +265,25 @@ async def health_check(request):
         PlainTextResponse: 服务器状态信息
     """
     from starlette.responses import PlainTextResponse
+    if storage_service.use_local_fallback and not storage_service.local_storage_ready:
+        return PlainTextResponse("OK (local fallback warming up)")
     return PlainTextResponse("OK")
 
+@mcp.custom_route("/metrics/storage", methods=["GET"])
+async def storage_metrics(request):
+    """存储层指标端点
+
+    返回:
+        JSONResponse: Mem0 熔断器状态与转换计数、写入查重计数、写后队列深度与时延、本地副本同步状态
+    """
+    from starlette.responses import JSONResponse
+    return JSONResponse({
+        "circuit": storage_service.circuit_stats(),
+        "dedup": storage_service.dedup_stats(),
+        "write_queue": storage_service.write_queue_stats(),
+        "replica": storage_service.replica_stats(),
+    })
+
 @mcp.custom_route("/", methods=["GET"])
 async def root_redirect(request):
     """根路径重定向到MCP端点信息
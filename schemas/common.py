@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from schemas.privacy import PrivacyLevel
 
 class Metadata(BaseModel):
@@ -22,3 +22,10 @@ class ListResult(BaseModel):
     """
     context:str
     metadata:Metadata
+
+class MemoryPage(BaseModel):
+    """
+    分页列出的一页记忆
+    """
+    memories:List[Dict[str, Any]]
+    next_cursor:Optional[str] = None
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IVF 近似最近邻索引
+用 NumPy 实现的球面 k-means 粗量化器：每个向量归入最近的聚类中心，
+查询时只在最近的 nprobe 个倒排列表中做精确打分，用召回率换取延迟。
+"""
+
+import math
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from storage.vector_index import normalize_rows
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    """分块计算每个向量最近（内积最大）的聚类中心
+
+    参数:
+        vectors: 形状为 (n, dim) 的归一化向量
+        centroids: 形状为 (nlist, dim) 的归一化聚类中心
+        chunk_size: 每块的向量数，限制临时矩阵的大小
+
+    返回:
+        np.ndarray: 每个向量所属的聚类下标
+    """
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        block = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """倒排文件 (IVF) 近似最近邻索引
+
+    只保存行号：向量本身仍由 VectorIndex 的向量存储提供，
+    因此删除通过 VectorIndex 的存活标记过滤，无需修改倒排列表。
+    """
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 16, min_train_size: int = 10000,
+                 train_sample: int = 50000, iterations: int = 10, seed: int = 0):
+        """初始化 IVF 索引
+
+        参数:
+            nlist: 聚类数，为空时训练时取 4 * sqrt(N)
+            nprobe: 查询时默认探查的倒排列表数，越大召回越高、延迟越高
+            min_train_size: 向量数达到该值后才训练，之前使用精确搜索
+            train_sample: k-means 训练的最大采样数
+            iterations: k-means 迭代次数
+            seed: 随机种子
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.train_sample = train_sample
+        self.iterations = iterations
+        self.seed = seed
+
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        self._list_sizes = np.zeros(0, dtype=np.int64)
+        self.row_count = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def untrained_copy(self) -> "IVFIndex":
+        """返回参数相同、尚未训练的新索引（后台训练完成前不影响正在使用的索引）"""
+        return IVFIndex(nlist=self.nlist, nprobe=self.nprobe, min_train_size=self.min_train_size,
+                        train_sample=self.train_sample, iterations=self.iterations, seed=self.seed)
+
+    def train(self, matrix: np.ndarray, rows: np.ndarray, chunk_size: int = 65536):
+        """用球面 k-means 训练聚类中心，并把给定的行分配到倒排列表
+
+        只有采样的向量会被整体读入内存，分配阶段按块读取，适用于 memmap 存储。
+
+        参数:
+            matrix: 向量存储的全部行（可以是 memmap）
+            rows: 参与训练并需要分配的行号
+            chunk_size: 分配阶段每块读取的行数
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        rng = np.random.default_rng(self.seed)
+        n = len(rows)
+        nlist = self.nlist or int(min(max(16, 4 * math.sqrt(n)), 65536))
+        nlist = min(nlist, n)
+
+        sample_idx = np.sort(rng.choice(n, min(n, self.train_sample), replace=False))
+        sample = np.asarray(matrix[rows[sample_idx]], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            assignments = nearest_centroids(sample, centroids)
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            nonempty = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+            sums[nonempty] = np.add.reduceat(sample[order], starts, axis=0)
+            # 空聚类重新随机初始化
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+            centroids = normalize_rows(sums)
+
+        self.centroids = centroids
+        self.nlist = nlist
+        self._lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self._list_sizes = np.zeros(nlist, dtype=np.int64)
+        self.row_count = 0
+        for start in range(0, n, chunk_size):
+            chunk = rows[start:start + chunk_size]
+            self.add(chunk, matrix[chunk])
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        """把新的行增量分配到最近的倒排列表
+
+        参数:
+            rows: 行号数组
+            vectors: 对应的归一化向量
+        """
+        if not self.trained or len(rows) == 0:
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        assignments = nearest_centroids(vectors, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        sorted_rows = rows[order]
+        counts = np.bincount(assignments, minlength=self.nlist)
+        offset = 0
+        for list_id in np.flatnonzero(counts):
+            self._append(list_id, sorted_rows[offset:offset + counts[list_id]])
+            offset += counts[list_id]
+        self.row_count = max(self.row_count, int(rows.max()) + 1)
+
+    def _append(self, list_id: int, rows: np.ndarray):
+        """向倒排列表追加行号，容量不足时按倍数扩容"""
+        size = self._list_sizes[list_id]
+        current = self._lists[list_id]
+        required = size + len(rows)
+        if required > len(current):
+            grown = np.empty(max(required, 2 * len(current), 16), dtype=np.int64)
+            grown[:size] = current[:size]
+            self._lists[list_id] = current = grown
+        current[size:required] = rows
+        self._list_sizes[list_id] = required
+
+    def candidates(self, query_vector: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """返回最近的 nprobe 个倒排列表中的全部行号
+
+        参数:
+            query_vector: 归一化的查询向量
+            nprobe: 探查的倒排列表数，为空时使用默认值
+
+        返回:
+            np.ndarray: 候选行号
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query_vector
+        if nprobe < self.nlist:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.nlist)
+        parts = [self._lists[i][:self._list_sizes[i]] for i in probe]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def save(self, path: str):
+        """持久化聚类中心和倒排列表（先写临时文件再原子替换）
+
+        参数:
+            path: .npz 文件路径
+        """
+        if not self.trained:
+            return
+        lists = [self._lists[i][:self._list_sizes[i]] for i in range(self.nlist)]
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            list_sizes=self._list_sizes,
+            rows=np.concatenate(lists) if lists else np.empty(0, dtype=np.int64),
+            row_count=np.int64(self.row_count),
+        )
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """从文件加载聚类中心和倒排列表
+
+        参数:
+            path: .npz 文件路径
+
+        返回:
+            bool: 是否加载成功
+        """
+        try:
+            with np.load(path) as data:
+                centroids = data["centroids"]
+                list_sizes = data["list_sizes"].astype(np.int64)
+                rows = data["rows"].astype(np.int64)
+                row_count = int(data["row_count"])
+        except Exception as e:
+            print(f"加载 IVF 索引失败，将重新训练: {e}")
+            return False
+        offsets = np.concatenate(([0], np.cumsum(list_sizes)))
+        self.centroids = centroids
+        self.nlist = len(centroids)
+        self._lists = [rows[offsets[i]:offsets[i + 1]].copy() for i in range(self.nlist)]
+        self._list_sizes = list_sizes
+        self.row_count = row_count
+        return True
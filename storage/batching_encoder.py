@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+微批编码器
+把并发到达的零散 encode 调用在几毫秒内合并为一次批量前向计算，
+由单个工作线程执行，再把结果按调用拆分回各自的 Future。
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_STOP = object()
+
+
+class MicroBatchingEncoder:
+    """合并并发编码请求的编码器前端，encode 接口与底层编码器一致"""
+
+    def __init__(self, encoder: Any, max_batch_size: int = 32, max_wait_ms: float = 2.0):
+        """初始化并启动工作线程
+
+        参数:
+            encoder: 底层编码器（需提供 encode 方法）
+            max_batch_size: 一批最多合并的文本数（单个请求超过上限时单独成批，不拆分）
+            max_wait_ms: 收到一批中第一个请求后最多等待的毫秒数
+        """
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue()
+        self._pending: Optional[Tuple[List[str], Future, float]] = None
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self.max_batch_seen = 0
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+        self._worker = threading.Thread(target=self._run, name="micro-batching-encoder", daemon=True)
+        self._worker.start()
+
+    def __getattr__(self, name: str) -> Any:
+        # 其余属性透传给底层编码器
+        return getattr(self.encoder, name)
+
+    def submit(self, texts: List[str]) -> Future:
+        """提交编码请求
+
+        参数:
+            texts: 文本列表
+
+        返回:
+            Future: 结果为形状 (len(texts), dim) 的向量
+        """
+        future: Future = Future()
+        if not texts:
+            future.set_result(np.empty((0, 0), dtype=np.float32))
+            return future
+        self._queue.put((list(texts), future, time.perf_counter()))
+        return future
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """同步编码（阻塞到所在批次完成）
+
+        参数:
+            texts: 文本列表
+            **kwargs: 合并后的批量调用不透传额外参数，传入时直接调用底层编码器
+
+        返回:
+            np.ndarray: 形状为 (len(texts), dim) 的向量
+        """
+        if kwargs:
+            return np.asarray(self.encoder.encode(texts, **kwargs), dtype=np.float32)
+        return self.submit(texts).result()
+
+    async def encode_async(self, texts: List[str]) -> np.ndarray:
+        """异步编码，等待期间不占用事件循环
+
+        参数:
+            texts: 文本列表
+
+        返回:
+            np.ndarray: 形状为 (len(texts), dim) 的向量
+        """
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _next_batch(self) -> Optional[List[Tuple[List[str], Future, float]]]:
+        """阻塞取出下一批请求，收到停止信号时返回 None"""
+        first = self._pending or self._queue.get()
+        self._pending = None
+        if first is _STOP:
+            return None
+        batch = [first]
+        size = len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP or size + len(item[0]) > self.max_batch_size:
+                # 放不下的请求留给下一批
+                self._pending = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        """工作线程：取批、编码、拆分结果"""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            texts = [text for item in batch for text in item[0]]
+            try:
+                vectors = np.asarray(self.encoder.encode(texts), dtype=np.float32)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for item_texts, future, _ in batch:
+                future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+            self._record(batch, len(texts), started)
+
+    def _record(self, batch: List[Tuple[List[str], Future, float]], size: int, started: float):
+        """更新批大小与排队延迟统计"""
+        delays = [started - enqueued for _, _, enqueued in batch]
+        with self._stats_lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.texts += size
+            self.max_batch_seen = max(self.max_batch_seen, size)
+            self.queue_delay_total += sum(delays)
+            self.queue_delay_max = max(self.queue_delay_max, max(delays))
+
+    def stats(self) -> Dict[str, Any]:
+        """返回批大小与排队延迟统计"""
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "texts": self.texts,
+                "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "avg_queue_delay_ms": self.queue_delay_total / self.requests * 1000 if self.requests else 0.0,
+                "max_queue_delay_ms": self.queue_delay_max * 1000,
+            }
+
+    def close(self, timeout: Optional[float] = None):
+        """处理完已排队的请求后停止工作线程
+
+        参数:
+            timeout: 最长等待秒数
+        """
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
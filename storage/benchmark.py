@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地存储性能基准测试
+
+用法:
+    python -m storage.benchmark search --sizes 1000 10000 100000
+    python -m storage.benchmark alloc --size 100000
+    python -m storage.benchmark ingest --sizes 100 500
+    python -m storage.benchmark ann --size 100000 --nprobe 4 8 16 32 64
+    python -m storage.benchmark quant --size 100000
+    python -m storage.benchmark concurrency --clients 50 --latency-ms 200
+    python -m storage.benchmark encoder --onnx-model ./models/all-MiniLM-L6-v2-onnx --threads 2
+
+除 encoder 外均使用随机向量模拟编码器，不依赖 sentence_transformers。
+concurrency 用固定延迟的模拟 Mem0 客户端比较同步与异步 StorageService 检索的并发吞吐，不访问网络。
+encoder 在独立子进程中分别加载各个后端，比较加载耗时、编码吞吐和常驻内存 (RSS)。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from schemas.common import Metadata, RetriveResult
+from schemas.privacy import PrivacyLevel
+from storage.ann_index import IVFIndex
+from storage.embedding_store import EmbeddingStore, InMemoryVectorStore
+from storage.local_storage import LocalStorageService, load_encoder
+from storage.vector_index import VectorIndex, normalize_rows
+
+DIM = 384
+
+
+class RandomEncoder:
+    """返回随机向量的编码器，用于基准测试"""
+
+    def __init__(self, dim: int = DIM, seed: int = 0):
+        self.dim = dim
+        self.rng = np.random.default_rng(seed)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.rng.standard_normal((len(texts), self.dim)).astype(np.float32)
+
+
+def _time_call(fn: Callable[[], object], repeat: int) -> float:
+    """多次调用并返回单次调用的平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def _build_service(size: int, tmpdir: str) -> LocalStorageService:
+    """构造一个包含 size 条随机记忆的本地存储服务（直接写入内存状态，跳过逐条持久化）"""
+    encoder = RandomEncoder()
+    service = LocalStorageService(storage_path=os.path.join(tmpdir, f"bench_{size}.jsonl"), encoder=encoder,
+                                  fsync=False)
+    embeddings = encoder.encode([""] * size)
+    ids = [str(uuid.uuid4()) for _ in range(size)]
+    rows = service.index.add_batch(ids, embeddings, [PrivacyLevel.LEVEL_1_PUBLIC.value] * size)
+    for memory_id, row in zip(ids, rows):
+        service._memories[memory_id] = {
+            "id": memory_id,
+            "content": f"memory {memory_id}",
+            "metadata": {"privacy_level": PrivacyLevel.LEVEL_1_PUBLIC.value, "source": "bench"},
+            "embedding_row": row,
+            "seq": service._next_seq(),
+        }
+    return service
+
+
+def _legacy_search(embeddings: List[Tuple[str, List[float]]], query: np.ndarray, top_k: int):
+    """旧实现：对每条记忆单独构造数组并计算余弦相似度，再全量排序
+
+    不包含旧实现每次查询重新读取 JSON 文件的开销，因此是旧实现延迟的下界。
+    """
+    scores = []
+    for memory_id, embedding in embeddings:
+        embedding = np.array(embedding)
+        similarity = float(np.dot(query, embedding) / (np.linalg.norm(query) * np.linalg.norm(embedding)))
+        scores.append((memory_id, similarity))
+    scores.sort(key=lambda item: item[1], reverse=True)
+    return scores[:top_k]
+
+
+def bench_search(sizes: List[int], top_k: int = 5, repeat: int = 20):
+    """对比不同规模下旧实现与向量索引的查询延迟"""
+    print(f"{'memories':>10} {'legacy (ms)':>14} {'index (ms)':>12} {'speedup':>9}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in sizes:
+            service = _build_service(size, tmpdir)
+            embeddings = [(memory_id, service.index.vector(memory_id).tolist()) for memory_id in service._memories]
+            query = service.encoder.encode(["query"])[0]
+            legacy_ms = _time_call(lambda: _legacy_search(embeddings, query, top_k), max(1, repeat // 10))
+            index_ms = _time_call(lambda: service.search("query", top_k=top_k), repeat)
+            print(f"{size:>10} {legacy_ms:>14.2f} {index_ms:>12.2f} {legacy_ms / index_ms:>8.1f}x")
+
+
+def _materialized_search(service: LocalStorageService, query: np.ndarray, top_k: int) -> List[RetriveResult]:
+    """对照实现：为每条记忆构造 RetriveResult / Metadata，全量排序后取 top_k"""
+    matrix = service.index.store.matrix
+    scores = matrix @ normalize_rows(query)
+    results = []
+    for memory_id, memory in service._memories.items():
+        results.append(RetriveResult(
+            context=memory["content"],
+            metadata=Metadata(privacy_level=PrivacyLevel(memory["metadata"]["privacy_level"]),
+                              source=memory["metadata"]["source"]),
+            score=float(scores[memory["embedding_row"]])
+        ))
+    results.sort(key=lambda result: result.score, reverse=True)
+    return results[:top_k]
+
+
+def _peak_allocation_mb(fn: Callable[[], object]) -> float:
+    """单次调用期间 Python 堆的峰值增量 (MB)"""
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (peak - base) / 1024 / 1024
+
+
+def bench_alloc(size: int, top_k: int = 5, repeat: int = 20):
+    """对比逐条构造结果对象与数组打分 + top_k 选择的单次查询内存分配和延迟"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        service = _build_service(size, tmpdir)
+        query = service.encoder.encode(["query"])[0]
+        print(f"{size} memories, top_k={top_k}")
+        print(f"{'method':>14} {'latency (ms)':>13} {'peak alloc (MB)':>16}")
+        for name, fn, runs in [
+            ("materialize", lambda: _materialized_search(service, query, top_k), max(1, repeat // 10)),
+            ("top-k select", lambda: service.search("query", top_k=top_k), repeat),
+        ]:
+            latency_ms = _time_call(fn, runs)
+            print(f"{name:>14} {latency_ms:>13.2f} {_peak_allocation_mb(fn):>16.2f}")
+        service.close()
+
+
+class LatencyMemoryClient:
+    """每次调用固定耗时的模拟 Mem0 客户端，用于并发基准测试"""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+
+    def search(self, query: str, **kwargs) -> List[dict]:
+        time.sleep(self.latency)
+        return [{"memory": query, "score": 0.9, "metadata": {"privacy_level": 1, "source": "bench"}}]
+
+
+def bench_concurrency(clients: int, latency_ms: float, max_concurrency: int):
+    """事件循环中同时发起 clients 个检索：同步 search 与 search_async 的总耗时与吞吐"""
+    from storage.service import StorageService
+
+    service = StorageService(None, memory_client=LatencyMemoryClient(latency_ms), max_concurrency=max_concurrency)
+
+    async def blocking_search(i: int):
+        # 旧写法：在 async 函数中直接调用同步 search，整个事件循环等待这次 HTTP 往返
+        return service.search(f"query {i}")
+
+    async def async_search(i: int):
+        return await service.search_async(f"query {i}")
+
+    async def run(search) -> float:
+        start = time.perf_counter()
+        await asyncio.gather(*[search(i) for i in range(clients)])
+        return time.perf_counter() - start
+
+    print(f"{clients} concurrent searches, simulated Mem0 latency {latency_ms:.0f} ms, "
+          f"executor size {max_concurrency}")
+    print(f"{'method':>14} {'total (s)':>10} {'searches/s':>11}")
+    for name, search in [("blocking", blocking_search), ("search_async", async_search)]:
+        elapsed = asyncio.run(run(search))
+        print(f"{name:>14} {elapsed:>10.2f} {clients / elapsed:>11.1f}")
+
+
+def _legacy_ingest(path: str, size: int, encoder: RandomEncoder):
+    """旧实现：每次写入都重新读取并重写整个 JSON 文件"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"memories": []}, f)
+    for i in range(size):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        data["memories"].append({
+            "id": str(uuid.uuid4()),
+            "content": f"memory {i}",
+            "metadata": {"privacy_level": PrivacyLevel.LEVEL_1_PUBLIC.value, "source": "bench"},
+            "embedding": encoder.encode([""])[0].tolist(),
+        })
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def bench_ingest(sizes: List[int]):
+    """对比整文件重写与追加写日志的逐条写入吞吐"""
+    metadata = Metadata(privacy_level=PrivacyLevel.LEVEL_1_PUBLIC, source="bench")
+    print(f"{'memories':>10} {'legacy (s)':>12} {'journal (s)':>12} {'journal+fsync (s)':>18}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in sizes:
+            legacy_s = _time_call(lambda: _legacy_ingest(os.path.join(tmpdir, f"legacy_{size}.json"),
+                                                         size, RandomEncoder()), 1) / 1000
+            timings = []
+            for fsync in (False, True):
+                service = LocalStorageService(storage_path=os.path.join(tmpdir, f"journal_{size}_{fsync}.jsonl"),
+                                              encoder=RandomEncoder(), fsync=fsync)
+                timings.append(_time_call(lambda: [service.add(f"memory {i}", metadata) for i in range(size)],
+                                          1) / 1000)
+                service.close()
+            print(f"{size:>10} {legacy_s:>12.2f} {timings[0]:>12.2f} {timings[1]:>18.2f}")
+
+
+def _clustered_vectors(size: int, dim: int = DIM, clusters: int = 1000, seed: int = 0) -> np.ndarray:
+    """生成带聚类结构的随机向量，比均匀随机向量更接近真实句向量的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    return centers[labels] + 1.5 * rng.standard_normal((size, dim)).astype(np.float32)
+
+
+def bench_ann(size: int, nprobes: List[int], top_k: int = 10, queries: int = 200):
+    """对比 IVF 近似搜索与精确搜索的 recall@k 与延迟"""
+    vectors = _clustered_vectors(size + queries)
+    base, query_vectors = vectors[:size], vectors[size:]
+    ids = [str(i) for i in range(size)]
+
+    index = VectorIndex(InMemoryVectorStore(), ann=IVFIndex(min_train_size=size))
+    train_start = time.perf_counter()
+    index.add_batch(ids, base, [PrivacyLevel.LEVEL_1_PUBLIC.value] * size)
+    index.wait_for_ann()
+    print(f"IVF 训练: nlist={index.ann.nlist}, 耗时 {time.perf_counter() - train_start:.2f}s")
+
+    exact = [{memory_id for memory_id, _ in index.search(q, top_k, exact=True)} for q in query_vectors]
+    exact_ms = _time_call(lambda: [index.search(q, top_k, exact=True) for q in query_vectors], 1) / queries
+
+    print(f"{'nprobe':>8} {'recall@' + str(top_k):>10} {'latency (ms)':>13} {'speedup':>9}")
+    print(f"{'exact':>8} {1.0:>10.3f} {exact_ms:>13.3f} {1.0:>8.1f}x")
+    for nprobe in nprobes:
+        hits = 0
+        start = time.perf_counter()
+        for q, truth in zip(query_vectors, exact):
+            found = {memory_id for memory_id, _ in index.search(q, top_k, nprobe=nprobe)}
+            hits += len(found & truth)
+        ann_ms = (time.perf_counter() - start) * 1000 / queries
+        recall = hits / (top_k * queries)
+        print(f"{nprobe:>8} {recall:>10.3f} {ann_ms:>13.3f} {exact_ms / ann_ms:>8.1f}x")
+
+
+def bench_quant(size: int, top_k: int = 10, queries: int = 200, rescore_factors: List[int] = (1, 2, 4, 8)):
+    """对比 float16 / int8 量化粗排 + float32 重打分与全精度搜索的内存占用、recall@k 与延迟"""
+    vectors = _clustered_vectors(size + queries)
+    base, query_vectors = vectors[:size], vectors[size:]
+    ids = [str(i) for i in range(size)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = EmbeddingStore(os.path.join(tmpdir, "bench.f32"), fsync=False)
+        rows = np.arange(store.append(normalize_rows(base)), size)
+        exact_index = VectorIndex(store)
+        exact_index.attach_batch(ids, rows, [PrivacyLevel.LEVEL_1_PUBLIC.value] * size)
+        exact = [{memory_id for memory_id, _ in exact_index.search(q, top_k)} for q in query_vectors]
+        exact_ms = _time_call(lambda: [exact_index.search(q, top_k) for q in query_vectors], 1) / queries
+
+        print(f"{'precision':>10} {'rescore':>8} {'RAM (MB)':>9} {'recall@' + str(top_k):>10} {'latency (ms)':>13}")
+        print(f"{'float32':>10} {'-':>8} {size * base.shape[1] * 4 / 2**20:>9.1f} {1.0:>10.3f} {exact_ms:>13.3f}")
+        for precision in ("float16", "int8"):
+            index = VectorIndex(store, precision=precision)
+            index.attach_batch(ids, rows, [PrivacyLevel.LEVEL_1_PUBLIC.value] * size)
+            for factor in rescore_factors:
+                index.rescore_factor = factor
+                hits = 0
+                start = time.perf_counter()
+                for q, truth in zip(query_vectors, exact):
+                    hits += len({memory_id for memory_id, _ in index.search(q, top_k)} & truth)
+                latency = (time.perf_counter() - start) * 1000 / queries
+                print(f"{precision:>10} {factor:>8} {index.quantized.nbytes / 2**20:>9.1f} "
+                      f"{hits / (top_k * queries):>10.3f} {latency:>13.3f}")
+        store.close()
+
+
+def _rss_mb() -> float:
+    """当前进程的常驻内存 (MB)，读取不到 /proc 时退化为峰值 RSS"""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _sample_sentences(count: int) -> List[str]:
+    """生成长度不一的中英文测试句子"""
+    rng = np.random.default_rng(0)
+    words = ["用户", "喜欢", "喝咖啡", "周末", "跑步", "python", "深色主题", "音乐", "会议", "项目进度"]
+    return [" ".join(rng.choice(words, size=int(rng.integers(4, 24)))) for _ in range(count)]
+
+
+def encoder_worker(backend: str, onnx_model: str, count: int, batch_size: int, threads: int):
+    """在当前进程中加载一个后端并测量，结果以 JSON 打印到标准输出"""
+    baseline = _rss_mb()
+    start = time.perf_counter()
+    encoder = load_encoder(backend, LocalStorageService.MODEL_NAME, onnx_model, batch_size, threads or None)
+    load_seconds = time.perf_counter() - start
+    texts = _sample_sentences(count)
+    encoder.encode(texts[:batch_size])  # 预热
+    start = time.perf_counter()
+    for begin in range(0, count, batch_size):
+        encoder.encode(texts[begin:begin + batch_size])
+    encode_seconds = time.perf_counter() - start
+    print(json.dumps({
+        "load_s": load_seconds,
+        "texts_per_s": count / encode_seconds,
+        "rss_mb": _rss_mb(),
+        "rss_delta_mb": _rss_mb() - baseline,
+    }))
+
+
+def bench_encoder(backends: List[str], onnx_model: str, count: int, batch_sizes: List[int], threads: int):
+    """每个后端 / 批大小组合在独立子进程中测量，避免模型和运行时相互影响 RSS"""
+    print(f"{'backend':>8} {'batch':>6} {'load (s)':>9} {'texts/s':>9} {'RSS (MB)':>9} {'model RSS (MB)':>15}")
+    for backend in backends:
+        for batch_size in batch_sizes:
+            command = [sys.executable, "-m", "storage.benchmark", "encoder-worker", "--backend", backend,
+                       "--count", str(count), "--batch-size", str(batch_size), "--threads", str(threads)]
+            if onnx_model:
+                command += ["--onnx-model", onnx_model]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "unknown error"
+                print(f"{backend:>8} {batch_size:>6} 失败: {error}")
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            print(f"{backend:>8} {batch_size:>6} {result['load_s']:>9.2f} {result['texts_per_s']:>9.1f} "
+                  f"{result['rss_mb']:>9.1f} {result['rss_delta_mb']:>15.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地存储性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    search_parser = subparsers.add_parser("search", help="查询延迟：旧实现 vs 常驻向量索引")
+    search_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    search_parser.add_argument("--top-k", type=int, default=5)
+    search_parser.add_argument("--repeat", type=int, default=20)
+
+    alloc_parser = subparsers.add_parser("alloc", help="单次查询的内存分配与延迟：逐条构造结果 vs top_k 选择")
+    alloc_parser.add_argument("--size", type=int, default=100000)
+    alloc_parser.add_argument("--top-k", type=int, default=5)
+    alloc_parser.add_argument("--repeat", type=int, default=20)
+
+    ingest_parser = subparsers.add_parser("ingest", help="逐条写入：整文件重写 vs 追加写日志")
+    ingest_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500])
+
+    ann_parser = subparsers.add_parser("ann", help="IVF 近似搜索 recall@k 与延迟")
+    ann_parser.add_argument("--size", type=int, default=100000)
+    ann_parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    ann_parser.add_argument("--top-k", type=int, default=10)
+
+    quant_parser = subparsers.add_parser("quant", help="量化粗排 + 重打分的内存占用与 recall@k")
+    quant_parser.add_argument("--size", type=int, default=100000)
+    quant_parser.add_argument("--top-k", type=int, default=10)
+
+    concurrency_parser = subparsers.add_parser("concurrency", help="并发检索：同步 search vs search_async")
+    concurrency_parser.add_argument("--clients", type=int, default=50)
+    concurrency_parser.add_argument("--latency-ms", type=float, default=200.0)
+    concurrency_parser.add_argument("--max-concurrency", type=int, default=16)
+
+    encoder_parser = subparsers.add_parser("encoder", help="编码器后端：PyTorch vs ONNX 的吞吐与内存")
+    encoder_parser.add_argument("--backends", nargs="+", default=["torch", "onnx"])
+    encoder_parser.add_argument("--onnx-model", default=os.getenv("LOCAL_ONNX_MODEL_PATH", ""))
+    encoder_parser.add_argument("--count", type=int, default=512)
+    encoder_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32])
+    encoder_parser.add_argument("--threads", type=int, default=0, help="推理线程数，0 表示运行时默认")
+
+    worker_parser = subparsers.add_parser("encoder-worker")
+    worker_parser.add_argument("--backend", required=True)
+    worker_parser.add_argument("--onnx-model", default="")
+    worker_parser.add_argument("--count", type=int, default=512)
+    worker_parser.add_argument("--batch-size", type=int, default=32)
+    worker_parser.add_argument("--threads", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "search":
+        bench_search(args.sizes, args.top_k, args.repeat)
+    elif args.command == "alloc":
+        bench_alloc(args.size, args.top_k, args.repeat)
+    elif args.command == "ingest":
+        bench_ingest(args.sizes)
+    elif args.command == "ann":
+        bench_ann(args.size, args.nprobe, args.top_k)
+    elif args.command == "quant":
+        bench_quant(args.size, args.top_k)
+    elif args.command == "concurrency":
+        bench_concurrency(args.clients, args.latency_ms, args.max_concurrency)
+    elif args.command == "encoder":
+        bench_encoder(args.backends, args.onnx_model, args.count, args.batch_sizes, args.threads)
+    elif args.command == "encoder-worker":
+        encoder_worker(args.backend, args.onnx_model, args.count, args.batch_size, args.threads)
+
+
+if __name__ == "__main__":
+    main()
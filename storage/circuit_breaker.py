@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+熔断器
+包装对远端服务（Mem0）的调用：最近一段调用的失败率超过阈值时熔断 (open)，请求直接走降级路径；
+熔断期间后台线程定期探活，探活成功即恢复 (closed)；熔断超时后放行少量试探请求 (half-open)，
+试探成功恢复、失败重新熔断。单次偶发失败不会让进程永久停留在降级路径上。
+"""
+
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开（或半开试探名额已满）时拒绝调用"""
+
+
+class CircuitBreaker:
+    """closed / open / half-open 三态熔断器（线程安全）"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str = "mem0", window_size: int = 20, failure_rate_threshold: float = 0.5,
+                 min_calls: int = 5, open_timeout: float = 30.0, half_open_max_calls: int = 1,
+                 probe: Optional[Callable[[], Any]] = None, probe_interval: float = 10.0,
+                 on_state_change: Optional[Callable[[str, str], None]] = None,
+                 is_failure: Optional[Callable[[Exception], bool]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """初始化
+
+        参数:
+            name: 熔断器名称（用于日志）
+            window_size: 统计失败率的最近调用数
+            failure_rate_threshold: 窗口内失败率达到该值时熔断
+            min_calls: 窗口内调用数不足该值时不熔断
+            open_timeout: 熔断后经过该秒数进入半开状态，放行试探请求
+            half_open_max_calls: 半开状态下同时放行的试探请求数
+            probe: 可选的探活函数，熔断期间在后台线程中每 probe_interval 秒调用一次，不抛异常即视为恢复
+            probe_interval: 探活间隔秒数
+            on_state_change: 可选的状态转换回调 (旧状态, 新状态)，在持有锁时调用，不得阻塞或回调熔断器
+            is_failure: 可选的异常分类函数，返回 False 的异常（例如 404 等客户端错误）说明远端可用，
+                        记为成功并原样抛出；为空时所有异常都计为失败
+            clock: 单调时钟（测试时可替换）
+        """
+        self.name = name
+        self.window_size = window_size
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = min_calls
+        self.open_timeout = open_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.on_state_change = on_state_change
+        self.is_failure = is_failure
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._window: Deque[bool] = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._state_since = clock()
+        self._half_open_in_flight = 0
+        self._transitions: Counter = Counter()
+        self._counts: Counter = Counter()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def state(self) -> str:
+        """当前状态（熔断超时后惰性转为半开）"""
+        with self._lock:
+            self._expire_open()
+            return self._state
+
+    def _expire_open(self):
+        """熔断超时则转为半开（需持有锁）"""
+        if self._state == self.OPEN and self.clock() - self._opened_at >= self.open_timeout:
+            self._transition(self.HALF_OPEN)
+
+    def _transition(self, state: str):
+        """切换状态并记录转换（需持有锁）"""
+        if state == self._state:
+            return
+        self._transitions[f"{self._state}->{state}"] += 1
+        print(f"{self.name} 熔断器: {self._state} -> {state}")
+        previous, self._state = self._state, state
+        self._state_since = self.clock()
+        self._half_open_in_flight = 0
+        if state == self.OPEN:
+            self._opened_at = self._state_since
+            self._start_probe()
+        elif state == self.CLOSED:
+            self._window.clear()
+        if self.on_state_change is not None:
+            try:
+                self.on_state_change(previous, state)
+            except Exception as e:
+                print(f"{self.name} 熔断器状态回调失败: {e}")
+
+    def allow_request(self) -> bool:
+        """是否放行一次调用；半开状态下占用一个试探名额，调用方须随后调用 record_success / record_failure
+
+        返回:
+            bool: 放行时为 True
+        """
+        with self._lock:
+            self._expire_open()
+            if self._state == self.CLOSED:
+                allowed = True
+            elif self._state == self.HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                allowed = True
+            else:
+                allowed = False
+            self._counts["allowed" if allowed else "rejected"] += 1
+            return allowed
+
+    def record_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            self._counts["successes"] += 1
+            if self._state == self.HALF_OPEN:
+                self._transition(self.CLOSED)
+            elif self._state == self.CLOSED:
+                self._window.append(True)
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        with self._lock:
+            self._counts["failures"] += 1
+            if self._state == self.HALF_OPEN:
+                self._transition(self.OPEN)
+            elif self._state == self.CLOSED:
+                self._window.append(False)
+                if len(self._window) >= self.min_calls and self._failure_rate() >= self.failure_rate_threshold:
+                    self._transition(self.OPEN)
+
+    def _failure_rate(self) -> float:
+        """窗口内的失败率（需持有锁）"""
+        if not self._window:
+            return 0.0
+        return self._window.count(False) / len(self._window)
+
+    def call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """经熔断器执行一次调用
+
+        参数:
+            fn: 被保护的调用
+            *args, **kwargs: 传给 fn 的参数
+
+        返回:
+            fn 的返回值
+
+        异常:
+            CircuitOpenError: 熔断器拒绝调用；fn 自身抛出的异常在记录结果后原样抛出
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(f"{self.name} 熔断器已打开")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure is None or self.is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def force_open(self):
+        """手动熔断（例如运维切换到降级路径），之后仍按探活和超时自动恢复"""
+        with self._lock:
+            self._transition(self.OPEN)
+
+    def reset(self):
+        """手动恢复到闭合状态并清空统计窗口"""
+        with self._lock:
+            self._transition(self.CLOSED)
+            self._window.clear()
+
+    def _start_probe(self):
+        """熔断时启动后台探活线程（需持有锁）"""
+        if self.probe is None or (self._probe_thread is not None and self._probe_thread.is_alive()):
+            return
+        self._probe_thread = threading.Thread(target=self._run_probe, name=f"{self.name}-health-probe",
+                                              daemon=True)
+        self._probe_thread.start()
+
+    def _run_probe(self):
+        """熔断（或半开）期间定期探活，成功则恢复闭合"""
+        while not self._stop.wait(self.probe_interval):
+            if self.state == self.CLOSED:
+                return
+            try:
+                self.probe()
+            except Exception as e:
+                with self._lock:
+                    self._counts["probe_failures"] += 1
+                    if self._state == self.OPEN:
+                        # 探活失败说明仍不可用，重新计算熔断超时
+                        self._opened_at = self.clock()
+                print(f"{self.name} 探活失败: {e}")
+                continue
+            with self._lock:
+                self._counts["probe_successes"] += 1
+                self._transition(self.CLOSED)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        """返回状态与转换计数
+
+        返回:
+            Dict: state、进入当前状态的秒数、窗口调用数与失败率、各类调用计数和状态转换计数
+        """
+        with self._lock:
+            self._expire_open()
+            return {
+                "state": self._state,
+                "state_seconds": self.clock() - self._state_since,
+                "window_calls": len(self._window),
+                "failure_rate": self._failure_rate(),
+                "allowed": self._counts["allowed"],
+                "rejected": self._counts["rejected"],
+                "successes": self._counts["successes"],
+                "failures": self._counts["failures"],
+                "probe_successes": self._counts["probe_successes"],
+                "probe_failures": self._counts["probe_failures"],
+                "transitions": dict(self._transitions),
+            }
+
+    def close(self):
+        """停止后台探活线程"""
+        self._stop.set()
+        thread = self._probe_thread
+        if thread is not None:
+            thread.join()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量缓存
+以"模型名 + 归一化文本"的哈希为键缓存编码结果：内存中为有界 LRU，
+可选的磁盘层 (SQLite) 在进程重启后继续命中。记忆写入和查询共用同一缓存。
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """归一化文本：NFKC 规范化、去除首尾空白并合并连续空白"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(model_name: str, text: str) -> str:
+    """计算缓存键
+
+    参数:
+        model_name: 编码模型名称
+        text: 原始文本
+
+    返回:
+        str: sha256 十六进制摘要
+    """
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """有界 LRU 向量缓存，带可选的 SQLite 磁盘层"""
+
+    def __init__(self, max_entries: int = 10000, disk_path: Optional[str] = None):
+        """初始化缓存
+
+        参数:
+            max_entries: 内存中最多缓存的向量数
+            disk_path: 磁盘层 SQLite 文件路径，为空时不启用磁盘层
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """查找缓存，先查内存再查磁盘，磁盘命中会提升到内存
+
+        参数:
+            key: 缓存键
+
+        返回:
+            Optional[np.ndarray]: 缓存的向量，未命中时为 None
+        """
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+            if self._disk is not None:
+                row = self._disk.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._put_memory(key, vector)
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        """写入若干向量（内存层和磁盘层）
+
+        参数:
+            items: 缓存键 -> 向量
+        """
+        with self._lock:
+            for key, vector in items.items():
+                self._put_memory(key, np.asarray(vector, dtype=np.float32))
+            if self._disk is not None and items:
+                self._disk.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+                )
+
+    def _put_memory(self, key: str, vector: np.ndarray):
+        """写入内存层并按 LRU 淘汰（需持有锁）"""
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中/未命中计数"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        """关闭磁盘层"""
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
+
+
+class CachedEncoder:
+    """带向量缓存的编码器包装：只把未命中的文本交给底层编码器，一次批量编码"""
+
+    def __init__(self, encoder: Any, cache: EmbeddingCache, model_name: str):
+        """初始化
+
+        参数:
+            encoder: 底层编码器（需提供 encode 方法）
+            cache: 向量缓存
+            model_name: 模型名称，参与缓存键计算
+        """
+        self.encoder = encoder
+        self.cache = cache
+        self.model_name = model_name
+
+    def __getattr__(self, name: str) -> Any:
+        # 其余属性透传给底层编码器
+        return getattr(self.encoder, name)
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """编码文本，优先使用缓存
+
+        参数:
+            texts: 文本列表
+            **kwargs: 透传给底层编码器的参数
+
+        返回:
+            np.ndarray: 形状为 (len(texts), dim) 的向量
+        """
+        keys = [cache_key(self.model_name, text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [self.cache.get(key) for key in keys]
+
+        missing: Dict[str, int] = {}
+        for i, vector in enumerate(vectors):
+            if vector is None and keys[i] not in missing:
+                missing[keys[i]] = i
+        if missing:
+            encoded = np.asarray(
+                self.encoder.encode([texts[i] for i in missing.values()], **kwargs), dtype=np.float32
+            )
+            fresh = dict(zip(missing.keys(), encoded))
+            self.cache.put_many(fresh)
+            vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+
+        return np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
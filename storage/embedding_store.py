@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量存储
+按行存放预归一化的 float32 向量：内存版用于测试和临时索引，
+文件版是定长步长的二进制文件，通过 np.memmap 只读映射，多进程可共享同一份页缓存。
+"""
+
+import os
+import struct
+from typing import Optional
+
+import numpy as np
+
+
+class InMemoryVectorStore:
+    """常驻内存、按倍数扩容的向量存储"""
+
+    def __init__(self, dim: Optional[int] = None, capacity: int = 1024):
+        """初始化内存向量存储
+
+        参数:
+            dim: 向量维度，为 None 时在第一次追加时确定
+            capacity: 初始预分配的行数
+        """
+        self.dim = dim
+        self._capacity = max(1, capacity)
+        self._size = 0
+        self._matrix: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """当前全部行组成的 (n, dim) 矩阵视图"""
+        if self._matrix is None:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    def append(self, vectors: np.ndarray) -> int:
+        """追加若干行向量
+
+        参数:
+            vectors: 形状为 (n, dim) 的 float32 向量
+
+        返回:
+            int: 第一行的行号
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: 期望 {self.dim}, 实际 {vectors.shape[1]}")
+
+        required = self._size + len(vectors)
+        if self._matrix is None or required > self._capacity:
+            capacity = self._capacity
+            while capacity < required:
+                capacity *= 2
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            if self._matrix is not None:
+                matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+            self._capacity = capacity
+
+        start = self._size
+        self._matrix[start:required] = vectors
+        self._size = required
+        return start
+
+    def close(self):
+        """内存存储无需释放资源"""
+
+
+class EmbeddingStore:
+    """定长步长的 float32 向量文件
+
+    文件格式: 16 字节头 (8 字节魔数 + uint32 维度 + 4 字节保留) 后紧跟按行排列的 float32 向量。
+    追加写入后 fsync；读取通过只读 np.memmap 完成，行数变化时惰性重新映射。
+    """
+
+    MAGIC = b"ADCEMB01"
+    HEADER_SIZE = 16
+
+    def __init__(self, path: str, dim: Optional[int] = None, fsync: bool = True):
+        """打开（或创建）向量文件
+
+        参数:
+            path: 向量文件路径
+            dim: 向量维度，文件已存在时以文件头为准
+            fsync: 每次追加后是否 fsync
+        """
+        self.path = path
+        self.dim = dim
+        self.fsync = fsync
+        self._size = 0
+        self._file = None
+        self._mmap: Optional[np.ndarray] = None
+
+        if os.path.exists(path) and os.path.getsize(path) >= self.HEADER_SIZE:
+            with open(path, 'rb') as f:
+                header = f.read(self.HEADER_SIZE)
+            if header[:8] != self.MAGIC:
+                raise ValueError(f"不是有效的向量文件: {path}")
+            file_dim = struct.unpack("<I", header[8:12])[0]
+            if dim is not None and dim != file_dim:
+                raise ValueError(f"向量维度不匹配: 文件为 {file_dim}, 期望 {dim}")
+            self.dim = file_dim
+            self._recover()
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * 4
+
+    def _recover(self):
+        """丢弃末尾不完整的行（写入时崩溃留下的半行）"""
+        body = os.path.getsize(self.path) - self.HEADER_SIZE
+        self._size = body // self.row_bytes
+        if body % self.row_bytes:
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.HEADER_SIZE + self._size * self.row_bytes)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """当前全部行组成的只读 (n, dim) memmap 视图"""
+        if self._size == 0:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        if self._mmap is None or self._mmap.shape[0] != self._size:
+            self._mmap = np.memmap(self.path, dtype=np.float32, mode='r',
+                                   offset=self.HEADER_SIZE, shape=(self._size, self.dim))
+        return self._mmap
+
+    def _open(self):
+        if self._file is None:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) < self.HEADER_SIZE
+            self._file = open(self.path, 'ab')
+            if new_file:
+                self._file.truncate(0)
+                self._file.write(self.MAGIC + struct.pack("<II", self.dim, 0))
+
+    def append(self, vectors: np.ndarray) -> int:
+        """追加若干行向量并落盘
+
+        参数:
+            vectors: 形状为 (n, dim) 的 float32 向量
+
+        返回:
+            int: 第一行的行号
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: 期望 {self.dim}, 实际 {vectors.shape[1]}")
+
+        self._open()
+        self._file.write(vectors.tobytes())
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        start = self._size
+        self._size += len(vectors)
+        return start
+
+    def sync(self):
+        """把已追加的行 fsync 到磁盘（用于关闭逐次 fsync 的批量写入之后）"""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close_writer(self):
+        """只关闭追加写句柄，保留只读映射（压缩替换后仍在进行的搜索可以继续读取）"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """关闭文件并释放映射"""
+        self._mmap = None
+        self.close_writer()
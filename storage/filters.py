@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+记忆元数据过滤条件
+兼容 Mem0 风格的过滤字典，例如:
+    {"privacy_level": {"lte": 2}, "timestamp": {"gt": "2025-07-23T00:00:00"}}
+同一份条件既可以在内存中逐条判断，也可以翻译成 SQL WHERE 子句下推到 SQLite。
+"""
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from schemas.common import Metadata
+
+# 可过滤的字段 -> 在记忆条目中的取值路径
+FILTER_FIELDS = {
+    "privacy_level": ("metadata", "privacy_level"),
+    "source": ("metadata", "source"),
+    "blockchain_data_id": ("metadata", "blockchain_data_id"),
+    "timestamp": ("timestamp",),
+    "user_id": ("user_id",),
+}
+
+SQL_OPERATORS = {
+    "eq": "=",
+    "ne": "!=",
+    "gt": ">",
+    "gte": ">=",
+    "lt": "<",
+    "lte": "<=",
+}
+
+Condition = Tuple[str, str, Any]
+
+
+def normalize_filter(metadata_filter: Optional[Union[Metadata, Dict[str, Any]]]) -> List[Condition]:
+    """把 Metadata 对象或过滤字典统一转换为 (字段, 操作符, 值) 条件列表
+
+    Metadata 对象沿用旧语义：只按隐私级别相等过滤。
+
+    参数:
+        metadata_filter: Metadata 对象、过滤字典或 None
+
+    返回:
+        List[Condition]: 条件列表，空列表表示不过滤
+    """
+    if metadata_filter is None:
+        return []
+    if isinstance(metadata_filter, Metadata):
+        return [("privacy_level", "eq", metadata_filter.privacy_level.value)]
+
+    conditions: List[Condition] = []
+    for field, spec in metadata_filter.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"不支持的过滤字段: {field}")
+        if not isinstance(spec, dict):
+            spec = {"eq": spec}
+        for op, value in spec.items():
+            if op not in SQL_OPERATORS and op != "in":
+                raise ValueError(f"不支持的过滤操作符: {op}")
+            conditions.append((field, op, _normalize_value(field, value)))
+    return conditions
+
+
+def _normalize_value(field: str, value: Any) -> Any:
+    """将枚举等取值转换为存储中的原始类型"""
+    if isinstance(value, (list, tuple, set)):
+        return [_normalize_value(field, item) for item in value]
+    if hasattr(value, "value"):
+        return value.value
+    return value
+
+
+def _get_field(memory: Dict[str, Any], field: str) -> Any:
+    value: Any = memory
+    for key in FILTER_FIELDS[field]:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def matches(memory: Dict[str, Any], conditions: List[Condition]) -> bool:
+    """判断一条记忆是否满足全部条件
+
+    参数:
+        memory: 记忆条目
+        conditions: normalize_filter 返回的条件列表
+
+    返回:
+        bool: 是否满足
+    """
+    for field, op, value in conditions:
+        actual = _get_field(memory, field)
+        if op == "in":
+            if actual not in value:
+                return False
+            continue
+        if op == "eq":
+            ok = actual == value
+        elif op == "ne":
+            ok = actual != value
+        elif actual is None:
+            ok = False
+        elif op == "gt":
+            ok = actual > value
+        elif op == "gte":
+            ok = actual >= value
+        elif op == "lt":
+            ok = actual < value
+        else:
+            ok = actual <= value
+        if not ok:
+            return False
+    return True
+
+
+def to_sql(conditions: List[Condition]) -> Tuple[str, List[Any]]:
+    """把条件列表翻译为参数化的 SQL WHERE 子句（列名与字段名一致）
+
+    参数:
+        conditions: normalize_filter 返回的条件列表
+
+    返回:
+        Tuple[str, List]: (WHERE 子句（不含 WHERE 关键字，无条件时为 "1"）, 参数列表)
+    """
+    clauses: List[str] = []
+    params: List[Any] = []
+    for field, op, value in conditions:
+        if op == "in":
+            if not value:
+                clauses.append("0")
+                continue
+            clauses.append(f"{field} IN ({', '.join('?' * len(value))})")
+            params.extend(value)
+        elif op == "ne":
+            clauses.append(f"{field} IS NOT ?")
+            params.append(value)
+        else:
+            clauses.append(f"{field} {SQL_OPERATORS[op]} ?")
+            params.append(value)
+    return (" AND ".join(clauses) or "1"), params
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索结果融合
+把向量检索和关键词检索各自的排序合并为一个排序，用于混合检索。
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+FUSION_METHODS = ("rrf", "weighted")
+
+Ranking = List[Tuple[str, float]]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Ranking], k: int = 60) -> Ranking:
+    """倒数排名融合 (RRF)：score(d) = Σ 1 / (k + rank(d))
+
+    只依赖名次，不要求各路分数可比。返回的分数除以理论最大值 len(rankings) / (k + 1)，
+    落在 (0, 1] 区间：在每一路中都排第一的文档得 1.0。
+
+    参数:
+        rankings: 各路检索结果，每路为按分数降序的 (文档ID, 分数) 列表
+        k: 平滑常数，越大名次靠后的文档权重衰减越慢
+
+    返回:
+        Ranking: 按融合分数降序的 (文档ID, 融合分数) 列表
+    """
+    if not rankings:
+        return []
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    best = len(rankings) / (k + 1)
+    return sorted(((doc_id, score / best) for doc_id, score in fused.items()),
+                  key=lambda item: item[1], reverse=True)
+
+
+def weighted_fusion(rankings: Sequence[Ranking], weights: Sequence[float]) -> Ranking:
+    """加权分数融合：score(d) = Σ w_i * score_i(d)，未出现在某一路中的文档该路记 0 分
+
+    要求各路分数处于相同量级（余弦相似度与归一化的 BM25 分数均在 [0, 1] 附近）。
+
+    参数:
+        rankings: 各路检索结果
+        weights: 与 rankings 一一对应的权重
+
+    返回:
+        Ranking: 按融合分数降序的 (文档ID, 融合分数) 列表
+    """
+    if len(weights) != len(rankings):
+        raise ValueError("weights 与 rankings 数量不一致")
+    fused: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for doc_id, score in ranking:
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight * max(float(score), 0.0)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+追加写的记忆日志 (JSONL)
+每次写入只追加一行记录，删除以墓碑记录表示，启动时回放日志重建内存状态，
+并在后台定期压缩日志以回收被删除/覆盖的记录。
+"""
+
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+
+class MemoryJournal:
+    """追加写的记忆日志
+
+    记录格式（每行一个 JSON 对象）:
+        {"op": "add", "memory": {...}}     新增或覆盖一条记忆
+        {"op": "delete", "id": "..."}      删除（墓碑）
+        {"op": "meta", "meta": {...}}      存储级元数据（例如当前向量文件名），压缩时写在文件开头，
+                                           save_meta 追加的元数据记录覆盖此前的元数据
+
+    写入时 flush 并可选 fsync，保证进程崩溃后已确认的写入不会丢失；
+    回放时遇到末尾被截断的半行会将其丢弃并截断文件。
+    """
+
+    def __init__(self, path: str, fsync: bool = True,
+                 compact_min_records: int = 1000, compact_ratio: float = 2.0):
+        """初始化日志
+
+        参数:
+            path: 日志文件路径
+            fsync: 每次写入后是否调用 fsync
+            compact_min_records: 日志记录数低于该值时不压缩
+            compact_ratio: 日志记录数超过存活记忆数的该倍数时触发压缩
+        """
+        self.path = path
+        self.fsync = fsync
+        self.compact_min_records = compact_min_records
+        self.compact_ratio = compact_ratio
+
+        self._lock = threading.Lock()
+        # 串行化压缩；调用方可在外部持有它，使"更新内存状态 + 压缩"对后台压缩原子
+        self.compaction_lock = threading.RLock()
+        self.meta: Dict[str, Any] = {}
+        self._meta_saves = 0
+        self._file = None
+        self._records = 0
+        self._compacting = False
+        self._compaction_thread: Optional[threading.Thread] = None
+
+    @property
+    def record_count(self) -> int:
+        """日志中的记录条数（包含已被覆盖或删除的记录）"""
+        return self._records
+
+    def replay(self) -> Dict[str, Dict[str, Any]]:
+        """回放日志，重建存活的记忆
+
+        返回:
+            Dict[str, Dict]: 按写入顺序排列的 记忆ID -> 记忆条目
+        """
+        memories: Dict[str, Dict[str, Any]] = {}
+        self.meta = {}
+        records = 0
+        valid_offset = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # 末尾半行：上次写入时崩溃，丢弃
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        print(f"日志记录损坏，停止回放: {self.path} @ {valid_offset}")
+                        break
+                    if record.get("op") == "meta":
+                        self.meta = record["meta"]
+                    else:
+                        self._apply(memories, record)
+                    records += 1
+                    valid_offset += len(line)
+            if valid_offset < os.path.getsize(self.path):
+                with open(self.path, 'r+b') as f:
+                    f.truncate(valid_offset)
+
+        with self._lock:
+            self._records = records
+            self._open()
+        return memories
+
+    @staticmethod
+    def _apply(memories: Dict[str, Dict[str, Any]], record: Dict[str, Any]):
+        """将一条日志记录应用到内存状态"""
+        op = record.get("op")
+        if op == "add":
+            memory = record["memory"]
+            memories.pop(memory["id"], None)
+            memories[memory["id"]] = memory
+        elif op == "delete":
+            memories.pop(record["id"], None)
+
+    def _open(self):
+        """以追加模式打开日志文件（需持有锁）"""
+        if self._file is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'ab')
+
+    def _write(self, records: List[Dict[str, Any]]):
+        """追加写入若干记录并落盘"""
+        payload = b"".join(
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            for record in records
+        )
+        with self._lock:
+            self._open()
+            self._file.write(payload)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._records += len(records)
+
+    def append_add(self, memory: Dict[str, Any]):
+        """追加一条新增记录
+
+        参数:
+            memory: 记忆条目
+        """
+        self._write([{"op": "add", "memory": memory}])
+
+    def add_many(self, memories: List[Dict[str, Any]]):
+        """一次写入并落盘多条新增记录
+
+        参数:
+            memories: 记忆条目列表
+        """
+        if memories:
+            self._write([{"op": "add", "memory": memory} for memory in memories])
+
+    def save_meta(self, meta: Dict[str, Any]):
+        """追加一条元数据记录，回放时后出现的元数据覆盖之前的
+
+        参数:
+            meta: 新的存储级元数据
+        """
+        self._write([{"op": "meta", "meta": meta}])
+        with self._lock:
+            self.meta = meta
+            self._meta_saves += 1
+
+    def append_delete(self, memory_id: str):
+        """追加一条删除（墓碑）记录
+
+        参数:
+            memory_id: 记忆ID
+        """
+        self._write([{"op": "delete", "id": memory_id}])
+
+    def needs_compaction(self, live_count: int) -> bool:
+        """判断日志是否需要压缩
+
+        参数:
+            live_count: 当前存活的记忆数
+        """
+        return (self._records >= self.compact_min_records
+                and self._records > live_count * self.compact_ratio)
+
+    def maybe_compact(self, live_count: int, snapshot: Callable[[], List[Dict[str, Any]]]):
+        """在需要时于后台线程中压缩日志
+
+        参数:
+            live_count: 当前存活的记忆数
+            snapshot: 返回当前全部存活记忆的回调（调用方负责线程安全）
+        """
+        if self._compacting or not self.needs_compaction(live_count):
+            return
+        self._compacting = True
+        self._compaction_thread = threading.Thread(
+            target=self._compact_in_background, args=(snapshot,), daemon=True
+        )
+        self._compaction_thread.start()
+
+    def _compact_in_background(self, snapshot: Callable[[], List[Dict[str, Any]]]):
+        try:
+            self.compact(snapshot)
+        except Exception as e:
+            print(f"日志压缩失败: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self, snapshot: Callable[[], List[Dict[str, Any]]], meta: Optional[Dict[str, Any]] = None):
+        """压缩日志：把存活记忆写入新文件后原子替换旧日志
+
+        快照写出期间不持有锁，写入仍可继续追加到旧日志；
+        替换前再把快照之后追加的记录拷贝到新文件末尾。
+
+        调用方必须先更新内存状态再追加日志，这样快照之前写入的记录都已反映在快照中，
+        快照之后的记录则由尾部拷贝补齐（重复的新增/删除在回放时是幂等的）。
+
+        参数:
+            snapshot: 返回当前全部存活记忆的回调
+            meta: 新的存储级元数据，为空时沿用当前元数据；随替换一起原子生效
+        """
+        with self.compaction_lock:
+            self._compact(snapshot, self.meta if meta is None else meta)
+
+    def _compact(self, snapshot: Callable[[], List[Dict[str, Any]]], meta: Dict[str, Any]):
+        with self._lock:
+            self._open()
+            self._file.flush()
+            offset = self._file.tell()
+            memories = snapshot()
+            meta_saves = self._meta_saves
+
+        tmp_path = self.path + ".compact"
+        with open(tmp_path, 'wb') as out:
+            if meta:
+                out.write(json.dumps({"op": "meta", "meta": meta},
+                                     ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+            for memory in memories:
+                out.write(json.dumps({"op": "add", "memory": memory},
+                                     ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+
+            with self._lock:
+                # 拷贝快照之后追加的记录
+                self._file.flush()
+                tail_records = 0
+                with open(self.path, 'rb') as src:
+                    src.seek(offset)
+                    for line in src:
+                        out.write(line)
+                        tail_records += 1
+                out.flush()
+                os.fsync(out.fileno())
+
+                self._file.close()
+                self._file = None
+                os.replace(tmp_path, self.path)
+                self._fsync_directory()
+                # 压缩期间追加的元数据记录已随尾部拷贝写入新文件，内存中保留较新的元数据
+                if self._meta_saves == meta_saves:
+                    self.meta = meta
+                self._records = len(memories) + tail_records
+                self._open()
+
+    def _fsync_directory(self):
+        """fsync 日志所在目录，保证 rename 持久化"""
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """等待后台压缩完成（主要用于测试和关闭流程）"""
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def close(self):
+        """关闭日志文件"""
+        self.wait_for_compaction()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
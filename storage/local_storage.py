@@ -5,16 +5,77 @@
 当 Mem0 API 不可用时的备选方案
 """
 
+import itertools
 import json
 import os
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from schemas.common import Metadata, RetriveResult
-from schemas.privacy import PrivacyLevel
+from typing import List, Dict, Any, Iterator, Optional, Set, Union
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from schemas.common import MemoryPage, Metadata, RetriveResult
+from schemas.privacy import PrivacyLevel
+from storage.ann_index import IVFIndex
+from storage.batching_encoder import MicroBatchingEncoder
+from storage.embedding_cache import CachedEncoder, EmbeddingCache
+from storage.embedding_store import EmbeddingStore
+from storage.filters import Condition, matches, normalize_filter
+from storage.fusion import FUSION_METHODS, reciprocal_rank_fusion, weighted_fusion
+from storage.journal import MemoryJournal
+from storage.keyword_index import BM25Index
+from storage.pagination import Cursor, decode_cursor, encode_cursor
+from storage.process_encoder import ProcessPoolEncoder
+from storage.recency import RecencyScorer, parse_timestamp
+from storage.sqlite_store import SQLiteMemoryStore
+from storage.vector_index import VectorIndex
+
+ENCODER_BACKENDS = ("torch", "onnx")
+DEDUP_MODES = ("skip", "merge", "update")
+
+
+def encoder_cache_name(backend: str, model_name: str, onnx_model_path: Optional[str] = None) -> str:
+    """编码器在向量缓存键中的名称：不同后端（尤其是量化模型）的向量不混用
+
+    参数:
+        backend: 编码器后端
+        model_name: 模型名称
+        onnx_model_path: onnx 后端的模型路径
+
+    返回:
+        str: 缓存键使用的模型名称
+    """
+    if backend == "onnx":
+        return f"{model_name}:onnx:{os.path.basename(os.path.normpath(onnx_model_path or ''))}"
+    return model_name
+
+
+def load_encoder(backend: str, model_name: str, onnx_model_path: Optional[str] = None,
+                 batch_size: int = 32, threads: Optional[int] = None) -> Any:
+    """加载句子编码器（相关依赖导入较慢，仅在需要时导入）
+
+    参数:
+        backend: "torch"（sentence_transformers + PyTorch）或 "onnx"（onnxruntime）
+        model_name: 模型名称（torch 后端使用）
+        onnx_model_path: ONNX 模型目录或文件（onnx 后端使用）
+        batch_size: onnx 后端每次推理的句子数
+        threads: CPU 推理线程数，为空时使用运行时默认值
+
+    返回:
+        编码器实例（提供 encode 方法）
+    """
+    if backend == "onnx":
+        from storage.onnx_encoder import OnnxSentenceEncoder
+        if not onnx_model_path:
+            raise ValueError("onnx 后端需要设置模型路径 (LOCAL_ONNX_MODEL_PATH)")
+        return OnnxSentenceEncoder(onnx_model_path, batch_size=batch_size, threads=threads)
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name)
+    raise ValueError(f"不支持的编码器后端: {backend}")
 
 class LocalStorageService:
     """本地存储服务
@@ -22,55 +83,595 @@ class LocalStorageService:
     使用本地文件系统和向量相似度搜索作为 Mem0 的备选方案
     """
     
-    def __init__(self, storage_path: str = "./local_memories.json"):
+    MODEL_NAME = 'all-MiniLM-L6-v2'
+    
+    def __init__(self, storage_path: str = "./local_memories.jsonl", encoder: Optional[Any] = None,
+                 fsync: bool = True, ann_index: Optional[bool] = None, ann_nprobe: Optional[int] = None,
+                 ann_min_size: Optional[int] = None, backend: Optional[str] = None,
+                 embedding_cache_size: int = 10000, embedding_cache_path: Optional[str] = None,
+                 embedding_precision: Optional[str] = None, rescore_factor: int = 4,
+                 hybrid_search: Optional[bool] = None, fusion: Optional[str] = None, hybrid_alpha: float = 0.5,
+                 hybrid_candidates: int = 4, background_encoder: bool = True,
+                 encoder_backend: Optional[str] = None, onnx_model_path: Optional[str] = None,
+                 encoder_batch_size: int = 32, encoder_threads: Optional[int] = None,
+                 micro_batch_size: Optional[int] = None, micro_batch_wait_ms: float = 2.0,
+                 encoder_processes: Optional[int] = None, vector_compact_ratio: float = 0.3,
+                 vector_compact_min_dead: int = 1000, user_id: Optional[str] = None,
+                 load_default_encoder: bool = True, recency_scoring: Optional[bool] = None,
+                 recency_weight: float = 0.2, importance_weight: float = 0.1,
+                 recency_half_life_days: Optional[float] = None, dedup_threshold: Optional[float] = None,
+                 dedup_mode: Optional[str] = None, access_flush_size: Optional[int] = None):
         """初始化本地存储服务
         
         参数:
-            storage_path: 本地存储文件路径
+            storage_path: 本地存储路径（扩展名会按后端替换），同名的旧版 .json 文件会在首次启动时自动迁移
+            encoder: 可选的编码器实例（需提供 encode 方法），为空时加载默认句子转换器
+            fsync: 每次写入后是否 fsync
+            ann_index: 是否启用 IVF 近似最近邻索引（记忆数达到 ann_min_size 后生效），
+                       为空时读取环境变量 LOCAL_ANN_INDEX，默认不启用
+            ann_nprobe: IVF 搜索时探查的倒排列表数，越大召回越高、延迟越高；
+                        为空时读取环境变量 LOCAL_ANN_NPROBE，默认 16
+            ann_min_size: 启用 IVF 索引所需的最少向量数，为空时读取环境变量 LOCAL_ANN_MIN_SIZE，默认 10000
+            backend: 记录存储后端，"jsonl"（追加写日志）或 "sqlite"（支持元数据过滤下推），
+                     为空时读取环境变量 LOCAL_STORAGE_BACKEND，默认 "jsonl"
+            embedding_cache_size: 内存向量缓存的条数上限，0 表示不缓存
+            embedding_cache_path: 向量缓存磁盘层的 SQLite 路径，为空时读取环境变量
+                                  EMBEDDING_CACHE_PATH，未设置则只使用内存缓存
+            embedding_precision: 常驻内存的打分精度，"float32"、"float16" 或 "int8"；
+                                 后两者在量化副本上粗排，再从向量文件中精确重打分；
+                                 为空时读取环境变量 LOCAL_EMBEDDING_PRECISION，默认 "float32"
+            rescore_factor: 量化粗排保留 top_k * rescore_factor 个候选用于重打分
+            hybrid_search: search 的默认检索方式，为 True 时并行执行向量检索和 BM25 关键词检索并融合；
+                           为空时读取环境变量 LOCAL_SEARCH_MODE（"vector" 或 "hybrid"），默认 "vector"
+            fusion: 混合检索的融合方式，"rrf"（倒数排名融合）或 "weighted"（加权分数融合），
+                    为空时读取环境变量 LOCAL_SEARCH_FUSION，默认 "rrf"
+            hybrid_alpha: 加权融合时向量分数的权重，关键词分数权重为 1 - hybrid_alpha
+            hybrid_candidates: 混合检索时每一路取 top_k * hybrid_candidates 个候选参与融合
+            background_encoder: 未提供 encoder 时是否在后台线程加载默认句子转换器；
+                                加载完成前 add 不计算向量、search 走 BM25 关键词检索，
+                                加载完成后为期间写入的记忆补算向量
+            encoder_backend: 默认编码器的推理后端，"torch" 或 "onnx"，为空时读取环境变量
+                             LOCAL_ENCODER_BACKEND，默认 "torch"
+            onnx_model_path: onnx 后端的模型目录或文件，为空时读取环境变量 LOCAL_ONNX_MODEL_PATH
+            encoder_batch_size: onnx 后端每次推理的句子数
+            encoder_threads: CPU 推理线程数，为空时读取环境变量 LOCAL_ENCODER_THREADS，未设置则使用运行时默认值
+            micro_batch_size: 大于 0 时启用微批编码，把并发的 encode 调用合并为最多这么多条文本的一批；
+                              为空时读取环境变量 LOCAL_ENCODER_MICRO_BATCH，默认 0（不启用）
+            micro_batch_wait_ms: 微批编码收到第一个请求后最多等待的毫秒数
+            encoder_processes: 大于 0 时在这么多个独立进程中运行默认编码器（向量经共享内存传回），
+                               编码不再与事件循环争用 GIL；为空时读取环境变量 LOCAL_ENCODER_PROCESSES，默认 0
+            vector_compact_ratio: 向量文件中已删除行的占比超过该值时触发后台压缩
+            vector_compact_min_dead: 已删除行数低于该值时不压缩向量文件
+            user_id: 本存储所属的用户，写入记忆条目的 user_id 字段，默认 DEFAULT_USER_ID
+            load_default_encoder: 未提供 encoder 时是否自行加载默认句子转换器；为 False 时
+                                  保持关键词检索，直到调用 set_encoder（多个分区共享一个编码器时使用）
+            recency_scoring: search 的默认打分方式，为 True 时向量分数按
+                             (1 - recency_weight - importance_weight) * 相似度 + recency_weight * 新鲜度
+                             + importance_weight * 访问频次 加权；只有启用时才记录访问计数（检索路径不产生写入）。
+                             为空时读取环境变量 LOCAL_RECENCY_SCORING，默认不启用
+            recency_weight: 新鲜度（按半衰期指数衰减）的权重
+            importance_weight: 访问频次（被检索返回的次数，对数归一化）的权重
+            recency_half_life_days: 新鲜度减半所需的天数，为空时读取环境变量 LOCAL_RECENCY_HALF_LIFE，默认 30
+            dedup_threshold: add 时若同一隐私级别下已有余弦相似度不低于该值的记忆，视为近似重复；
+                             为空时读取环境变量 LOCAL_DEDUP_THRESHOLD，未设置则不去重
+            dedup_mode: 近似重复的处理方式，"skip"（不写入）、"merge"（保留原记忆，刷新时间并累加重复次数）
+                        或 "update"（用新内容原地覆盖原记忆，ID 不变）；为空时读取环境变量 LOCAL_DEDUP_MODE，默认 "skip"
+            access_flush_size: 访问计数有变化的记忆累积到该条数时批量写入记录存储（关闭时写入剩余部分）；
+                               为空时读取环境变量 LOCAL_ACCESS_FLUSH_SIZE，默认 64
         """
-        self.storage_path = storage_path
+        base_path = os.path.splitext(storage_path)[0]
+        self.backend = backend or os.getenv("LOCAL_STORAGE_BACKEND", "jsonl")
+        if self.backend not in ("jsonl", "sqlite"):
+            raise ValueError(f"不支持的本地存储后端: {self.backend}")
+        self.encoder_backend = encoder_backend or os.getenv("LOCAL_ENCODER_BACKEND", "torch")
+        if self.encoder_backend not in ENCODER_BACKENDS:
+            raise ValueError(f"不支持的编码器后端: {self.encoder_backend}")
+        self.onnx_model_path = onnx_model_path or os.getenv("LOCAL_ONNX_MODEL_PATH")
+        self.encoder_batch_size = encoder_batch_size
+        if micro_batch_size is None:
+            micro_batch_size = int(os.getenv("LOCAL_ENCODER_MICRO_BATCH", "0"))
+        self.micro_batch_size = micro_batch_size
+        self.micro_batch_wait_ms = micro_batch_wait_ms
+        self.batching_encoder: Optional[MicroBatchingEncoder] = None
+        if encoder_processes is None:
+            encoder_processes = int(os.getenv("LOCAL_ENCODER_PROCESSES", "0"))
+        self.encoder_processes = encoder_processes
+        self.process_encoder: Optional[ProcessPoolEncoder] = None
+        threads = encoder_threads or os.getenv("LOCAL_ENCODER_THREADS")
+        self.encoder_threads = int(threads) if threads else None
+        # 缓存键包含后端与模型文件，不同后端（尤其是量化模型）的向量不混用
+        self.encoder_model_name = (encoder_cache_name(self.encoder_backend, self.MODEL_NAME, self.onnx_model_path)
+                                   if encoder is None else self.MODEL_NAME)
+        if hybrid_search is None:
+            search_mode = os.getenv("LOCAL_SEARCH_MODE", "vector")
+            if search_mode not in ("vector", "hybrid"):
+                raise ValueError(f"不支持的检索方式: {search_mode}")
+            hybrid_search = search_mode == "hybrid"
+        fusion = fusion or os.getenv("LOCAL_SEARCH_FUSION", "rrf")
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"不支持的融合方式: {fusion}")
+        if dedup_threshold is None and os.getenv("LOCAL_DEDUP_THRESHOLD"):
+            dedup_threshold = float(os.getenv("LOCAL_DEDUP_THRESHOLD"))
+        self.dedup_threshold = dedup_threshold
+        self.dedup_mode = dedup_mode or os.getenv("LOCAL_DEDUP_MODE", "skip")
+        if self.dedup_mode not in DEDUP_MODES:
+            raise ValueError(f"不支持的去重方式: {self.dedup_mode}")
+        self.dedup_counts = {"checked": 0, "skipped": 0, "merged": 0, "updated": 0}
+        if access_flush_size is None:
+            access_flush_size = int(os.getenv("LOCAL_ACCESS_FLUSH_SIZE", "64"))
+        self.access_flush_size = access_flush_size
+        # 访问计数已变化但尚未写入记录存储的记忆ID
+        self._access_dirty: Set[str] = set()
+        self.journal_path = base_path + ".jsonl"
+        self.storage_path = base_path + ".sqlite3" if self.backend == "sqlite" else self.journal_path
+        self.legacy_path = base_path + ".json"
         self.DEFAULT_USER_ID = "adventureX"
+        self.user_id = user_id or self.DEFAULT_USER_ID
+        
+        # 记忆写入与查询共用的向量缓存，相同文本不再重复编码
+        self.embedding_cache = None
+        if embedding_cache_size > 0:
+            self.embedding_cache = EmbeddingCache(
+                max_entries=embedding_cache_size,
+                disk_path=embedding_cache_path or os.getenv("EMBEDDING_CACHE_PATH")
+            )
+        # 编码器就绪前为 None，此时检索走关键词路径
+        self.encoder = None
+        self._encoder_loaded = threading.Event()
+        self._encoder_thread: Optional[threading.Thread] = None
+        
+        # 写入锁：保证内存状态更新与记录存储写入的顺序一致
+        self._write_lock = threading.RLock()
+        self._store_existed = os.path.exists(self.storage_path)
+        if self.backend == "sqlite":
+            self.records = SQLiteMemoryStore(self.storage_path, fsync=fsync)
+        else:
+            self.records = MemoryJournal(self.storage_path, fsync=fsync)
+        
+        # 回放日志，将记忆常驻内存
+        self._memories: Dict[str, Dict[str, Any]] = self.records.replay()
+        self._embedding_file = self.records.meta.get("embedding_file")
+        # 每条记忆带单调递增的写入序号 seq，分页游标据此续读（时间戳会被合并去重和副本覆盖刷新，不能代表写入顺序）；
+        # 删除最新记忆前把序号高水位写入存储元数据，重启后序号不会复用
+        self._seq = self.records.meta.get("seq", 0)
+        migrated = not self._store_existed and self._migrate_legacy_file()
+        self._number_memories(persist=not migrated)
+        
+        # 向量单独存放在定长二进制文件中，日志里只记录行号；压缩后换用新文件，文件名记录在存储元数据中
+        self.fsync = fsync
+        self.base_path = base_path
+        self.embedding_path = self._embedding_file_path(self._embedding_file)
+        self._remove_stale_embedding_files()
+        self.embedding_store = EmbeddingStore(self.embedding_path, fsync=fsync)
+        self.vector_compact_ratio = vector_compact_ratio
+        self.vector_compact_min_dead = vector_compact_min_dead
+        self._vector_compaction_thread: Optional[threading.Thread] = None
+        self._vector_compaction_lock = threading.Lock()
+        
+        # 基于 memmap 向量构建索引
+        if ann_index is None:
+            ann_index = os.getenv("LOCAL_ANN_INDEX", "false").lower() in ("1", "true", "yes")
+        if ann_nprobe is None:
+            ann_nprobe = int(os.getenv("LOCAL_ANN_NPROBE", "16"))
+        if ann_min_size is None:
+            ann_min_size = int(os.getenv("LOCAL_ANN_MIN_SIZE", "10000"))
+        ann = IVFIndex(nprobe=ann_nprobe, min_train_size=ann_min_size) if ann_index else None
+        embedding_precision = embedding_precision or os.getenv("LOCAL_EMBEDDING_PRECISION", "float32")
+        self.index = VectorIndex(self.embedding_store, ann=ann, precision=embedding_precision,
+                                 rescore_factor=rescore_factor)
+        # BM25 倒排索引：没有向量的记忆（或编码器不可用时的全部记忆）走关键词检索
+        self.keyword_index = BM25Index()
+        self.hybrid_search = hybrid_search
+        self.fusion = fusion
+        self.hybrid_alpha = hybrid_alpha
+        self.hybrid_candidates = hybrid_candidates
+        if recency_scoring is None:
+            recency_scoring = os.getenv("LOCAL_RECENCY_SCORING", "false").lower() in ("1", "true", "yes")
+        if recency_half_life_days is None:
+            recency_half_life_days = float(os.getenv("LOCAL_RECENCY_HALF_LIFE", "30"))
+        self.recency_scoring = recency_scoring
+        self.recency_scorer = RecencyScorer(recency_weight, importance_weight, recency_half_life_days)
+        # 混合检索时关键词一路在线程池中与向量一路并行执行
+        self._search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="local-search")
+        self._load_index(migrated)
+        if ann is not None:
+            self._load_ann()
         
         # 初始化句子转换器用于语义搜索
+        if encoder is not None:
+            self._on_encoder_loaded(encoder)
+        elif not load_default_encoder:
+            pass
+        elif background_encoder:
+            self._encoder_thread = threading.Thread(target=self._load_encoder, name="local-encoder-loader",
+                                                    daemon=True)
+            self._encoder_thread.start()
+        else:
+            self._load_encoder()
+    
+    @property
+    def encoder_ready(self) -> bool:
+        """编码器是否已就绪（就绪前检索只走关键词路径）"""
+        return self.encoder is not None
+    
+    def wait_for_encoder(self, timeout: Optional[float] = None) -> bool:
+        """等待编码器加载（及随后的向量补算）结束
+        
+        参数:
+            timeout: 最长等待秒数，为空时一直等待
+            
+        返回:
+            bool: 编码器是否就绪（加载失败时为 False）
+        """
+        self._encoder_loaded.wait(timeout)
+        return self.encoder_ready
+    
+    def _load_encoder(self):
+        """加载默认句子转换器，失败时保持关键词检索"""
+        args = (self.encoder_backend, self.MODEL_NAME, self.onnx_model_path,
+                self.encoder_batch_size, self.encoder_threads)
         try:
-            self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
+            if self.encoder_processes > 0:
+                encoder = self.process_encoder = ProcessPoolEncoder(load_encoder, args, self.encoder_processes)
+                # 试编码一次，确保工作进程已加载模型
+                encoder.encode(["warm up"])
+            else:
+                encoder = load_encoder(*args)
         except Exception as e:
-            print(f"警告: 无法加载句子转换器，将使用简单文本匹配: {e}")
-            self.encoder = None
+            print(f"警告: 无法加载句子转换器，将使用关键词匹配: {e}")
+            if self.process_encoder is not None:
+                self.process_encoder.close(wait=False)
+                self.process_encoder = None
+            self._encoder_loaded.set()
+            return
+        self._on_encoder_loaded(encoder)
+    
+    def set_encoder(self, encoder: Any):
+        """启用外部提供的编码器（例如多个分区共享的编码器），并为没有向量的记忆补算向量
         
-        # 确保存储文件存在
-        self._ensure_storage_file()
+        参数:
+            encoder: 编码器实例（需提供 encode 方法）
+        """
+        self._on_encoder_loaded(encoder)
     
-    def _ensure_storage_file(self):
-        """确保存储文件存在"""
-        if not os.path.exists(self.storage_path):
-            with open(self.storage_path, 'w', encoding='utf-8') as f:
-                json.dump({"memories": []}, f, ensure_ascii=False, indent=2)
+    def _on_encoder_loaded(self, encoder: Any):
+        """启用编码器，并为没有向量的记忆补算向量
+        
+        参数:
+            encoder: 编码器实例（需提供 encode 方法）
+        """
+        # 缓存在外层：命中缓存的文本不进入微批队列
+        if self.micro_batch_size > 0:
+            encoder = self.batching_encoder = MicroBatchingEncoder(
+                encoder, max_batch_size=self.micro_batch_size, max_wait_ms=self.micro_batch_wait_ms
+            )
+        if self.embedding_cache is not None:
+            encoder = CachedEncoder(encoder, self.embedding_cache, self.encoder_model_name)
+        # 先启用编码器，之后写入的记忆直接计算向量；补算期间没有向量的记忆仍可被关键词检索命中
+        self.encoder = encoder
+        try:
+            self._backfill_embeddings(encoder)
+        except Exception as e:
+            print(f"补算记忆向量失败: {e}")
+        self._encoder_loaded.set()
     
-    def _load_memories(self) -> Dict[str, Any]:
-        """加载记忆数据
+    def _backfill_embeddings(self, encoder: Any, batch_size: int = 64):
+        """为没有向量的记忆（编码器就绪前写入的或旧数据）计算向量并写回记录存储
+        
+        参数:
+            encoder: 编码器实例
+            batch_size: 每批编码的记忆数
+        """
+        with self._write_lock:
+            pending = [memory for memory_id, memory in self._memories.items() if memory_id not in self.index]
+        if not pending:
+            return
+        
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            embeddings = np.asarray(encoder.encode([memory["content"] for memory in batch]), dtype=np.float32)
+            with self._write_lock:
+                # 编码期间可能被删除
+                alive = [i for i, memory in enumerate(batch)
+                         if memory["id"] in self._memories and memory["id"] not in self.index]
+                if not alive:
+                    continue
+                entries = [batch[i] for i in alive]
+                rows = self.index.add_batch(
+                    [entry["id"] for entry in entries],
+                    embeddings[alive],
+                    [entry["metadata"]["privacy_level"] for entry in entries],
+                    **self._index_signals(entries)
+                )
+                for entry, row in zip(entries, rows):
+                    entry["embedding_row"] = row
+                self.records.add_many(entries)
+        print(f"已为 {len(pending)} 条记忆补算向量")
+        self._maybe_compact()
+    
+    def _embedding_file_path(self, name: Optional[str]) -> str:
+        """向量文件路径，name 为空时使用默认文件名"""
+        if not name:
+            return self.base_path + ".f32"
+        return os.path.join(os.path.dirname(os.path.abspath(self.base_path)), name)
+    
+    @property
+    def ann_path(self) -> str:
+        """IVF 索引文件路径（与当前向量文件对应）"""
+        return os.path.splitext(self.embedding_path)[0] + ".ivf.npz"
+    
+    def _embedding_generation(self, name: Optional[str]) -> int:
+        """从向量文件名 (<base>.<代数>.f32) 中解析代数，默认文件 <base>.f32 为第 0 代"""
+        if not name:
+            return 0
+        generation = name[len(os.path.basename(self.base_path)) + 1:].split(".", 1)[0]
+        return int(generation) if generation.isdigit() else 0
+    
+    def _remove_stale_embedding_files(self):
+        """删除压缩中断或压缩提交后未及清理的其他代向量文件和 IVF 索引文件"""
+        current = self._embedding_generation(self._embedding_file)
+        prefix = os.path.basename(self.base_path) + "."
+        directory = os.path.dirname(os.path.abspath(self.base_path))
+        for name in os.listdir(directory):
+            if not name.startswith(prefix):
+                continue
+            stem = name[len(prefix):]
+            head, _, tail = stem.partition(".")
+            if stem in ("f32", "ivf.npz"):
+                generation = 0
+            elif head.isdigit() and tail in ("f32", "ivf.npz"):
+                generation = int(head)
+            else:
+                continue
+            if generation != current:
+                os.remove(os.path.join(directory, name))
+    
+    def _load_index(self, migrated: bool = False):
+        """基于回放得到的记忆构建常驻内存的向量索引
+        
+        参数:
+            migrated: 记忆是否从旧格式迁移而来（需要写入新的记录存储）
+        """
+        stored_rows = len(self.embedding_store)
+        attached = [
+            memory for memory in self._memories.values()
+            if memory.get("embedding_row") is not None and memory["embedding_row"] < stored_rows
+        ]
+        self.index.attach_batch(
+            [memory["id"] for memory in attached],
+            [memory["embedding_row"] for memory in attached],
+            [memory["metadata"]["privacy_level"] for memory in attached],
+            **self._index_signals(attached)
+        )
+        
+        # 旧格式中内联在 JSON 里的向量，迁移到向量文件后重写日志
+        inline = [memory for memory in self._memories.values() if "embedding" in memory]
+        if inline:
+            rows = self.index.add_batch(
+                [memory["id"] for memory in inline],
+                np.asarray([memory["embedding"] for memory in inline], dtype=np.float32),
+                [memory["metadata"]["privacy_level"] for memory in inline],
+                **self._index_signals(inline)
+            )
+            for memory, row in zip(inline, rows):
+                del memory["embedding"]
+                memory["embedding_row"] = row
+        if inline or migrated:
+            self.records.compact(self._snapshot, meta=self._records_meta())
+        
+        for memory in self._memories.values():
+            self.keyword_index.add(memory["id"], memory["content"])
+    
+    @staticmethod
+    def _index_signals(memories: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """从记忆条目中取出索引打分所需的写入时间和访问计数"""
+        return {
+            "timestamps": np.fromiter((parse_timestamp(memory.get("timestamp")) for memory in memories),
+                                      dtype=np.float64, count=len(memories)),
+            "access_counts": np.fromiter((memory.get("access_count", 0) for memory in memories),
+                                         dtype=np.float32, count=len(memories)),
+        }
+    
+    def _load_ann(self):
+        """加载持久化的 IVF 索引，不存在或已失效时按需在后台训练"""
+        ann = self.index.ann
+        if os.path.exists(self.ann_path):
+            loaded = ann.untrained_copy()
+            if loaded.load(self.ann_path) and loaded.row_count <= len(self.embedding_store):
+                self.index.attach_ann(loaded)
+                return
+        self.index.maybe_train_ann()
+    
+    def _migrate_legacy_file(self) -> bool:
+        """将旧格式存储载入内存，由调用方写入新的记录存储（旧文件保留不动）
+        
+        SQLite 后端优先从 JSONL 日志迁移，其次是旧版整文件 JSON。
         
         返回:
-            Dict: 包含所有记忆的字典
+            bool: 是否载入了旧格式存储
         """
+        if self.backend == "sqlite" and os.path.exists(self.journal_path):
+            journal = MemoryJournal(self.journal_path)
+            self._memories = journal.replay()
+            self._embedding_file = journal.meta.get("embedding_file")
+            self._seq = journal.meta.get("seq", 0)
+            journal.close()
+            print(f"已将 {len(self._memories)} 条记忆从 {self.journal_path} 迁移到 {self.storage_path}")
+            return True
+        if not os.path.exists(self.legacy_path):
+            return False
         try:
-            with open(self.storage_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                memories = json.load(f).get("memories", [])
         except Exception as e:
-            print(f"加载记忆文件失败: {e}")
-            return {"memories": []}
+            print(f"加载旧版记忆文件失败: {e}")
+            return False
+        self._memories = {memory["id"]: memory for memory in memories}
+        print(f"已将 {len(memories)} 条记忆从 {self.legacy_path} 迁移到 {self.storage_path}")
+        return True
     
-    def _save_memories(self, data: Dict[str, Any]):
-        """保存记忆数据
+    def _number_memories(self, persist: bool = True):
+        """恢复写入序号高水位，为没有写入序号的旧记忆编号，并按序号排列内存中的记忆
+        
+        旧记忆从已持久化的最大序号之后按加载顺序编号，避免与已有序号重复；persist 为 True 时
+        立即写回记录存储，使编号在之后的重启中保持不变。JSONL 日志回放时被覆盖的记忆会移到末尾，
+        因此加载后需要按序号重新排列。
         
         参数:
-            data: 要保存的记忆数据
+            persist: 是否把新编号写回记录存储（迁移时由随后的压缩统一写入）
         """
+        last = max([self._seq] + [memory["seq"] for memory in self._memories.values()
+                                  if memory.get("seq") is not None])
+        legacy = [memory for memory in self._memories.values() if memory.get("seq") is None]
+        for memory in legacy:
+            last += 1
+            memory["seq"] = last
+        if legacy and persist:
+            self.records.add_many(legacy)
+        self._seq = last
+        seqs = [memory["seq"] for memory in self._memories.values()]
+        if any(earlier > later for earlier, later in zip(seqs, seqs[1:])):
+            self._memories = dict(sorted(self._memories.items(), key=lambda item: item[1]["seq"]))
+    
+    def _next_seq(self) -> int:
+        """分配下一个写入序号（需持有写入锁）"""
+        self._seq += 1
+        return self._seq
+    
+    def _snapshot(self) -> List[Dict[str, Any]]:
+        """返回当前全部存活记忆，供日志压缩使用"""
+        return list(self._memories.values())
+    
+    def _records_meta(self) -> Dict[str, Any]:
+        """写入记录存储的元数据：当前向量文件名和写入序号高水位"""
+        return {"embedding_file": os.path.basename(self.embedding_path), "seq": self._seq}
+    
+    def _maybe_compact(self):
+        """记录存储中失效记录过多时触发后台压缩；向量文件中墓碑行过多时在后台压缩向量文件"""
+        self.records.maybe_compact(len(self._memories), self._snapshot)
+        dead = self.index.dead_count
+        if dead < self.vector_compact_min_dead or dead <= self.vector_compact_ratio * len(self.embedding_store):
+            return
+        thread = self._vector_compaction_thread
+        if thread is not None and thread.is_alive():
+            return
+        self._vector_compaction_thread = threading.Thread(
+            target=self._compact_vectors_in_background, name="local-vector-compaction", daemon=True
+        )
+        self._vector_compaction_thread.start()
+    
+    def _compact_vectors_in_background(self):
         try:
-            with open(self.storage_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.compact_vectors()
         except Exception as e:
-            print(f"保存记忆文件失败: {e}")
+            print(f"向量文件压缩失败: {e}")
+    
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """等待后台的日志压缩和向量文件压缩完成（主要用于测试和关闭流程）"""
+        thread = self._vector_compaction_thread
+        if thread is not None:
+            thread.join(timeout)
+        self.records.wait_for_compaction(timeout)
+    
+    def compact_vectors(self):
+        """压缩向量文件：把存活向量拷贝到新一代文件并重建索引，然后原子切换
+        
+        拷贝和重建（包括 IVF 训练与量化副本）期间不持有任何锁，搜索和写入照常进行；
+        最后在写入锁内补齐期间新增/删除的记忆，把新行号和新文件名在一次记录存储压缩中提交，
+        再切换到新索引。提交之前崩溃时记录存储仍指向旧文件，提交之后指向新文件。
+        搜索不取写入锁，切换前后读到的都是一致的 (索引, 向量文件) 组合。
+        """
+        with self._vector_compaction_lock:
+            with self._write_lock:
+                old_index = self.index
+                snapshot_rows = len(self.embedding_store)
+                ids, rows, privacy = old_index.live_rows()
+                timestamps, access_counts = old_index.signals(rows)
+            
+            generation = self._embedding_generation(self._embedding_file) + 1
+            new_path = f"{self.base_path}.{generation}.f32"
+            for path in (new_path, os.path.splitext(new_path)[0] + ".ivf.npz"):
+                if os.path.exists(path):
+                    os.remove(path)
+            new_store = EmbeddingStore(new_path, dim=self.embedding_store.dim, fsync=False)
+            ann = old_index.ann.untrained_copy() if old_index.ann is not None else None
+            new_index = VectorIndex(new_store, ann=ann, precision=old_index.precision,
+                                    rescore_factor=old_index.rescore_factor)
+            matrix = old_index.store.matrix
+            chunk_size = 65536
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                new_index.add_batch(ids[start:start + chunk_size], matrix[chunk], privacy[start:start + chunk_size],
+                                    normalized=True, timestamps=timestamps[start:start + chunk_size],
+                                    access_counts=access_counts[start:start + chunk_size])
+            new_index.wait_for_ann()
+            
+            with self._write_lock, self.records.compaction_lock:
+                # 补齐快照之后新增的行，移除快照之后删除的记忆
+                matrix = old_index.store.matrix
+                late = [(old_index.id_at(row), row) for row in range(snapshot_rows, matrix.shape[0])]
+                late = [(memory_id, row) for memory_id, row in late if memory_id is not None]
+                if late:
+                    late_rows = np.asarray([row for _, row in late], dtype=np.int64)
+                    late_timestamps, late_access = old_index.signals(late_rows)
+                    new_index.add_batch([memory_id for memory_id, _ in late], matrix[late_rows],
+                                        [self._memories[memory_id]["metadata"]["privacy_level"] for memory_id, _ in late],
+                                        normalized=True, timestamps=late_timestamps, access_counts=late_access)
+                for memory_id in ids:
+                    if memory_id not in old_index:
+                        new_index.remove(memory_id)
+                if self.fsync:
+                    new_store.sync()
+                
+                # 先改内存中的行号，再在记录存储压缩中提交新行号和新文件名；失败时恢复
+                previous_rows = {}
+                for memory_id, memory in self._memories.items():
+                    row = new_index.row_of(memory_id)
+                    if row is not None:
+                        previous_rows[memory_id] = memory.get("embedding_row")
+                        memory["embedding_row"] = row
+                old_path = self.embedding_path
+                try:
+                    self.embedding_path = new_path
+                    self.records.compact(self._snapshot, meta=self._records_meta())
+                except Exception:
+                    self.embedding_path = old_path
+                    for memory_id, row in previous_rows.items():
+                        self._memories[memory_id]["embedding_row"] = row
+                    raise
+                
+                old_store = self.embedding_store
+                old_ann_path = os.path.splitext(old_path)[0] + ".ivf.npz"
+                new_store.fsync = self.fsync
+                self._embedding_file = os.path.basename(new_path)
+                self.embedding_store = new_store
+                self.index = new_index
+            
+            # 旧文件不再被引用；已映射的内存在最后一个读取者释放后回收
+            old_store.close_writer()
+            for path in (old_path, old_ann_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            print(f"向量文件压缩完成: {snapshot_rows} 行 -> {len(new_store)} 行")
+    
+    def close(self):
+        """关闭记录存储、向量文件和向量缓存，并持久化 IVF 索引"""
+        self._search_executor.shutdown(wait=True)
+        if self._encoder_thread is not None:
+            self._encoder_thread.join()
+        if self.batching_encoder is not None:
+            self.batching_encoder.close()
+        if self.process_encoder is not None:
+            self.process_encoder.close()
+        self.flush_access_counts()
+        self.wait_for_compaction()
+        self.records.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+        if self.index.ann is not None:
+            self.index.wait_for_ann()
+            self.index.ann.save(self.ann_path)
+        self.embedding_store.close()
     
     def add(self, text: str, metadata: Metadata) -> str:
         """添加记忆
@@ -83,192 +684,508 @@ class LocalStorageService:
             str: 操作结果消息
         """
         try:
-            data = self._load_memories()
-            
             # 创建新的记忆条目
-            memory_entry = {
-                "id": str(uuid.uuid4()),
-                "content": text,
-                "metadata": {
-                    "privacy_level": metadata.privacy_level.value,
-                    "source": metadata.source
-                },
-                "timestamp": datetime.now().isoformat(),
-                "user_id": self.DEFAULT_USER_ID
-            }
+            memory_entry = self._new_entry(text, metadata)
             
             # 如果有编码器，计算向量
+            embedding = None
             if self.encoder:
                 try:
-                    embedding = self.encoder.encode([text])[0].tolist()
-                    memory_entry["embedding"] = embedding
+                    embedding = np.asarray(self.encoder.encode([text])[0], dtype=np.float32)
                 except Exception as e:
                     print(f"计算向量失败: {e}")
             
-            data["memories"].append(memory_entry)
-            self._save_memories(data)
+            with self._write_lock:
+                # 查找与写入在同一把锁内，并发写入同一事实时只有第一条落盘
+                duplicate_id = None
+                if embedding is not None and self.dedup_threshold is not None:
+                    duplicate_id = self._find_duplicate(embedding, metadata.privacy_level.value)
+                if duplicate_id is not None:
+                    message = self._apply_duplicate(duplicate_id, memory_entry, embedding)
+                else:
+                    # 先写向量文件再写日志：崩溃时最多留下一行无主向量
+                    memory_entry["seq"] = self._next_seq()
+                    if embedding is not None:
+                        memory_entry["embedding_row"] = self.index.add(
+                            memory_entry["id"], embedding, metadata.privacy_level.value
+                        )
+                    self._memories[memory_entry["id"]] = memory_entry
+                    self.keyword_index.add(memory_entry["id"], text)
+                    self.records.append_add(memory_entry)
+                    message = "ad-context记忆成功"
+            self._maybe_compact()
             
-            return "ad-context记忆成功"
+            return message
             
         except Exception as e:
             return f"ad-context记忆失败: {str(e)}"
     
-    def search(self, query_text: str, top_k: int = 5, metadata_filter: Optional[Metadata] = None) -> List[RetriveResult]:
+    def _find_duplicate(self, embedding: np.ndarray, privacy_level: int) -> Optional[str]:
+        """在同一隐私级别中查找与新记忆近似重复的已有记忆（需持有写入锁）
+        
+        返回:
+            Optional[str]: 最相似且相似度不低于 dedup_threshold 的记忆ID，没有时为 None
+        """
+        self.dedup_counts["checked"] += 1
+        hits = self.index.search(embedding, 1, privacy_level)
+        if hits and hits[0][1] >= self.dedup_threshold and hits[0][0] in self._memories:
+            return hits[0][0]
+        return None
+    
+    def _apply_duplicate(self, memory_id: str, memory_entry: Dict[str, Any], embedding: np.ndarray) -> str:
+        """按 dedup_mode 处理近似重复的写入（需持有写入锁）
+        
+        参数:
+            memory_id: 已有的相似记忆ID
+            memory_entry: 新记忆条目
+            embedding: 新记忆的向量
+            
+        返回:
+            str: 操作结果消息
+        """
+        existing = self._memories[memory_id]
+        if self.dedup_mode == "skip":
+            self.dedup_counts["skipped"] += 1
+            return "ad-context记忆成功: 与已有记忆重复，已跳过"
+        
+        if self.dedup_mode == "merge":
+            # 保留原内容和向量，只刷新时间并记录重复次数
+            existing["timestamp"] = memory_entry["timestamp"]
+            existing["duplicate_count"] = existing.get("duplicate_count", 0) + 1
+            self.index.touch(memory_id, parse_timestamp(existing["timestamp"]))
+            self.records.append_add(existing)
+            self.dedup_counts["merged"] += 1
+            return "ad-context记忆成功: 已合并到相似记忆"
+        
+        # update：新内容原地覆盖，沿用原ID、写入序号和访问计数
+        entry = dict(memory_entry, id=memory_id, seq=existing["seq"])
+        if "access_count" in existing:
+            entry["access_count"] = existing["access_count"]
+        entry["embedding_row"] = self.index.add_batch(
+            [memory_id], np.asarray([embedding]), [entry["metadata"]["privacy_level"]],
+            access_counts=[entry.get("access_count", 0)]
+        )[0]
+        self._memories[memory_id] = entry
+        self.keyword_index.add(memory_id, entry["content"])
+        self.records.append_add(entry)
+        self.dedup_counts["updated"] += 1
+        return "ad-context记忆成功: 已更新相似记忆"
+    
+    def dedup_stats(self) -> Dict[str, int]:
+        """返回写入去重计数：checked（检查次数）、skipped、merged、updated"""
+        with self._write_lock:
+            return dict(self.dedup_counts)
+    
+    def add_many(self, texts: List[str], metadatas: Union[Metadata, List[Metadata]],
+                 batch_size: int = 64) -> str:
+        """批量添加记忆
+        
+        按 batch_size 分批调用编码器以利用其批处理能力，所有记录在一次写入中落盘。
+        
+        参数:
+            texts: 记忆内容列表
+            metadatas: 与 texts 一一对应的元数据列表，或应用于全部记忆的单个元数据
+            batch_size: 每批编码的文本数
+            
+        返回:
+            str: 操作结果消息
+        """
+        if isinstance(metadatas, Metadata):
+            metadatas = [metadatas] * len(texts)
+        if len(metadatas) != len(texts):
+            return "ad-context批量记忆失败: texts 与 metadatas 数量不一致"
+        if not texts:
+            return "ad-context批量记忆成功: 0 条"
+        
+        try:
+            entries = [self._new_entry(text, metadata) for text, metadata in zip(texts, metadatas)]
+            
+            embeddings = None
+            if self.encoder:
+                try:
+                    embeddings = np.concatenate([
+                        np.asarray(self.encoder.encode(texts[start:start + batch_size]), dtype=np.float32)
+                        for start in range(0, len(texts), batch_size)
+                    ])
+                except Exception as e:
+                    print(f"批量计算向量失败: {e}")
+            
+            with self._write_lock:
+                if embeddings is not None:
+                    rows = self.index.add_batch(
+                        [entry["id"] for entry in entries],
+                        embeddings,
+                        [metadata.privacy_level.value for metadata in metadatas]
+                    )
+                    for entry, row in zip(entries, rows):
+                        entry["embedding_row"] = row
+                for entry in entries:
+                    entry["seq"] = self._next_seq()
+                    self._memories[entry["id"]] = entry
+                    self.keyword_index.add(entry["id"], entry["content"])
+                self.records.add_many(entries)
+            self._maybe_compact()
+            
+            return f"ad-context批量记忆成功: {len(entries)} 条"
+            
+        except Exception as e:
+            return f"ad-context批量记忆失败: {str(e)}"
+    
+    def upsert_many(self, entries: List[Dict[str, Any]], batch_size: int = 64) -> int:
+        """按条目自带的ID写入或覆盖记忆（用于同步远端记忆的本地副本）
+
+        内容和元数据都未变化的条目跳过；只有内容变化的条目重新编码。
+
+        参数:
+            entries: 记忆条目，至少包含 id、content、metadata，可选 timestamp
+            batch_size: 每批编码的文本数
+
+        返回:
+            int: 实际写入的条目数
+        """
+        encoded, reused, reused_vectors = [], [], []
+        with self._write_lock:
+            for entry in entries:
+                existing = self._memories.get(entry["id"])
+                if existing is not None and existing["content"] == entry["content"] \
+                        and existing["metadata"] == entry["metadata"]:
+                    continue
+                entry = dict(entry, user_id=self.user_id)
+                # 内容未变的条目沿用已有向量
+                vector = self.index.vector(entry["id"]) if existing is not None \
+                    and existing["content"] == entry["content"] else None
+                if vector is not None:
+                    reused.append(entry)
+                    reused_vectors.append(vector)
+                else:
+                    encoded.append(entry)
+        changed = encoded + reused
+        if not changed:
+            return 0
+
+        embeddings = None
+        if self.encoder and encoded:
+            texts = [entry["content"] for entry in encoded]
+            try:
+                embeddings = np.concatenate([
+                    np.asarray(self.encoder.encode(texts[start:start + batch_size]), dtype=np.float32)
+                    for start in range(0, len(texts), batch_size)
+                ])
+            except Exception as e:
+                print(f"批量计算向量失败: {e}")
+
+        with self._write_lock:
+            if embeddings is None:
+                # 没有新向量时移除旧内容的向量，这些条目只参与关键词检索
+                for entry in encoded:
+                    self.index.remove(entry["id"])
+            groups = ((encoded, embeddings, False),
+                      (reused, np.asarray(reused_vectors, dtype=np.float32) if reused else None, True))
+            for group, vectors, normalized in groups:
+                if not group or vectors is None:
+                    continue
+                rows = self.index.add_batch(
+                    [entry["id"] for entry in group],
+                    vectors,
+                    [entry["metadata"].get("privacy_level", PrivacyLevel.LEVEL_1_PUBLIC.value) for entry in group],
+                    normalized=normalized,
+                    **self._index_signals(group)
+                )
+                for entry, row in zip(group, rows):
+                    entry["embedding_row"] = row
+            for entry in changed:
+                # 覆盖已有记忆时沿用其写入序号
+                existing = self._memories.get(entry["id"])
+                entry["seq"] = existing["seq"] if existing is not None else self._next_seq()
+                self._memories[entry["id"]] = entry
+                self.keyword_index.add(entry["id"], entry["content"])
+            self.records.add_many(changed)
+        self._maybe_compact()
+        return len(changed)
+
+    def memory_ids(self) -> List[str]:
+        """返回全部记忆ID（按写入顺序）"""
+        with self._write_lock:
+            return list(self._memories)
+
+    def _new_entry(self, text: str, metadata: Metadata) -> Dict[str, Any]:
+        """创建新的记忆条目（不含向量）
+        
+        参数:
+            text: 记忆内容
+            metadata: 元数据
+            
+        返回:
+            Dict: 记忆条目
+        """
+        memory_entry = {
+            "id": str(uuid.uuid4()),
+            "content": text,
+            "metadata": {
+                "privacy_level": metadata.privacy_level.value,
+                "source": metadata.source
+            },
+            "timestamp": datetime.now().isoformat(),
+            "user_id": self.user_id
+        }
+        if metadata.blockchain_data_id:
+            memory_entry["metadata"]["blockchain_data_id"] = metadata.blockchain_data_id
+        return memory_entry
+    
+    def search(self, query_text: str, top_k: int = 5,
+               metadata_filter: Optional[Union[Metadata, Dict[str, Any]]] = None,
+               hybrid: Optional[bool] = None, recency: Optional[bool] = None) -> List[RetriveResult]:
         """搜索记忆
         
+        返回的记忆各累加一次访问计数（用于访问频次加权）。
+        
         参数:
             query_text: 查询文本
             top_k: 返回结果数量
-            metadata_filter: 元数据过滤器
+            metadata_filter: 元数据过滤器，Metadata 对象（按隐私级别相等过滤）或过滤字典，
+                             例如 {"privacy_level": {"lte": 2}, "timestamp": {"gt": "2025-07-23"}}
+            hybrid: 是否混合检索（向量 + BM25 关键词并行检索后融合），为空时使用构造参数 hybrid_search
+            recency: 向量分数是否叠加新鲜度与访问频次，为空时使用构造参数 recency_scoring
             
         返回:
             List[RetriveResult]: 搜索结果列表
         """
         try:
-            data = self._load_memories()
-            memories = data.get("memories", [])
-            
-            if not memories:
+            if not self._memories:
                 return []
             
-            # 应用元数据过滤
-            if metadata_filter:
-                filtered_memories = []
-                for memory in memories:
-                    memory_metadata = memory.get("metadata", {})
-                    if memory_metadata.get("privacy_level") == metadata_filter.privacy_level.value:
-                        filtered_memories.append(memory)
-                memories = filtered_memories
-            
-            results = []
+            conditions = normalize_filter(metadata_filter)
+            privacy_level = None
+            candidate_ids = None
+            if len(conditions) == 1 and conditions[0][:2] == ("privacy_level", "eq"):
+                # 单一隐私级别相等过滤直接使用索引中的隐私级别数组
+                privacy_level = conditions[0][2]
+            elif conditions:
+                candidate_ids = self._filter_ids(conditions)
+                if not candidate_ids:
+                    return []
             
-            if self.encoder and memories:
-                # 使用向量相似度搜索
-                try:
-                    query_embedding = self.encoder.encode([query_text])[0]
-                    
-                    for memory in memories:
-                        if "embedding" in memory:
-                            memory_embedding = np.array(memory["embedding"])
-                            similarity = cosine_similarity([query_embedding], [memory_embedding])[0][0]
-                            
-                            result = RetriveResult(
-                                context=memory["content"],
-                                metadata=Metadata(
-                                    privacy_level=PrivacyLevel(memory["metadata"]["privacy_level"]),
-                                    source=memory["metadata"]["source"]
-                                ),
-                                score=float(similarity)
-                            )
-                            results.append(result)
-                        else:
-                            # 如果没有向量，使用简单文本匹配
-                            score = self._simple_text_similarity(query_text, memory["content"])
-                            result = RetriveResult(
-                                context=memory["content"],
-                                metadata=Metadata(
-                                    privacy_level=PrivacyLevel(memory["metadata"]["privacy_level"]),
-                                    source=memory["metadata"]["source"]
-                                ),
-                                score=score
-                            )
-                            results.append(result)
-                            
-                except Exception as e:
-                    print(f"向量搜索失败，使用文本匹配: {e}")
-                    # 降级到简单文本匹配
-                    for memory in memories:
-                        score = self._simple_text_similarity(query_text, memory["content"])
-                        result = RetriveResult(
-                            context=memory["content"],
-                            metadata=Metadata(
-                                privacy_level=PrivacyLevel(memory["metadata"]["privacy_level"]),
-                                source=memory["metadata"]["source"]
-                            ),
-                            score=score
-                        )
-                        results.append(result)
+            scorer = self.recency_scorer if (self.recency_scoring if recency is None else recency) else None
+            if self.hybrid_search if hybrid is None else hybrid:
+                # 关键词一路覆盖全部记忆（包括没有向量的），在线程池中与向量一路并行
+                fetch_k = top_k * self.hybrid_candidates
+                keyword_future = self._search_executor.submit(
+                    self._keyword_search, query_text, fetch_k, privacy_level, candidate_ids
+                )
+                vector_hits = self._vector_search(query_text, fetch_k, privacy_level, candidate_ids, scorer)
+                keyword_hits = keyword_future.result()
+                if vector_hits is None:
+                    scored = keyword_hits
+                elif self.fusion == "rrf":
+                    scored = reciprocal_rank_fusion([vector_hits, keyword_hits])
+                else:
+                    scored = weighted_fusion([vector_hits, keyword_hits],
+                                             [self.hybrid_alpha, 1.0 - self.hybrid_alpha])
             else:
-                # 使用简单文本匹配
-                for memory in memories:
-                    score = self._simple_text_similarity(query_text, memory["content"])
-                    result = RetriveResult(
-                        context=memory["content"],
-                        metadata=Metadata(
-                            privacy_level=PrivacyLevel(memory["metadata"]["privacy_level"]),
-                            source=memory["metadata"]["source"]
-                        ),
-                        score=score
-                    )
-                    results.append(result)
+                vector_hits = self._vector_search(query_text, top_k, privacy_level, candidate_ids, scorer)
+                scored = list(vector_hits or [])
+                # 没有向量的记忆（或向量搜索不可用时的全部记忆）使用 BM25 关键词检索
+                if vector_hits is None or len(self.index) < len(self._memories):
+                    scored.extend(self._keyword_search(query_text, top_k, privacy_level, candidate_ids,
+                                                       unindexed_only=vector_hits is not None))
+                # 按相似度排序
+                scored.sort(key=lambda item: item[1], reverse=True)
             
-            # 按相似度排序并返回前 top_k 个结果
-            results.sort(key=lambda x: x.score, reverse=True)
-            return results[:top_k]
+            # 返回前 top_k 个结果
+            results = [(memory_id, score) for memory_id, score in scored[:top_k] if memory_id in self._memories]
+            if self.recency_scoring:
+                self._record_access([memory_id for memory_id, _ in results])
+            return [self._to_result(memory_id, score) for memory_id, score in results]
             
         except Exception as e:
             print(f"搜索记忆失败: {str(e)}")
             return []
     
-    def _simple_text_similarity(self, query: str, text: str) -> float:
-        """简单的文本相似度计算
+    def _vector_search(self, query_text: str, top_k: int, privacy_level: Optional[int],
+                       candidate_ids: Optional[List[str]],
+                       scorer: Optional[RecencyScorer] = None) -> Optional[List[tuple]]:
+        """向量检索：一次矩阵-向量乘法 + argpartition，只对通过过滤的候选打分
+        
+        返回:
+            Optional[List[tuple]]: (记忆ID, 余弦相似度或加权分数) 列表，编码器或索引不可用时为 None
+        """
+        # 向量文件压缩会整体替换索引，本次检索固定使用同一个索引
+        index = self.index
+        if not self.encoder or len(index) == 0:
+            return None
+        try:
+            query_embedding = self.encoder.encode([query_text])[0]
+            rows = None
+            if candidate_ids is not None:
+                rows = np.fromiter(
+                    (row for row in map(index.row_of, candidate_ids) if row is not None),
+                    dtype=np.int64
+                )
+            return index.search(query_embedding, top_k, privacy_level, rows=rows, scorer=scorer)
+        except Exception as e:
+            print(f"向量搜索失败，使用文本匹配: {e}")
+            return None
+    
+    def _record_access(self, memory_ids: List[str]):
+        """累加访问计数：索引中的计数用于打分，记忆条目中的计数累积 access_flush_size 条后批量落盘"""
+        self.index.record_access(memory_ids)
+        with self._write_lock:
+            for memory_id in memory_ids:
+                memory = self._memories.get(memory_id)
+                if memory is not None:
+                    memory["access_count"] = memory.get("access_count", 0) + 1
+                    self._access_dirty.add(memory_id)
+            if len(self._access_dirty) < self.access_flush_size:
+                return
+        self.flush_access_counts()
+    
+    def flush_access_counts(self) -> int:
+        """把尚未落盘的访问计数写入记录存储（SQLite 原地更新，JSONL 追加记录并随压缩合并）
+        
+        返回:
+            int: 写入的记忆条数
+        """
+        with self._write_lock:
+            dirty = [self._memories[memory_id] for memory_id in self._access_dirty if memory_id in self._memories]
+            self._access_dirty.clear()
+            if dirty:
+                self.records.add_many(dirty)
+        if dirty:
+            self._maybe_compact()
+        return len(dirty)
+    
+    def _keyword_search(self, query_text: str, top_k: int, privacy_level: Optional[int],
+                        candidate_ids: Optional[List[str]], unindexed_only: bool = False) -> List[tuple]:
+        """BM25 关键词检索
         
         参数:
-            query: 查询文本
-            text: 目标文本
+            unindexed_only: 为 True 时只检索没有向量的记忆
             
         返回:
-            float: 相似度分数 (0-1)
+            List[tuple]: (记忆ID, 归一化 BM25 分数) 列表
         """
-        query_lower = query.lower()
-        text_lower = text.lower()
+        candidate_set = set(candidate_ids) if candidate_ids is not None else None
         
-        # 简单的关键词匹配
-        query_words = set(query_lower.split())
-        text_words = set(text_lower.split())
+        def allowed(memory_id: str) -> bool:
+            memory = self._memories.get(memory_id)
+            if memory is None or (unindexed_only and memory_id in self.index):
+                return False
+            if candidate_set is not None and memory_id not in candidate_set:
+                return False
+            return privacy_level is None or memory["metadata"]["privacy_level"] == privacy_level
         
-        if not query_words:
-            return 0.0
+        return self.keyword_index.search(query_text, top_k, allowed)
+    
+    def _filter_ids(self, conditions: List[Condition], limit: Optional[int] = None) -> List[str]:
+        """返回满足元数据条件的记忆ID（按写入顺序）
         
-        # 计算交集比例
-        intersection = query_words.intersection(text_words)
-        similarity = len(intersection) / len(query_words)
+        SQLite 后端把条件下推到带索引的 SQL 查询，JSONL 后端在内存中逐条判断。
         
-        # 如果查询文本是目标文本的子字符串，给予更高分数
-        if query_lower in text_lower:
-            similarity = max(similarity, 0.8)
+        参数:
+            conditions: normalize_filter 返回的条件列表
+            limit: 最多返回的数量
+            
+        返回:
+            List[str]: 记忆ID列表
+        """
+        if isinstance(self.records, SQLiteMemoryStore):
+            return [row[0] for row in self.records.query(conditions, limit=limit)]
+        ids = (memory_id for memory_id, memory in self._memories.items() if matches(memory, conditions))
+        return list(itertools.islice(ids, limit))
+    
+    def _to_result(self, memory_id: str, score: float) -> RetriveResult:
+        """将记忆条目转换为检索结果
         
-        return similarity
+        参数:
+            memory_id: 记忆ID
+            score: 相似度分数
+            
+        返回:
+            RetriveResult: 检索结果
+        """
+        memory = self._memories[memory_id]
+        return RetriveResult(
+            context=memory["content"],
+            metadata=Metadata(
+                privacy_level=PrivacyLevel(memory["metadata"]["privacy_level"]),
+                source=memory["metadata"]["source"],
+                blockchain_data_id=memory["metadata"].get("blockchain_data_id")
+            ),
+            score=float(score)
+        )
     
-    def list(self, limit: int = 100, filters: Optional[Metadata] = None) -> List[Dict[str, Any]]:
+    def list(self, limit: int = 100,
+             filters: Optional[Union[Metadata, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
         """列出记忆
         
         参数:
             limit: 返回结果数量限制
-            filters: 过滤器
+            filters: 过滤器，格式同 search 的 metadata_filter
             
         返回:
             List[Dict]: 记忆列表
         """
         try:
-            data = self._load_memories()
-            memories = data.get("memories", [])
-            
-            # 应用过滤器
-            if filters:
-                filtered_memories = []
-                for memory in memories:
-                    memory_metadata = memory.get("metadata", {})
-                    if memory_metadata.get("privacy_level") == filters.privacy_level.value:
-                        filtered_memories.append(memory)
-                memories = filtered_memories
-            
-            return memories[:limit]
+            return self.list_page(limit, filters=filters).memories
             
         except Exception as e:
             print(f"列出记忆失败: {str(e)}")
             return []
     
+    def list_page(self, limit: int = 100, cursor: Optional[str] = None,
+                  filters: Optional[Union[Metadata, Dict[str, Any]]] = None) -> MemoryPage:
+        """按写入顺序分页列出记忆
+        
+        参数:
+            limit: 每页数量
+            cursor: 上一页返回的 next_cursor，为空时从第一条开始
+            filters: 过滤器，格式同 search 的 metadata_filter
+            
+        返回:
+            MemoryPage: 本页记忆及下一页游标（没有更多记忆时为空）
+        """
+        conditions = normalize_filter(filters)
+        after = decode_cursor(cursor)
+        # 多取一条用于判断是否还有下一页
+        if conditions and isinstance(self.records, SQLiteMemoryStore):
+            ids = [row[0] for row in self.records.query(conditions, limit=limit + 1, after=after)]
+        else:
+            with self._write_lock:
+                ids = list(itertools.islice(self._ids_after(after, conditions), limit + 1))
+        memories = [memory for memory in map(self._memories.get, ids[:limit]) if memory is not None]
+        next_cursor = encode_cursor(memories[-1]) if len(ids) > limit and memories else None
+        return MemoryPage(memories=memories, next_cursor=next_cursor)
+    
+    def _ids_after(self, after: Optional[Cursor], conditions: List[Condition]) -> Iterator[str]:
+        """按写入顺序惰性产出游标之后、满足条件的记忆ID（需持有写入锁）
+
+        覆盖已有记忆时字典位置和写入序号都不变，因此字典顺序与 seq 顺序一致。
+        """
+        items = iter(self._memories.items())
+        if after is not None:
+            after_seq = after[1]
+            items = itertools.dropwhile(lambda item: item[1]["seq"] <= after_seq, items)
+        return (memory_id for memory_id, memory in items if matches(memory, conditions))
+    
+    def iter_memories(self, page_size: int = 100,
+                      filters: Optional[Union[Metadata, Dict[str, Any]]] = None) -> Iterator[Dict[str, Any]]:
+        """逐页遍历全部记忆，同一时刻只持有一页
+        
+        参数:
+            page_size: 每页数量
+            filters: 过滤器，格式同 search 的 metadata_filter
+            
+        返回:
+            Iterator[Dict]: 记忆条目
+        """
+        cursor = None
+        while True:
+            page = self.list_page(page_size, cursor, filters)
+            yield from page.memories
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+    
     def delete(self, memory_id: str) -> Dict[str, Any]:
         """删除记忆
         
@@ -279,19 +1196,19 @@ class LocalStorageService:
             Dict: 操作结果
         """
         try:
-            data = self._load_memories()
-            memories = data.get("memories", [])
-            
             # 查找并删除指定ID的记忆
-            original_count = len(memories)
-            memories = [m for m in memories if m.get("id") != memory_id]
-            
-            if len(memories) < original_count:
-                data["memories"] = memories
-                self._save_memories(data)
-                return {"message": "记忆删除成功", "deleted": True}
-            else:
-                return {"message": "未找到指定记忆", "deleted": False}
+            with self._write_lock:
+                if memory_id not in self._memories:
+                    return {"message": "未找到指定记忆", "deleted": False}
+                if self._memories[memory_id]["seq"] == self._seq:
+                    # 删除最新记忆前持久化序号高水位，重启后该序号不会分配给新记忆
+                    self.records.save_meta(dict(self.records.meta, seq=self._seq))
+                del self._memories[memory_id]
+                self.index.remove(memory_id)
+                self.keyword_index.remove(memory_id)
+                self.records.append_delete(memory_id)
+            self._maybe_compact()
+            return {"message": "记忆删除成功", "deleted": True}
                 
         except Exception as e:
             return {"message": f"删除记忆失败: {str(e)}", "deleted": False}
\ No newline at end of file
@@ -0,0 +1,1292 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from schemas.common import Metadata
+from schemas.privacy import PrivacyLevel
+from storage.ann_index import IVFIndex
+from storage.batching_encoder import MicroBatchingEncoder
+from storage.circuit_breaker import CircuitBreaker, CircuitOpenError
+from storage.embedding_cache import CachedEncoder, EmbeddingCache
+from storage.embedding_store import EmbeddingStore, InMemoryVectorStore
+from storage.filters import matches, normalize_filter, to_sql
+from storage.fusion import reciprocal_rank_fusion, weighted_fusion
+from storage.journal import MemoryJournal
+from storage.keyword_index import BM25Index, tokenize
+from storage.local_storage import LocalStorageService, load_encoder
+from storage.onnx_encoder import mean_pool
+from storage.partitioned_storage import PartitionedLocalStorage
+from storage.process_encoder import ProcessPoolEncoder
+from storage.recency import RecencyScorer
+from storage.replay import FallbackReplayer
+from storage.replica import Mem0Replica
+from storage.vector_index import VectorIndex
+from storage.write_queue import WriteBehindQueue
+
+
+class KeywordEncoder:
+    """根据关键词生成确定性向量的测试编码器"""
+
+    VOCAB = ["咖啡", "python", "主题", "音乐", "跑步"]
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts):
+        self.calls += 1
+        vectors = np.zeros((len(texts), len(self.VOCAB) + 1), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for j, word in enumerate(self.VOCAB):
+                if word in text.lower():
+                    vectors[i, j] = 1.0
+            vectors[i, -1] = 0.1
+        return vectors
+
+
+def make_metadata(level: PrivacyLevel = PrivacyLevel.LEVEL_1_PUBLIC) -> Metadata:
+    return Metadata(privacy_level=level, source="test")
+
+
+@pytest.fixture
+def storage_path(tmp_path):
+    return os.path.join(tmp_path, "local_memories.jsonl")
+
+
+@pytest.fixture(params=["jsonl", "sqlite"])
+def service(request, storage_path):
+    return LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend=request.param)
+
+
+class TestVectorIndex:
+    """VectorIndex测试类"""
+
+    def test_search_returns_top_k_sorted(self):
+        index = VectorIndex()
+        index.add_batch(["a", "b", "c"], np.array([[1, 0], [0.6, 0.8], [0, 1]]), [1, 1, 1])
+
+        results = index.search([1, 0.1], top_k=2)
+
+        assert [memory_id for memory_id, _ in results] == ["a", "b"]
+        assert results[0][1] > results[1][1]
+
+    def test_privacy_filter(self):
+        index = VectorIndex()
+        index.add_batch(["a", "b"], np.array([[1, 0], [0.9, 0.1]]), [1, 2])
+
+        results = index.search([1, 0], top_k=5, privacy_level=2)
+
+        assert [memory_id for memory_id, _ in results] == ["b"]
+
+    def test_remove_keeps_rows_in_sync(self):
+        index = VectorIndex(InMemoryVectorStore(capacity=1))
+        index.add_batch(["a", "b", "c"], np.array([[1, 0], [0, 1], [1, 1]]), [1, 1, 1])
+
+        assert index.remove("a")
+        assert not index.remove("a")
+        assert len(index) == 2
+        assert index.search([0, 1], top_k=1)[0][0] == "b"
+
+    def test_recency_scorer_prefers_fresh_and_frequent(self):
+        index = VectorIndex()
+        now = time.time()
+        index.add_batch(["old", "new", "popular"], np.array([[1, 0], [1, 0], [1, 0]]), [1, 1, 1],
+                        timestamps=[now - 90 * 86400, now, now - 90 * 86400])
+        index.record_access(["popular", "popular"])
+        scorer = RecencyScorer(recency_weight=0.2, importance_weight=0.1, half_life_days=30)
+
+        results = index.search([1, 0], top_k=3, scorer=scorer)
+
+        assert [memory_id for memory_id, _ in results] == ["new", "popular", "old"]
+        assert results[0][1] == pytest.approx(0.7 + 0.2, abs=1e-3)
+        assert index.search([1, 0], top_k=3)[0][1] == pytest.approx(1.0)
+
+    def test_recency_scorer_rejects_invalid_weights(self):
+        with pytest.raises(ValueError):
+            RecencyScorer(recency_weight=0.8, importance_weight=0.5)
+
+
+class TestLocalStorageService:
+    """LocalStorageService测试类"""
+
+    def test_add_and_search(self, service):
+        service.add("用户喜欢喝咖啡", make_metadata())
+        service.add("项目使用Python开发", make_metadata())
+
+        results = service.search("咖啡", top_k=1)
+
+        assert len(results) == 1
+        assert results[0].context == "用户喜欢喝咖啡"
+
+    def test_search_with_metadata_filter(self, service):
+        service.add("用户喜欢喝咖啡", make_metadata(PrivacyLevel.LEVEL_1_PUBLIC))
+        service.add("用户喜欢喝咖啡和音乐", make_metadata(PrivacyLevel.LEVEL_2_INTERNAL))
+
+        results = service.search("咖啡", metadata_filter=make_metadata(PrivacyLevel.LEVEL_2_INTERNAL))
+
+        assert [r.context for r in results] == ["用户喜欢喝咖啡和音乐"]
+
+    def test_add_many_encodes_in_batches(self, service):
+        texts = [f"用户喜欢咖啡 {i}" for i in range(10)] + ["用户喜欢跑步"]
+
+        result = service.add_many(texts, make_metadata(), batch_size=4)
+
+        assert result == "ad-context批量记忆成功: 11 条"
+        assert service.encoder.calls == 3
+        assert len(service.list(limit=100)) == 11
+        assert service.search("跑步", top_k=1)[0].context == "用户喜欢跑步"
+
+    def test_search_with_filter_dict(self, service):
+        service.add("用户喜欢喝咖啡", make_metadata(PrivacyLevel.LEVEL_1_PUBLIC))
+        service.add("用户喜欢喝咖啡和音乐", make_metadata(PrivacyLevel.LEVEL_2_INTERNAL))
+        service.add("用户在咖啡店跑步", make_metadata(PrivacyLevel.LEVEL_3_RESTRICTED))
+        first_timestamp = service.list()[0]["timestamp"]
+
+        results = service.search("咖啡", metadata_filter={
+            "privacy_level": {"lte": 2},
+            "timestamp": {"gt": first_timestamp},
+        })
+
+        assert [r.context for r in results] == ["用户喜欢喝咖啡和音乐"]
+        assert len(service.list(filters={"privacy_level": {"in": [1, 3]}})) == 2
+
+    def test_list_page_walks_all_memories(self, service):
+        service.add_many([f"记忆 {i}" for i in range(5)], make_metadata())
+
+        first = service.list_page(limit=2)
+        second = service.list_page(limit=2, cursor=first.next_cursor)
+        third = service.list_page(limit=2, cursor=second.next_cursor)
+
+        assert [m["content"] for m in first.memories + second.memories + third.memories] == \
+            [f"记忆 {i}" for i in range(5)]
+        assert third.next_cursor is None
+        assert [m["content"] for m in service.iter_memories(page_size=2)] == [f"记忆 {i}" for i in range(5)]
+
+    def test_list_page_with_filter(self, service):
+        for i in range(4):
+            level = PrivacyLevel.LEVEL_1_PUBLIC if i % 2 == 0 else PrivacyLevel.LEVEL_2_INTERNAL
+            service.add(f"记忆 {i}", make_metadata(level))
+
+        first = service.list_page(limit=1, filters={"privacy_level": 2})
+        second = service.list_page(limit=1, cursor=first.next_cursor, filters={"privacy_level": 2})
+
+        assert [m["content"] for m in first.memories + second.memories] == ["记忆 1", "记忆 3"]
+        assert second.next_cursor is None
+
+    def test_cursor_survives_deleting_its_memory(self, service):
+        for i in range(4):
+            service.add(f"记忆 {i}", make_metadata())
+        first = service.list_page(limit=2)
+
+        service.delete(first.memories[-1]["id"])
+        rest = service.list_page(limit=10, cursor=first.next_cursor)
+
+        assert [m["content"] for m in rest.memories] == ["记忆 2", "记忆 3"]
+
+    def test_cursor_ignores_refreshed_timestamps(self, service):
+        for i in range(4):
+            service.add(f"记忆 {i}", make_metadata())
+        first = service.list_page(limit=2)
+
+        # 覆盖写入会刷新时间戳，但不改变写入顺序
+        memory = service.list(limit=1)[0]
+        service.upsert_many([dict(memory, content="记忆 0（已更新）", timestamp="2999-01-01T00:00:00")])
+        service.delete(first.memories[-1]["id"])
+        rest = service.list_page(limit=10, cursor=first.next_cursor)
+
+        assert [m["content"] for m in rest.memories] == ["记忆 2", "记忆 3"]
+
+    def test_write_order_survives_restart(self, service, storage_path):
+        for i in range(3):
+            service.add(f"记忆 {i}", make_metadata())
+        cursor = service.list_page(limit=1).next_cursor
+        service.close()
+
+        reopened = LocalStorageService(storage_path=storage_path, backend=service.backend, encoder=KeywordEncoder())
+        reopened.add("记忆 3", make_metadata())
+        rest = reopened.list_page(limit=10, cursor=cursor)
+        reopened.close()
+
+        assert [m["content"] for m in rest.memories] == ["记忆 1", "记忆 2", "记忆 3"]
+
+    def test_deleted_newest_seq_is_not_reused_after_restart(self, service, storage_path):
+        for i in range(3):
+            service.add(f"记忆 {i}", make_metadata())
+        cursor = service.list_page(limit=2).next_cursor
+        newest = service.list()[-1]
+        service.delete(newest["id"])
+        service.close()
+
+        reopened = LocalStorageService(storage_path=storage_path, backend=service.backend, encoder=KeywordEncoder())
+        reopened.add("记忆 3", make_metadata())
+        tail_cursor = reopened.list_page(limit=2).next_cursor
+        rest = reopened.list_page(limit=10, cursor=tail_cursor)
+        seqs = [memory["seq"] for memory in reopened.list()]
+        reopened.close()
+
+        assert cursor == tail_cursor
+        assert [m["content"] for m in rest.memories] == ["记忆 3"]
+        assert seqs == [1, 2, 4]
+
+    def test_legacy_memories_are_numbered_after_persisted_seqs(self, storage_path):
+        memory = {"content": "", "metadata": {"privacy_level": 1, "source": "test"}, "timestamp": "2025-01-01"}
+        with open(storage_path, "w", encoding="utf-8") as f:
+            for record in ({"op": "add", "memory": dict(memory, id="a", content="记忆 a")},
+                           {"op": "add", "memory": dict(memory, id="b", content="记忆 b")},
+                           {"op": "add", "memory": dict(memory, id="a", content="记忆 a", seq=1)}):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        service = LocalStorageService(storage_path=storage_path, backend="jsonl", encoder=KeywordEncoder())
+        first = service.list_page(limit=1)
+        rest = service.list_page(limit=10, cursor=first.next_cursor)
+        service.close()
+        reopened = LocalStorageService(storage_path=storage_path, backend="jsonl", encoder=KeywordEncoder())
+        seqs = {memory["id"]: memory["seq"] for memory in reopened.list()}
+        reopened.close()
+
+        assert [m["id"] for m in first.memories + rest.memories] == ["a", "b"]
+        assert seqs == {"a": 1, "b": 2}
+
+    def test_overwritten_memory_keeps_its_place_after_restart(self, service, storage_path):
+        for i in range(3):
+            service.add(f"记忆 {i}", make_metadata())
+        memory = service.list(limit=1)[0]
+        service.upsert_many([dict(memory, content="记忆 0（已更新）")])
+        service.close()
+
+        reopened = LocalStorageService(storage_path=storage_path, backend=service.backend, encoder=KeywordEncoder())
+        first = reopened.list_page(limit=1)
+        rest = reopened.list_page(limit=10, cursor=first.next_cursor)
+        reopened.close()
+
+        assert [m["content"] for m in first.memories + rest.memories] == ["记忆 0（已更新）", "记忆 1", "记忆 2"]
+
+    def test_ann_index_settings_from_env(self, storage_path, monkeypatch):
+        monkeypatch.setenv("LOCAL_ANN_INDEX", "true")
+        monkeypatch.setenv("LOCAL_ANN_NPROBE", "4")
+        monkeypatch.setenv("LOCAL_ANN_MIN_SIZE", "100")
+
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder())
+        ann = service.index.ann
+        service.close()
+
+        assert ann.nprobe == 4 and ann.min_train_size == 100
+
+    def test_embedding_precision_from_env(self, storage_path, monkeypatch):
+        monkeypatch.setenv("LOCAL_EMBEDDING_PRECISION", "int8")
+
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder())
+        precision = service.index.precision
+        service.close()
+
+        assert precision == "int8"
+
+    def test_search_mode_from_env(self, storage_path, monkeypatch):
+        monkeypatch.setenv("LOCAL_SEARCH_MODE", "hybrid")
+        monkeypatch.setenv("LOCAL_SEARCH_FUSION", "weighted")
+
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder())
+        service.close()
+
+        assert service.hybrid_search and service.fusion == "weighted"
+
+    def test_recency_settings_from_env(self, storage_path, monkeypatch):
+        monkeypatch.setenv("LOCAL_RECENCY_SCORING", "true")
+        monkeypatch.setenv("LOCAL_RECENCY_HALF_LIFE", "7")
+
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder())
+        service.close()
+
+        assert service.recency_scoring
+        assert service.recency_scorer.half_life == 7 * 86400.0
+
+    def test_invalid_cursor_raises(self, service):
+        with pytest.raises(ValueError):
+            service.list_page(cursor="not-a-cursor")
+
+    def test_recency_scoring_prefers_newer_memory(self, service):
+        service.add("用户喜欢喝咖啡", make_metadata())
+        service.add("用户喜欢喝咖啡!", make_metadata())
+        old_id = service.list()[0]["id"]
+        service.index._timestamps[service.index.row_of(old_id)] -= 365 * 86400
+
+        assert service.search("咖啡", top_k=1, recency=True)[0].context == "用户喜欢喝咖啡!"
+        assert service.search("咖啡", top_k=1)[0].context == "用户喜欢喝咖啡"
+
+    def test_access_counts_survive_reload(self, service, storage_path):
+        service.recency_scoring = True
+        service.add("用户喜欢喝咖啡", make_metadata())
+        service.add("用户喜欢跑步", make_metadata())
+        service.search("咖啡", top_k=1)
+        service.search("咖啡", top_k=1)
+        service.records.compact(service._snapshot)
+        service.close()
+
+        reloaded = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend=service.backend)
+        memory = reloaded.list()[0]
+
+        assert memory["access_count"] == 2
+        assert reloaded.index.signals([reloaded.index.row_of(memory["id"])])[1][0] == 2
+
+    def test_search_without_recency_scoring_records_no_access(self, service):
+        service.add("用户喜欢喝咖啡", make_metadata())
+        service.search("咖啡", top_k=1)
+
+        assert "access_count" not in service.list()[0]
+        assert not service._access_dirty
+
+    def test_access_counts_are_written_in_batches(self, storage_path, service):
+        service.close()
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend=service.backend,
+                                      recency_scoring=True, access_flush_size=2)
+        service.add("用户喜欢喝咖啡", make_metadata())
+        service.add("用户喜欢跑步", make_metadata())
+
+        service.search("咖啡", top_k=1)
+        assert "access_count" not in service.records.replay().popitem()[1]
+        service.search("跑步", top_k=1)
+        persisted = {memory["content"]: memory.get("access_count") for memory in service.records.replay().values()}
+        service.search("咖啡", top_k=1)
+        service.close()
+
+        reloaded = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend=service.backend)
+        counts = {memory["content"]: memory["access_count"] for memory in reloaded.list()}
+        reloaded.close()
+
+        assert persisted == {"用户喜欢喝咖啡": 1, "用户喜欢跑步": 1}
+        assert counts == {"用户喜欢喝咖啡": 2, "用户喜欢跑步": 1}
+
+    @pytest.mark.parametrize("mode", ["skip", "merge", "update"])
+    def test_near_duplicate_writes(self, storage_path, mode):
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(),
+                                      dedup_threshold=0.95, dedup_mode=mode)
+        service.add("用户喜欢喝咖啡", make_metadata())
+        original_id = service.list()[0]["id"]
+
+        message = service.add("用户很喜欢咖啡", make_metadata())
+        service.add("用户喜欢喝咖啡", make_metadata(PrivacyLevel.LEVEL_2_INTERNAL))
+        service.add("用户喜欢跑步", make_metadata())
+
+        memories = service.list()
+        assert len(memories) == 3
+        assert memories[0]["id"] == original_id
+        assert service.dedup_stats()["checked"] == 4
+        assert message.startswith("ad-context记忆成功: ")
+        if mode == "skip":
+            assert memories[0]["content"] == "用户喜欢喝咖啡"
+            assert service.dedup_stats()["skipped"] == 1
+        elif mode == "merge":
+            assert memories[0]["content"] == "用户喜欢喝咖啡"
+            assert memories[0]["duplicate_count"] == 1
+            assert service.dedup_stats()["merged"] == 1
+        else:
+            assert memories[0]["content"] == "用户很喜欢咖啡"
+            assert service.search("咖啡", top_k=1)[0].context == "用户很喜欢咖啡"
+            assert service.dedup_stats()["updated"] == 1
+        service.close()
+
+    def test_delete_removes_from_search(self, service):
+        service.add("用户喜欢喝咖啡", make_metadata())
+        memory_id = service.list()[0]["id"]
+
+        assert service.delete(memory_id)["deleted"]
+        assert service.search("咖啡") == []
+
+    def test_reload_from_disk(self, service, storage_path):
+        service.add("用户喜欢喝咖啡", make_metadata())
+        service.add("用户喜欢跑步", make_metadata())
+
+        reloaded = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend=service.backend)
+
+        assert len(reloaded.list()) == 2
+        assert reloaded.search("跑步", top_k=1)[0].context == "用户喜欢跑步"
+
+    def test_text_fallback_without_encoder(self, storage_path):
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder())
+        service.encoder = None
+        service.add("user likes coffee", make_metadata())
+
+        results = service.search("coffee")
+
+        assert results[0].context == "user likes coffee"
+
+    def test_keyword_fallback_matches_cjk_without_spaces(self, storage_path):
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder())
+        service.encoder = None
+        service.add("用户喜欢喝咖啡", make_metadata())
+        service.add("用户喜欢跑步", make_metadata(PrivacyLevel.LEVEL_2_INTERNAL))
+        service.add("今天天气不错", make_metadata())
+
+        assert [r.context for r in service.search("咖啡")] == ["用户喜欢喝咖啡"]
+        assert [r.context for r in service.search("喜欢", metadata_filter=make_metadata())] == ["用户喜欢喝咖啡"]
+
+        service.delete(service.list()[0]["id"])
+        assert service.search("咖啡") == []
+
+    @pytest.mark.parametrize("fusion", ["rrf", "weighted"])
+    def test_hybrid_search_finds_exact_keywords(self, storage_path, fusion):
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(),
+                                      hybrid_search=True, fusion=fusion)
+        service.add_many(["用户喜欢喝咖啡", "订单 SKU-12345 已发货", "订单 SKU-67890 已签收", "用户喜欢跑步"],
+                         make_metadata())
+
+        assert service.search("SKU-12345", top_k=1)[0].context == "订单 SKU-12345 已发货"
+        assert service.search("咖啡", top_k=1)[0].context == "用户喜欢喝咖啡"
+        assert service.search("SKU-12345", top_k=1, metadata_filter={"privacy_level": 2}) == []
+
+    def test_background_encoder_loading(self, storage_path, monkeypatch):
+        release = threading.Event()
+
+        def slow_load(backend, model_name, *args):
+            release.wait()
+            return KeywordEncoder()
+
+        monkeypatch.setattr("storage.local_storage.load_encoder", slow_load)
+        service = LocalStorageService(storage_path=storage_path)
+        service.add("用户喜欢喝咖啡", make_metadata())
+
+        assert not service.encoder_ready
+        assert service.search("咖啡")[0].context == "用户喜欢喝咖啡"
+
+        release.set()
+
+        assert service.wait_for_encoder(timeout=5)
+        assert len(service.index) == 1
+        service.close()
+        assert service.records.replay()[service.list()[0]["id"]]["embedding_row"] == 0
+
+    def test_encoder_load_failure_keeps_keyword_search(self, storage_path, monkeypatch):
+        def broken_load(backend, model_name, *args):
+            raise ImportError("未安装 sentence_transformers")
+
+        monkeypatch.setattr("storage.local_storage.load_encoder", broken_load)
+        service = LocalStorageService(storage_path=storage_path, background_encoder=False)
+        service.add("user likes coffee", make_metadata())
+
+        assert not service.wait_for_encoder(timeout=1)
+        assert service.search("coffee")[0].context == "user likes coffee"
+
+    @pytest.mark.parametrize("backend", ["jsonl", "sqlite"])
+    def test_vector_compaction_after_deletes(self, storage_path, backend):
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend=backend,
+                                      vector_compact_min_dead=2)
+        service.add_many(["用户喜欢喝咖啡", "用户喜欢跑步", "用户喜欢音乐", "python 项目", "深色主题"], make_metadata())
+        memories = {memory["content"]: memory["id"] for memory in service.list()}
+        old_path = service.embedding_path
+        for content in ["用户喜欢喝咖啡", "用户喜欢音乐"]:
+            service.delete(memories[content])
+        service.wait_for_compaction()
+
+        assert service.embedding_path.endswith(".1.f32")
+        assert not os.path.exists(old_path)
+        assert len(service.embedding_store) == 3
+        assert service.search("跑步", top_k=1)[0].context == "用户喜欢跑步"
+        service.add("用户喜欢喝咖啡", make_metadata())
+        service.close()
+
+        reloaded = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend=backend)
+
+        assert reloaded.embedding_path.endswith(".1.f32")
+        assert [r.context for r in reloaded.search("主题", top_k=1)] == ["深色主题"]
+        assert [r.context for r in reloaded.search("咖啡", top_k=1)] == ["用户喜欢喝咖啡"]
+
+    def test_stale_embedding_generations_removed(self, storage_path):
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder())
+        service.add("用户喜欢跑步", make_metadata())
+        service.close()
+        stale = os.path.splitext(storage_path)[0] + ".3.f32"
+        with open(stale, "wb") as f:
+            f.write(b"partial")
+
+        LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder())
+
+        assert not os.path.exists(stale)
+        assert os.path.exists(service.embedding_path)
+
+    def test_migrates_legacy_json(self, tmp_path, storage_path):
+        legacy_path = os.path.join(tmp_path, "local_memories.json")
+        with open(legacy_path, "w", encoding="utf-8") as f:
+            json.dump({"memories": [{
+                "id": "legacy",
+                "content": "用户喜欢喝咖啡",
+                "metadata": {"privacy_level": 1, "source": "test"},
+                "embedding": KeywordEncoder().encode(["咖啡"])[0].tolist(),
+            }]}, f)
+
+        service = LocalStorageService(storage_path=legacy_path, encoder=KeywordEncoder())
+
+        assert os.path.exists(storage_path)
+        assert service.search("咖啡")[0].context == "用户喜欢喝咖啡"
+
+    def test_embeddings_stored_outside_journal(self, storage_path):
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend="jsonl")
+        service.add("用户喜欢喝咖啡", make_metadata())
+        service.close()
+
+        with open(storage_path, encoding="utf-8") as f:
+            record = json.loads(f.readline())
+
+        assert "embedding" not in record["memory"]
+        assert record["memory"]["embedding_row"] == 0
+        assert len(EmbeddingStore(service.embedding_path)) == 1
+
+    def test_sqlite_migrates_journal(self, storage_path):
+        journal_service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend="jsonl")
+        journal_service.add("用户喜欢跑步", make_metadata())
+        journal_service.close()
+
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), backend="sqlite")
+
+        assert service.storage_path.endswith(".sqlite3")
+        assert service.search("跑步", top_k=1)[0].context == "用户喜欢跑步"
+
+    def test_repeated_queries_hit_cache(self, service):
+        service.add("用户喜欢喝咖啡", make_metadata())
+        calls = service.encoder.calls
+
+        service.search("咖啡")
+        service.search("  咖啡 ")
+
+        assert service.encoder.calls == calls + 1
+        assert service.embedding_cache.stats()["memory_hits"] == 1
+
+
+class TestPartitionedLocalStorage:
+    """PartitionedLocalStorage测试类"""
+
+    @pytest.fixture
+    def partitions(self, tmp_path):
+        storage = PartitionedLocalStorage(root_path=os.path.join(tmp_path, "partitions"), encoder=KeywordEncoder(),
+                                          max_open_partitions=1,
+                                          legacy_storage_path=os.path.join(tmp_path, "local_memories.jsonl"))
+        yield storage
+        storage.close()
+
+    def test_users_are_isolated(self, partitions):
+        partitions.add("用户喜欢喝咖啡", make_metadata(), user_id="alice")
+        partitions.add("用户喜欢跑步", make_metadata(), user_id="bob")
+
+        assert [r.context for r in partitions.search("咖啡", user_id="alice")] == ["用户喜欢喝咖啡"]
+        assert [r.context for r in partitions.search("咖啡", user_id="bob")] == ["用户喜欢跑步"]
+        assert len(partitions.list(user_id="alice")) == 1
+
+    def test_lru_eviction_keeps_data(self, partitions):
+        partitions.add("用户喜欢喝咖啡", make_metadata(), user_id="alice")
+        partitions.add("用户喜欢跑步", make_metadata(), user_id="bob")
+
+        assert partitions.stats()["open_partitions"] == 1
+        assert partitions.stats()["evicted"] == 1
+        assert partitions.search("咖啡", top_k=1, user_id="alice")[0].context == "用户喜欢喝咖啡"
+        assert partitions.stats()["opened"] == 3
+
+    def test_dedup_counts_survive_eviction(self, tmp_path):
+        partitions = PartitionedLocalStorage(root_path=os.path.join(tmp_path, "partitions"), encoder=KeywordEncoder(),
+                                             max_open_partitions=1, legacy_storage_path=None, dedup_threshold=0.95)
+        partitions.add("用户喜欢喝咖啡", make_metadata(), user_id="alice")
+        partitions.add("用户喜欢喝咖啡", make_metadata(), user_id="alice")
+        partitions.add("用户喜欢喝咖啡", make_metadata(), user_id="bob")
+
+        assert partitions.stats()["dedup"]["skipped"] == 1
+        assert partitions.stats()["dedup"]["checked"] == 3
+        partitions.close()
+
+    def test_partitions_share_encoder(self, partitions):
+        with partitions.partition("alice") as alice:
+            assert alice.encoder is partitions.encoder
+            assert alice.embedding_cache is None
+
+    def test_partition_path_is_sanitized(self, partitions):
+        path = partitions.partition_path("../etc")
+
+        assert os.path.dirname(os.path.dirname(path)) == partitions.root_path
+        assert partitions.partition_path("Alice") != partitions.partition_path("alice")
+
+    def test_default_user_keeps_legacy_store(self, tmp_path):
+        legacy_path = os.path.join(tmp_path, "local_memories.jsonl")
+        legacy = LocalStorageService(storage_path=legacy_path, encoder=KeywordEncoder())
+        legacy.add("用户喜欢喝咖啡", make_metadata())
+        legacy.close()
+
+        partitions = PartitionedLocalStorage(root_path=os.path.join(tmp_path, "partitions"),
+                                             encoder=KeywordEncoder(), legacy_storage_path=legacy_path)
+        try:
+            assert partitions.partition_path(partitions.DEFAULT_USER_ID) == legacy_path
+            assert partitions.search("咖啡", top_k=1)[0].context == "用户喜欢喝咖啡"
+        finally:
+            partitions.close()
+
+
+class TestEmbeddingCache:
+    """EmbeddingCache测试类"""
+
+    def test_lru_eviction(self):
+        cache = EmbeddingCache(max_entries=2)
+        cache.put_many({"a": np.ones(2), "b": np.ones(2)})
+        cache.get("a")
+        cache.put_many({"c": np.ones(2)})
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        path = os.path.join(tmp_path, "cache.sqlite3")
+        encoder = KeywordEncoder()
+        CachedEncoder(encoder, EmbeddingCache(disk_path=path), "model").encode(["咖啡"])
+
+        cache = EmbeddingCache(disk_path=path)
+        vectors = CachedEncoder(encoder, cache, "model").encode(["咖啡", "咖啡"])
+
+        assert encoder.calls == 1
+        assert vectors.shape == (2, len(KeywordEncoder.VOCAB) + 1)
+        assert cache.stats()["disk_hits"] == 1
+
+    def test_model_name_is_part_of_key(self):
+        encoder = KeywordEncoder()
+        cache = EmbeddingCache()
+        CachedEncoder(encoder, cache, "model-a").encode(["咖啡"])
+        CachedEncoder(encoder, cache, "model-b").encode(["咖啡"])
+
+        assert encoder.calls == 2
+
+
+class TestBM25Index:
+    """BM25Index测试类"""
+
+    def test_tokenize_cjk_bigrams_and_words(self):
+        assert tokenize("喝咖啡 Python3") == ["喝", "咖", "啡", "喝咖", "咖啡", "python3"]
+
+    def test_rare_terms_rank_higher(self):
+        index = BM25Index()
+        index.add("a", "用户喜欢喝咖啡")
+        index.add("b", "用户喜欢跑步")
+        index.add("c", "用户喜欢音乐")
+
+        results = index.search("喜欢咖啡")
+
+        assert results[0][0] == "a"
+        assert all(0 < score < 1 for _, score in results)
+
+    def test_remove_and_replace(self):
+        index = BM25Index()
+        index.add("a", "咖啡")
+        index.add("a", "跑步")
+        index.add("b", "咖啡")
+        index.remove("b")
+
+        assert index.search("咖啡") == []
+        assert [doc_id for doc_id, _ in index.search("跑步")] == ["a"]
+
+    def test_top_k_selection_respects_filter(self):
+        index = BM25Index()
+        for i in range(10):
+            index.add(str(i), "咖啡 " * (i + 1) + "用户")
+
+        results = index.search("咖啡", top_k=3, allowed=lambda doc_id: doc_id != "9")
+
+        assert [doc_id for doc_id, _ in results] == ["8", "7", "6"]
+
+
+class TestEncoderBackends:
+    """编码器后端测试类"""
+
+    def test_mean_pool_ignores_padding(self):
+        hidden = np.array([[[1.0, 0.0], [0.0, 1.0], [9.0, 9.0]]], dtype=np.float32)
+        mask = np.array([[1, 1, 0]])
+
+        np.testing.assert_allclose(mean_pool(hidden, mask), [[np.sqrt(0.5), np.sqrt(0.5)]], rtol=1e-6)
+
+    def test_invalid_backend_settings(self, storage_path):
+        with pytest.raises(ValueError):
+            LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), encoder_backend="tf")
+        with pytest.raises(ValueError):
+            load_encoder("onnx", LocalStorageService.MODEL_NAME, onnx_model_path=None)
+
+
+class TestMicroBatchingEncoder:
+    """MicroBatchingEncoder测试类"""
+
+    def test_concurrent_requests_share_one_batch(self):
+        encoder = KeywordEncoder()
+        batching = MicroBatchingEncoder(encoder, max_batch_size=32, max_wait_ms=200)
+
+        futures = [batching.submit([text]) for text in ["咖啡", "跑步", "音乐"]]
+        vectors = [future.result(timeout=5) for future in futures]
+        batching.close()
+
+        assert encoder.calls == 1
+        np.testing.assert_array_equal(np.concatenate(vectors), encoder.encode(["咖啡", "跑步", "音乐"]))
+        assert batching.stats()["avg_batch_size"] == 3
+
+    def test_max_batch_size_and_errors(self):
+        batching = MicroBatchingEncoder(KeywordEncoder(), max_batch_size=2, max_wait_ms=200)
+
+        futures = [batching.submit([text]) for text in ["咖啡", "跑步", "音乐"]]
+        for future in futures:
+            future.result(timeout=5)
+
+        assert batching.stats()["batches"] == 2
+        batching.encoder = None
+        with pytest.raises(AttributeError):
+            batching.encode(["咖啡"])
+        batching.close()
+
+    def test_service_with_micro_batching(self, storage_path):
+        service = LocalStorageService(storage_path=storage_path, encoder=KeywordEncoder(), micro_batch_size=8)
+        service.add("用户喜欢喝咖啡", make_metadata())
+
+        assert service.search("咖啡", top_k=1)[0].context == "用户喜欢喝咖啡"
+        assert service.batching_encoder.stats()["requests"] == 2
+        service.close()
+
+
+class TestProcessPoolEncoder:
+    """ProcessPoolEncoder测试类"""
+
+    def test_encodes_in_worker_process(self):
+        encoder = ProcessPoolEncoder(KeywordEncoder, processes=1)
+        try:
+            vectors = encoder.encode(["咖啡", "跑步"])
+        finally:
+            encoder.close()
+
+        np.testing.assert_array_equal(vectors, KeywordEncoder().encode(["咖啡", "跑步"]))
+
+    def test_worker_errors_propagate(self):
+        encoder = ProcessPoolEncoder(load_encoder, ("onnx", LocalStorageService.MODEL_NAME), processes=1)
+        try:
+            with pytest.raises(Exception):
+                encoder.encode(["咖啡"])
+        finally:
+            encoder.close()
+
+
+class TestFusion:
+    """检索结果融合测试类"""
+
+    def test_rrf_prefers_documents_ranked_high_in_both_lists(self):
+        fused = reciprocal_rank_fusion([[("a", 0.9), ("b", 0.8)], [("b", 5.0), ("c", 1.0)]])
+
+        assert [doc_id for doc_id, _ in fused] == ["b", "a", "c"]
+        assert reciprocal_rank_fusion([[("a", 0.1)], [("a", 0.2)]]) == [("a", 1.0)]
+
+    def test_weighted_fusion(self):
+        fused = weighted_fusion([[("a", 0.9), ("b", 0.2)], [("b", 0.9)]], [0.5, 0.5])
+
+        assert fused == [("b", pytest.approx(0.55)), ("a", pytest.approx(0.45))]
+
+
+class TestFilters:
+    """元数据过滤条件测试类"""
+
+    def test_metadata_object_means_privacy_equality(self):
+        assert normalize_filter(make_metadata(PrivacyLevel.LEVEL_2_INTERNAL)) == [("privacy_level", "eq", 2)]
+
+    def test_matches_and_sql_agree(self):
+        conditions = normalize_filter({"privacy_level": {"lte": PrivacyLevel.LEVEL_2_INTERNAL}, "source": "test"})
+        memory = {"metadata": {"privacy_level": 1, "source": "test"}, "timestamp": "2025-07-23"}
+
+        assert matches(memory, conditions)
+        assert not matches({"metadata": {"privacy_level": 3, "source": "test"}}, conditions)
+        assert to_sql(conditions) == ("privacy_level <= ? AND source = ?", [2, "test"])
+
+    def test_unknown_field_rejected(self):
+        with pytest.raises(ValueError):
+            normalize_filter({"content": "x"})
+
+
+class TestEmbeddingStore:
+    """EmbeddingStore测试类"""
+
+    def test_append_and_reopen(self, tmp_path):
+        path = os.path.join(tmp_path, "vectors.f32")
+        store = EmbeddingStore(path, fsync=False)
+        assert store.append(np.ones((2, 3))) == 0
+        assert store.append(np.zeros((1, 3))) == 2
+        store.close()
+
+        reopened = EmbeddingStore(path)
+
+        assert reopened.dim == 3
+        assert reopened.matrix.shape == (3, 3)
+        assert reopened.matrix[1].tolist() == [1.0, 1.0, 1.0]
+
+    def test_truncated_row_is_dropped(self, tmp_path):
+        path = os.path.join(tmp_path, "vectors.f32")
+        store = EmbeddingStore(path, fsync=False)
+        store.append(np.ones((1, 4)))
+        store.close()
+        with open(path, "ab") as f:
+            f.write(b"\x00" * 6)
+
+        assert len(EmbeddingStore(path)) == 1
+
+    @pytest.mark.parametrize("precision", ["float16", "int8"])
+    def test_quantized_search_matches_exact(self, precision):
+        rng = np.random.default_rng(2)
+        vectors = rng.standard_normal((4096, 16)).astype(np.float32)
+        index = VectorIndex(precision=precision, rescore_factor=4)
+        index.add_batch([str(i) for i in range(4096)], vectors, [1] * 4096)
+
+        for query in vectors[:10]:
+            assert index.search(query, top_k=5) == index.search(query, top_k=5, exact=True)
+        assert index.quantized.nbytes < 4096 * 16 * 4
+
+    def test_quantized_rows_rebuilt_on_attach(self):
+        store = InMemoryVectorStore()
+        store.append(np.eye(3, dtype=np.float32))
+        index = VectorIndex(store, precision="int8")
+        index.attach_batch(["a", "b", "c"], [0, 1, 2], [1, 1, 1])
+
+        assert index.search([0, 1, 0], top_k=1)[0][0] == "b"
+
+
+class TestIVFIndex:
+    """IVFIndex测试类"""
+
+    def make_index(self, size=500):
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((size, 8)).astype(np.float32)
+        index = VectorIndex(ann=IVFIndex(nlist=8, nprobe=8, min_train_size=size))
+        index.add_batch([str(i) for i in range(size)], vectors, [1] * size)
+        index.wait_for_ann()
+        return index, vectors
+
+    def test_full_probe_matches_exact(self):
+        index, vectors = self.make_index()
+
+        assert index.ann.trained
+        assert index.search(vectors[3], top_k=5) == index.search(vectors[3], top_k=5, exact=True)
+
+    def test_incremental_add_and_persistence(self, tmp_path):
+        index, _ = self.make_index()
+        index.add("new", np.ones(8), 1)
+        path = os.path.join(tmp_path, "index.ivf.npz")
+        index.ann.save(path)
+
+        loaded = IVFIndex()
+        assert loaded.load(path)
+        assert loaded.nlist == 8
+        assert loaded.row_count == 501
+        assert index.search(np.ones(8), top_k=1, nprobe=1)[0][0] == "new"
+
+
+class TestMemoryJournal:
+    """MemoryJournal测试类"""
+
+    def test_replay_applies_tombstones(self, tmp_path):
+        path = os.path.join(tmp_path, "journal.jsonl")
+        journal = MemoryJournal(path, fsync=False)
+        journal.replay()
+        journal.append_add({"id": "a", "content": "1"})
+        journal.append_add({"id": "b", "content": "2"})
+        journal.append_delete("a")
+        journal.close()
+
+        memories = MemoryJournal(path).replay()
+
+        assert list(memories) == ["b"]
+
+    def test_replay_drops_truncated_tail(self, tmp_path):
+        path = os.path.join(tmp_path, "journal.jsonl")
+        journal = MemoryJournal(path, fsync=False)
+        journal.replay()
+        journal.append_add({"id": "a", "content": "1"})
+        journal.close()
+        with open(path, "ab") as f:
+            f.write(b'{"op": "add", "memory": {"id": "b"')
+
+        journal = MemoryJournal(path)
+        memories = journal.replay()
+        journal.append_add({"id": "c", "content": "3"})
+        journal.close()
+
+        assert list(memories) == ["a"]
+        assert list(MemoryJournal(path).replay()) == ["a", "c"]
+
+    def test_compaction_keeps_live_records(self, tmp_path):
+        path = os.path.join(tmp_path, "journal.jsonl")
+        journal = MemoryJournal(path, fsync=False, compact_min_records=4, compact_ratio=1.5)
+        memories = journal.replay()
+        for memory_id in ["a", "b", "c"]:
+            memories[memory_id] = {"id": memory_id}
+            journal.append_add(memories[memory_id])
+        for memory_id in ["a", "b"]:
+            del memories[memory_id]
+            journal.append_delete(memory_id)
+
+        journal.maybe_compact(len(memories), lambda: list(memories.values()))
+        journal.wait_for_compaction()
+        journal.close()
+
+        assert journal.record_count == 1
+        assert list(MemoryJournal(path).replay()) == ["c"]
+
+    def test_meta_survives_compaction(self, tmp_path):
+        path = os.path.join(tmp_path, "journal.jsonl")
+        journal = MemoryJournal(path, fsync=False)
+        journal.replay()
+        journal.append_add({"id": "a"})
+        journal.compact(lambda: [{"id": "a"}], meta={"embedding_file": "x.1.f32"})
+        journal.compact(lambda: [{"id": "a"}])
+        journal.close()
+
+        reopened = MemoryJournal(path)
+
+        assert list(reopened.replay()) == ["a"]
+        assert reopened.meta == {"embedding_file": "x.1.f32"}
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker:
+    def make_breaker(self, **kwargs):
+        clock = FakeClock()
+        options = dict(window_size=4, failure_rate_threshold=0.5, min_calls=4, open_timeout=30.0, clock=clock)
+        options.update(kwargs)
+        return CircuitBreaker(**options), clock
+
+    @staticmethod
+    def fail():
+        raise RuntimeError("boom")
+
+    def test_single_failure_keeps_circuit_closed(self):
+        breaker, _ = self.make_breaker()
+
+        with pytest.raises(RuntimeError):
+            breaker.call(self.fail)
+
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.call(lambda: "ok") == "ok"
+
+    def test_opens_when_failure_rate_reaches_threshold(self):
+        breaker, _ = self.make_breaker()
+        breaker.call(lambda: None)
+        breaker.call(lambda: None)
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                breaker.call(self.fail)
+
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.call(lambda: None)
+        assert breaker.stats()["rejected"] == 1
+
+    def test_half_open_trial_closes_or_reopens(self):
+        breaker, clock = self.make_breaker(min_calls=1)
+        with pytest.raises(RuntimeError):
+            breaker.call(self.fail)
+
+        clock.now = 31.0
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(RuntimeError):
+            breaker.call(self.fail)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        clock.now = 62.0
+        assert breaker.call(lambda: "ok") == "ok"
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.stats()["transitions"] == {
+            "closed->open": 1, "open->half_open": 2, "half_open->open": 1, "half_open->closed": 1,
+        }
+
+    def test_half_open_limits_trial_calls(self):
+        breaker, clock = self.make_breaker(min_calls=1)
+        breaker.force_open()
+        clock.now = 31.0
+
+        assert breaker.allow_request()
+        assert not breaker.allow_request()
+
+    def test_probe_success_closes_circuit(self):
+        probes = []
+        breaker = CircuitBreaker(min_calls=1, open_timeout=3600, probe=lambda: probes.append(1),
+                                 probe_interval=0.01)
+
+        breaker.force_open()
+        deadline = time.time() + 5
+        while breaker.state != CircuitBreaker.CLOSED and time.time() < deadline:
+            time.sleep(0.01)
+        breaker.close()
+
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert probes
+        assert breaker.stats()["probe_successes"] == 1
+
+
+class TestWriteBehindQueue:
+    def test_drains_entries_in_order(self, tmp_path):
+        submitted = []
+        queue = WriteBehindQueue(os.path.join(tmp_path, "queue.db"), submitted.append, batch_size=2,
+                                 max_concurrency=1, fsync=False)
+        for i in range(3):
+            queue.enqueue({"text": f"记忆 {i}"})
+
+        assert queue.stats()["depth"] == 3
+        assert queue.drain_once() == 2
+        assert queue.drain_once() == 1
+        assert [entry["text"] for entry in submitted] == ["记忆 0", "记忆 1", "记忆 2"]
+        assert queue.stats()["depth"] == 0
+        assert queue.stats()["submitted"] == 3
+        queue.close()
+
+    def test_failed_entries_retry_then_die(self, tmp_path):
+        def submit(entry):
+            raise RuntimeError("boom")
+
+        queue = WriteBehindQueue(os.path.join(tmp_path, "queue.db"), submit, max_attempts=2,
+                                 retry_base_delay=0.0, fsync=False)
+        queue.enqueue({"text": "a"})
+
+        queue.drain_once()
+        assert queue.stats()["depth"] == 1
+        queue.drain_once()
+        stats = queue.stats()
+        queue.close()
+
+        assert stats["depth"] == 0
+        assert stats["dead"] == 1
+        assert stats["retried"] == 1
+
+    def test_dead_entries_are_handed_off(self, tmp_path):
+        def submit(entry):
+            raise RuntimeError("boom")
+
+        handed_off = []
+        queue = WriteBehindQueue(os.path.join(tmp_path, "queue.db"), submit, max_attempts=1,
+                                 retry_base_delay=0.0, fsync=False, on_dead=handed_off.append)
+        queue.enqueue({"text": "a"})
+
+        queue.drain_once()
+        stats = queue.stats()
+        queue.close()
+
+        assert handed_off == [{"text": "a"}]
+        assert stats["dead"] == 0
+        assert stats["handed_off"] == 1
+
+    def test_dead_entries_can_be_redriven(self, tmp_path):
+        fail = [True]
+        submitted = []
+
+        def submit(entry):
+            if fail[0]:
+                raise RuntimeError("boom")
+            submitted.append(entry)
+
+        def on_dead(entry):
+            raise RuntimeError("local storage unavailable")
+
+        queue = WriteBehindQueue(os.path.join(tmp_path, "queue.db"), submit, max_attempts=1,
+                                 retry_base_delay=0.0, fsync=False, on_dead=on_dead)
+        queue.enqueue({"text": "a"})
+        queue.drain_once()
+        assert queue.stats()["dead"] == 1
+
+        fail[0] = False
+        assert queue.redrive() == 1
+        queue.drain_once()
+        stats = queue.stats()
+        queue.close()
+
+        assert submitted == [{"text": "a"}]
+        assert stats["dead"] == 0
+        assert stats["redriven"] == 1
+
+    def test_open_circuit_does_not_consume_attempts(self, tmp_path):
+        def submit(entry):
+            raise CircuitOpenError("open")
+
+        queue = WriteBehindQueue(os.path.join(tmp_path, "queue.db"), submit, max_attempts=1,
+                                 retry_base_delay=0.0, fsync=False)
+        queue.enqueue({"text": "a"})
+
+        queue.drain_once()
+        queue.drain_once()
+        stats = queue.stats()
+        queue.close()
+
+        assert stats["depth"] == 1
+        assert stats["dead"] == 0
+
+    def test_pending_entries_survive_restart(self, tmp_path):
+        path = os.path.join(tmp_path, "queue.db")
+        queue = WriteBehindQueue(path, lambda entry: None, fsync=False)
+        queue.enqueue({"text": "a"})
+        queue.close()
+
+        submitted = []
+        reopened = WriteBehindQueue(path, submitted.append, fsync=False)
+        reopened.start()
+        assert reopened.flush(timeout=5)
+        reopened.close()
+
+        assert submitted == [{"text": "a"}]
+
+
+class TestFallbackReplayer:
+    def make_storage(self, tmp_path):
+        return PartitionedLocalStorage(root_path=str(tmp_path / "partitions"), encoder=KeywordEncoder(),
+                                       legacy_storage_path=None, fsync=False)
+
+    def test_replays_and_removes_local_copies(self, tmp_path):
+        storage = self.make_storage(tmp_path)
+        storage.add("喜欢咖啡", make_metadata(), user_id="alice")
+        storage.add("银行卡号", make_metadata(PrivacyLevel.LEVEL_3_RESTRICTED), user_id="alice")
+        storage.add("在学 python", make_metadata(), user_id="bob")
+        local_ids = {memory["content"]: memory["id"] for user in ("alice", "bob")
+                     for memory in storage.list(user_id=user)}
+        submitted = []
+
+        def submit(memory):
+            submitted.append(memory["content"])
+            return [f"mem0-{len(submitted)}"]
+
+        replayer = FallbackReplayer(storage, submit, path=str(tmp_path / "replay.db"))
+        counts = replayer.replay()
+
+        assert sorted(storage.user_ids()) == ["alice", "bob"]
+        assert counts == {"replayed": 2, "skipped_sensitive": 1, "already_replayed": 0, "failed": 0,
+                          "unconfirmed": 0}
+        assert sorted(submitted) == ["喜欢咖啡", "在学 python"]
+        assert [memory["content"] for memory in storage.list(user_id="alice")] == ["银行卡号"]
+        assert storage.list(user_id="bob") == []
+        assert replayer.mem0_ids(local_ids["喜欢咖啡"]) is not None
+        replayer.close()
+        storage.close()
+
+    def test_failed_replay_keeps_local_copy_for_retry(self, tmp_path):
+        storage = self.make_storage(tmp_path)
+        storage.add("喜欢咖啡", make_metadata(), user_id="alice")
+
+        def submit(memory):
+            raise CircuitOpenError("open")
+
+        replayer = FallbackReplayer(storage, submit, path=str(tmp_path / "replay.db"))
+        counts = replayer.replay()
+
+        assert counts["failed"] == 1
+        assert len(storage.list(user_id="alice")) == 1
+        replayer.close()
+        storage.close()
+
+    def test_replay_without_mem0_ids_keeps_local_copy(self, tmp_path):
+        storage = self.make_storage(tmp_path)
+        storage.add("喜欢咖啡", make_metadata(), user_id="alice")
+        local_id = storage.list(user_id="alice")[0]["id"]
+
+        replayer = FallbackReplayer(storage, lambda memory: [], path=str(tmp_path / "replay.db"))
+        counts = replayer.replay(["alice"])
+
+        assert counts["unconfirmed"] == 1
+        assert counts["replayed"] == 0
+        assert replayer.mem0_ids(local_id) is None
+        assert len(storage.list(user_id="alice")) == 1
+        replayer.close()
+        storage.close()
+
+    def test_interrupted_replay_looks_up_mem0_before_resubmitting(self, tmp_path):
+        storage = self.make_storage(tmp_path)
+        storage.add("喜欢咖啡", make_metadata(), user_id="alice")
+        local_id = storage.list(user_id="alice")[0]["id"]
+        path = str(tmp_path / "replay.db")
+        interrupted = FallbackReplayer(storage, lambda memory: [], path=path)
+        interrupted._record([(local_id, "alice", "pending", [])])
+        interrupted.close()
+        submitted = []
+
+        replayer = FallbackReplayer(storage, lambda memory: submitted.append(memory) or ["new"],
+                                    lookup=lambda memory: ["existing"], path=path)
+        replayer.replay(["alice"])
+
+        assert submitted == []
+        assert replayer.mem0_ids(local_id) == ["existing"]
+        replayer.close()
+        storage.close()
+
+
+class TestMem0Replica:
+    def make_replica(self, tmp_path, pages, **kwargs):
+        clock = FakeClock()
+        requests = []
+
+        def fetch_page(user_id, updated_since, page, page_size):
+            requests.append(updated_since)
+            return pages.pop(0) if pages else {"results": [], "next": None}
+
+        storage = PartitionedLocalStorage(root_path=str(tmp_path / "replica"), encoder=KeywordEncoder(),
+                                          legacy_storage_path=None, fsync=False)
+        replica = Mem0Replica(fetch_page, storage, max_staleness=60, clock=clock, **kwargs)
+        return replica, clock, requests
+
+    @staticmethod
+    def mem0_memory(memory_id, text, updated_at="2026-10-01T08:00:00+00:00"):
+        return {"id": memory_id, "memory": text, "metadata": {"privacy_level": 1, "source": "test"},
+                "updated_at": updated_at}
+
+    def test_fresh_replica_serves_search(self, tmp_path):
+        pages = [{"results": [self.mem0_memory("m1", "喜欢咖啡")], "next": "page=2"},
+                 {"results": [self.mem0_memory("m2", "在学 python")], "next": None}]
+        replica, clock, _ = self.make_replica(tmp_path, pages)
+
+        assert not replica.is_fresh("alice")
+        assert replica.sync("alice") == {"fetched": 2, "upserted": 2, "deleted": 0}
+
+        assert replica.is_fresh("alice")
+        assert [r.context for r in replica.search("咖啡", top_k=1, user_id="alice")] == ["喜欢咖啡"]
+        clock.now = 61
+        assert not replica.is_fresh("alice")
+        replica.close()
+
+    def test_writes_invalidate_until_next_sync(self, tmp_path):
+        replica, _, _ = self.make_replica(tmp_path, [{"results": [self.mem0_memory("m1", "喜欢咖啡")]}])
+        replica.sync("alice")
+
+        replica.invalidate("alice")
+        assert not replica.is_fresh("alice")
+        replica.sync("alice")
+        assert replica.is_fresh("alice")
+        replica.close()
+
+    def test_incremental_sync_uses_watermark_and_full_sync_removes_deleted(self, tmp_path):
+        pages = [
+            {"results": [self.mem0_memory("m1", "喜欢咖啡"), self.mem0_memory("m2", "在学 python")]},
+            {"results": [self.mem0_memory("m2", "在学 python 和音乐", "2026-10-02T08:00:00+00:00")]},
+            {"results": [self.mem0_memory("m2", "在学 python 和音乐", "2026-10-02T08:00:00+00:00")]},
+        ]
+        replica, _, requests = self.make_replica(tmp_path, pages)
+        replica.sync("alice")
+
+        assert replica.sync("alice", full=False)["upserted"] == 1
+        assert requests[1] == "2026-10-01T08:00:00+00:00"
+        assert replica.sync("alice", full=True)["deleted"] == 1
+        assert replica.store.memory_ids("alice") == ["m2"]
+        assert [r.context for r in replica.search("音乐", user_id="alice")] == ["在学 python 和音乐"]
+        replica.close()
+
+    def test_idle_users_stop_syncing_and_tracking_is_bounded(self, tmp_path):
+        replica, clock, _ = self.make_replica(tmp_path, [], idle_ttl=60, max_users=2)
+        replica.is_fresh("alice")
+        clock.now = 50
+        replica.is_fresh("bob")
+        replica.is_fresh("carol")
+
+        assert list(replica._users) == ["bob", "carol"]
+
+        clock.now = 130
+        replica.is_fresh("carol")
+        replica._drop_idle_users()
+        replica.invalidate("bob")
+        assert list(replica._users) == ["carol"]
+        assert replica.stats()["users"] == 1
+        replica.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ONNX 句子编码器
+用 onnxruntime 在 CPU 上运行导出为 ONNX（可选 int8 动态量化）的句子转换器模型，
+不依赖 PyTorch，启动更快、常驻内存更小。
+
+模型目录由 optimum 导出，例如:
+    optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 ./models/all-MiniLM-L6-v2-onnx
+目录中需要 model.onnx（或量化后的 model_quantized.onnx）和 tokenizer.json。
+可用 quantize_model 生成 int8 量化模型。
+"""
+
+import os
+from typing import List, Optional
+
+import numpy as np
+
+MODEL_FILES = ("model_quantized.onnx", "model.onnx")
+
+
+def mean_pool(hidden_states: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """按注意力掩码对 token 向量求平均，并做 L2 归一化（与 all-MiniLM-L6-v2 的池化层一致）
+
+    参数:
+        hidden_states: 形状为 (batch, seq_len, dim) 的 token 向量
+        attention_mask: 形状为 (batch, seq_len) 的掩码
+
+    返回:
+        np.ndarray: 形状为 (batch, dim) 的 float32 句向量
+    """
+    mask = attention_mask[..., None].astype(np.float32)
+    pooled = (hidden_states * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return (pooled / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def quantize_model(model_path: str, output_path: Optional[str] = None) -> str:
+    """对 ONNX 模型做 int8 动态量化
+
+    参数:
+        model_path: 原始 model.onnx 路径
+        output_path: 输出路径，默认与原模型同目录的 model_quantized.onnx
+
+    返回:
+        str: 量化模型路径
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_path = output_path or os.path.join(os.path.dirname(model_path), "model_quantized.onnx")
+    quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8)
+    return output_path
+
+
+class OnnxSentenceEncoder:
+    """基于 onnxruntime 的句子编码器，encode 接口与 SentenceTransformer 一致"""
+
+    def __init__(self, model_path: str, batch_size: int = 32, threads: Optional[int] = None,
+                 max_length: int = 256):
+        """加载模型和分词器
+
+        参数:
+            model_path: 模型目录（优先使用其中的 model_quantized.onnx）或 .onnx 文件路径
+            batch_size: 每次推理的句子数
+            threads: onnxruntime 算子内线程数，为空时由 onnxruntime 决定（通常为物理核数）
+            max_length: 分词截断长度
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        if os.path.isdir(model_path):
+            model_dir = model_path
+            candidates = [os.path.join(model_dir, name) for name in MODEL_FILES]
+            model_file = next((path for path in candidates if os.path.exists(path)), None)
+            if model_file is None:
+                raise FileNotFoundError(f"{model_dir} 中没有 {' 或 '.join(MODEL_FILES)}")
+        else:
+            model_dir = os.path.dirname(model_path)
+            model_file = model_path
+        self.model_file = model_file
+        self.batch_size = batch_size
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self._input_names = {item.name for item in self.session.get_inputs()}
+
+    def encode(self, texts: List[str], batch_size: Optional[int] = None, **kwargs) -> np.ndarray:
+        """编码文本
+
+        参数:
+            texts: 文本列表
+            batch_size: 每次推理的句子数，为空时使用构造参数
+
+        返回:
+            np.ndarray: 形状为 (len(texts), dim) 的归一化 float32 向量
+        """
+        batch_size = batch_size or self.batch_size
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(list(texts[start:start + batch_size]))
+            input_ids = np.asarray([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.asarray([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self._input_names:
+                feeds["token_type_ids"] = np.asarray([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            hidden_states = self.session.run(None, {name: value for name, value in feeds.items()
+                                                    if name in self._input_names})[0]
+            outputs.append(mean_pool(hidden_states, attention_mask))
+        return np.concatenate(outputs) if outputs else np.empty((0, 0), dtype=np.float32)
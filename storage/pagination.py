@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地存储分页游标
+游标记录上一页最后一条记忆的 ID 和写入序号（base64url 编码的 JSON，对调用方不透明）。
+写入序号随每条新记忆单调递增并随记忆持久化，覆盖已有记忆时保持不变，删除最新记忆前其序号高水位写入存储元数据，
+重启后也不会复用；下一页从序号更大的记忆开始，因此即使该记忆已被删除，游标在写入、删除、合并去重乃至进程重启之后
+仍然有效，不会遗漏或重复。
+"""
+
+import base64
+import binascii
+import json
+from typing import Any, Dict, Optional, Tuple
+
+Cursor = Tuple[str, int]
+
+
+def encode_cursor(memory: Dict[str, Any]) -> str:
+    """由一页的最后一条记忆生成游标
+
+    参数:
+        memory: 记忆条目
+
+    返回:
+        str: 游标字符串
+    """
+    payload = json.dumps([memory["id"], memory["seq"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Cursor]:
+    """解析游标
+
+    参数:
+        cursor: encode_cursor 生成的游标，为空表示从头开始
+
+    返回:
+        Optional[Cursor]: (记忆ID, 写入序号)，为空表示从头开始
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        memory_id, seq = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if isinstance(seq, bool) or not isinstance(seq, int):
+            raise TypeError(seq)
+    except (ValueError, TypeError, binascii.Error) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+    return str(memory_id), seq
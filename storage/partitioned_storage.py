@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按用户分区的本地存储
+每个 user_id 一个独立的 LocalStorageService 分区（各自的日志、向量文件和索引），
+检索开销只与该用户的记忆数有关。分区按需打开，超过上限或空闲超时后按 LRU 关闭；
+所有分区共享同一个编码器和向量缓存，模型只加载一次。
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from schemas.common import MemoryPage, Metadata, RetriveResult
+from storage.batching_encoder import MicroBatchingEncoder
+from storage.embedding_cache import CachedEncoder, EmbeddingCache
+from storage.local_storage import LocalStorageService, encoder_cache_name, load_encoder
+from storage.process_encoder import ProcessPoolEncoder
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class _Partition:
+    """一个已打开的分区及其使用状态"""
+
+    def __init__(self, storage: LocalStorageService):
+        self.storage = storage
+        self.refs = 0
+        self.last_used = time.monotonic()
+
+
+class PartitionedLocalStorage:
+    """按用户分区的本地存储，接口与 LocalStorageService 一致，额外接受 user_id 参数"""
+
+    DEFAULT_USER_ID = "adventureX"
+    OWNER_FILE = "user_id"
+
+    def __init__(self, root_path: str = "./local_memories", encoder: Optional[Any] = None,
+                 max_open_partitions: int = 32, idle_timeout: Optional[float] = 600.0,
+                 legacy_storage_path: Optional[str] = "./local_memories.jsonl",
+                 background_encoder: bool = True, embedding_cache_size: int = 10000,
+                 embedding_cache_path: Optional[str] = None,
+                 encoder_source: Optional["PartitionedLocalStorage"] = None,
+                 encoder_backend: Optional[str] = None, onnx_model_path: Optional[str] = None,
+                 encoder_batch_size: int = 32, encoder_threads: Optional[int] = None,
+                 micro_batch_size: Optional[int] = None, micro_batch_wait_ms: float = 2.0,
+                 encoder_processes: Optional[int] = None, **storage_options):
+        """初始化
+
+        参数:
+            root_path: 分区根目录，每个用户一个子目录
+            encoder: 可选的编码器实例，为空时按 LOCAL_ENCODER_* 环境变量加载默认编码器
+            max_open_partitions: 同时打开的分区数上限，超出时关闭最久未使用的空闲分区
+            idle_timeout: 分区空闲超过该秒数后关闭，为空时不按空闲时间关闭
+            legacy_storage_path: 分区化之前的单一存储路径；默认用户的分区不存在而该存储存在时，
+                                 默认用户继续使用该存储
+            background_encoder: 是否在后台线程加载默认编码器（加载完成前各分区走关键词检索）
+            embedding_cache_size: 共享向量缓存的条数上限，0 表示不缓存
+            embedding_cache_path: 共享向量缓存磁盘层路径，为空时读取环境变量 EMBEDDING_CACHE_PATH
+            encoder_source: 可选的另一个分区存储，就绪后直接复用它的编码器（含缓存），不再单独加载模型
+            encoder_backend: 共享编码器的推理后端，为空时读取环境变量 LOCAL_ENCODER_BACKEND，默认 "torch"
+            onnx_model_path: onnx 后端的模型目录或文件，为空时读取环境变量 LOCAL_ONNX_MODEL_PATH
+            encoder_batch_size: onnx 后端每次推理的句子数
+            encoder_threads: CPU 推理线程数，为空时读取环境变量 LOCAL_ENCODER_THREADS
+            micro_batch_size: 大于 0 时共享编码器启用微批编码，为空时读取环境变量 LOCAL_ENCODER_MICRO_BATCH，默认 0
+            micro_batch_wait_ms: 微批编码收到第一个请求后最多等待的毫秒数
+            encoder_processes: 大于 0 时在这么多个独立进程中运行共享编码器，
+                               为空时读取环境变量 LOCAL_ENCODER_PROCESSES，默认 0
+            **storage_options: 透传给每个 LocalStorageService 分区的参数（如 backend、ann_index）
+        """
+        self.root_path = root_path
+        self.max_open_partitions = max_open_partitions
+        self.idle_timeout = idle_timeout
+        self.legacy_storage_path = legacy_storage_path
+        self.storage_options = storage_options
+        self._partitions: "OrderedDict[str, _Partition]" = OrderedDict()
+        self._opening: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.evicted = 0
+        # 已关闭分区的去重计数，打开中的分区在 stats 时实时汇总
+        self._closed_dedup: Counter = Counter()
+
+        self.embedding_cache = None
+        if embedding_cache_size > 0:
+            self.embedding_cache = EmbeddingCache(
+                max_entries=embedding_cache_size,
+                disk_path=embedding_cache_path or os.getenv("EMBEDDING_CACHE_PATH")
+            )
+        # 共享编码器的配置与 LocalStorageService 一致；各分区不再单独加载、微批或缓存
+        self.encoder_backend = encoder_backend or os.getenv("LOCAL_ENCODER_BACKEND", "torch")
+        self.onnx_model_path = onnx_model_path or os.getenv("LOCAL_ONNX_MODEL_PATH")
+        self.encoder_batch_size = encoder_batch_size
+        threads = encoder_threads or os.getenv("LOCAL_ENCODER_THREADS")
+        self.encoder_threads = int(threads) if threads else None
+        if micro_batch_size is None:
+            micro_batch_size = int(os.getenv("LOCAL_ENCODER_MICRO_BATCH", "0"))
+        self.micro_batch_size = micro_batch_size
+        self.micro_batch_wait_ms = micro_batch_wait_ms
+        if encoder_processes is None:
+            encoder_processes = int(os.getenv("LOCAL_ENCODER_PROCESSES", "0"))
+        self.encoder_processes = encoder_processes
+        self.process_encoder: Optional[ProcessPoolEncoder] = None
+        self.batching_encoder: Optional[MicroBatchingEncoder] = None
+        self.encoder = None
+        self._encoder_loaded = threading.Event()
+        self._encoder_thread: Optional[threading.Thread] = None
+        if encoder is not None:
+            self._on_encoder_loaded(encoder, LocalStorageService.MODEL_NAME)
+        elif encoder_source is not None:
+            self._encoder_thread = threading.Thread(target=self._share_encoder, args=(encoder_source,),
+                                                    name="partition-encoder-share", daemon=True)
+            self._encoder_thread.start()
+        elif background_encoder:
+            self._encoder_thread = threading.Thread(target=self._load_encoder, name="partition-encoder-loader",
+                                                    daemon=True)
+            self._encoder_thread.start()
+        else:
+            self._load_encoder()
+
+    @property
+    def encoder_ready(self) -> bool:
+        """共享编码器是否已就绪"""
+        return self.encoder is not None
+
+    def wait_for_encoder(self, timeout: Optional[float] = None) -> bool:
+        """等待共享编码器加载结束
+
+        参数:
+            timeout: 最长等待秒数，为空时一直等待
+
+        返回:
+            bool: 编码器是否就绪
+        """
+        self._encoder_loaded.wait(timeout)
+        return self.encoder_ready
+
+    def _load_encoder(self):
+        """加载共享的默认编码器（可在独立进程中运行），失败时各分区保持关键词检索"""
+        args = (self.encoder_backend, LocalStorageService.MODEL_NAME, self.onnx_model_path,
+                self.encoder_batch_size, self.encoder_threads)
+        try:
+            if self.encoder_processes > 0:
+                encoder = self.process_encoder = ProcessPoolEncoder(load_encoder, args, self.encoder_processes)
+                # 试编码一次，确保工作进程已加载模型
+                encoder.encode(["warm up"])
+            else:
+                encoder = load_encoder(*args)
+        except Exception as e:
+            print(f"警告: 无法加载句子转换器，本地存储将使用关键词匹配: {e}")
+            if self.process_encoder is not None:
+                self.process_encoder.close(wait=False)
+                self.process_encoder = None
+            self._encoder_loaded.set()
+            return
+        self._on_encoder_loaded(encoder, encoder_cache_name(self.encoder_backend, LocalStorageService.MODEL_NAME,
+                                                            self.onnx_model_path))
+
+    def _share_encoder(self, source: "PartitionedLocalStorage"):
+        """等待另一个分区存储的编码器就绪后复用（已包装过微批和缓存）"""
+        if source.wait_for_encoder():
+            self._set_shared_encoder(source.encoder)
+        self._encoder_loaded.set()
+
+    def _set_shared_encoder(self, encoder: Any):
+        """设置共享编码器并交给已打开的分区"""
+        with self._lock:
+            self.encoder = encoder
+            partitions = [partition.storage for partition in self._partitions.values()]
+        for storage in partitions:
+            storage.set_encoder(encoder)
+
+    def _on_encoder_loaded(self, encoder: Any, model_name: str):
+        """包装共享编码器（微批、缓存），并交给已打开的分区"""
+        if self.micro_batch_size > 0:
+            encoder = self.batching_encoder = MicroBatchingEncoder(
+                encoder, max_batch_size=self.micro_batch_size, max_wait_ms=self.micro_batch_wait_ms
+            )
+        if self.embedding_cache is not None:
+            encoder = CachedEncoder(encoder, self.embedding_cache, model_name)
+        self._set_shared_encoder(encoder)
+        self._encoder_loaded.set()
+
+    def partition_path(self, user_id: str) -> str:
+        """返回用户分区的存储路径
+
+        参数:
+            user_id: 用户ID
+
+        返回:
+            str: 分区的日志路径（目录名为过滤后的用户ID加哈希，避免路径穿越和大小写冲突）
+        """
+        if (user_id == self.DEFAULT_USER_ID and self.legacy_storage_path
+                and self._legacy_store_exists() and not os.path.isdir(self._partition_dir(user_id))):
+            return self.legacy_storage_path
+        return os.path.join(self._partition_dir(user_id), "memories.jsonl")
+
+    def _partition_dir(self, user_id: str) -> str:
+        digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.root_path, f"{_UNSAFE_CHARS.sub('_', user_id)[:64]}-{digest}")
+
+    def _write_owner(self, user_id: str):
+        """在分区目录中记录所属用户，目录名经过过滤无法还原用户ID"""
+        owner_path = os.path.join(self._partition_dir(user_id), self.OWNER_FILE)
+        if not os.path.exists(owner_path):
+            with open(owner_path, 'w', encoding='utf-8') as f:
+                f.write(user_id)
+
+    def user_ids(self) -> List[str]:
+        """列出磁盘上已有分区的用户
+
+        返回:
+            List[str]: 用户ID列表（早于记录所属用户的分区在下次打开前不会列出）
+        """
+        users = []
+        if self.legacy_storage_path and self._legacy_store_exists():
+            users.append(self.DEFAULT_USER_ID)
+        if os.path.isdir(self.root_path):
+            for name in sorted(os.listdir(self.root_path)):
+                owner_path = os.path.join(self.root_path, name, self.OWNER_FILE)
+                if os.path.isfile(owner_path):
+                    with open(owner_path, encoding='utf-8') as f:
+                        user_id = f.read()
+                    if user_id not in users:
+                        users.append(user_id)
+        return users
+
+    def _legacy_store_exists(self) -> bool:
+        base = os.path.splitext(self.legacy_storage_path)[0]
+        return any(os.path.exists(base + ext) for ext in (".jsonl", ".sqlite3", ".json"))
+
+    @contextmanager
+    def partition(self, user_id: Optional[str] = None) -> Iterator[LocalStorageService]:
+        """借用一个用户分区，使用期间不会被淘汰
+
+        参数:
+            user_id: 用户ID，为空时使用 DEFAULT_USER_ID
+
+        返回:
+            LocalStorageService: 该用户的分区
+        """
+        user_id = user_id or self.DEFAULT_USER_ID
+        partition = self._acquire(user_id)
+        try:
+            yield partition.storage
+        finally:
+            with self._lock:
+                partition.refs -= 1
+                partition.last_used = time.monotonic()
+            self._evict()
+
+    def _acquire(self, user_id: str) -> _Partition:
+        """取出（必要时打开）分区并增加引用计数"""
+        with self._lock:
+            partition = self._checkout(user_id)
+            if partition is not None:
+                return partition
+            opening = self._opening.setdefault(user_id, threading.Lock())
+
+        # 打开分区（回放日志、加载索引）只持有该用户的锁，不阻塞其他用户
+        with opening:
+            with self._lock:
+                partition = self._checkout(user_id)
+                if partition is not None:
+                    return partition
+            path = self.partition_path(user_id)
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if path != self.legacy_storage_path:
+                self._write_owner(user_id)
+            storage = LocalStorageService(
+                storage_path=path, encoder=self.encoder, load_default_encoder=False, user_id=user_id,
+                embedding_cache_size=0, micro_batch_size=0, encoder_processes=0, **self.storage_options
+            )
+            with self._lock:
+                partition = self._partitions[user_id] = _Partition(storage)
+                partition.refs += 1
+                self._opening.pop(user_id, None)
+                self.opened += 1
+                encoder = self.encoder
+        if encoder is not None and not storage.encoder_ready:
+            # 打开期间共享编码器刚好就绪
+            storage.set_encoder(encoder)
+        return partition
+
+    def _checkout(self, user_id: str) -> Optional[_Partition]:
+        """若分区已打开，标记为最近使用并增加引用计数（需持有锁）"""
+        partition = self._partitions.get(user_id)
+        if partition is not None:
+            self._partitions.move_to_end(user_id)
+            partition.refs += 1
+        return partition
+
+    def _evict(self):
+        """关闭超出数量上限或空闲超时、且当前没有被借用的分区"""
+        now = time.monotonic()
+        closing = []
+        with self._lock:
+            for user_id in list(self._partitions):
+                partition = self._partitions[user_id]
+                over_limit = len(self._partitions) > self.max_open_partitions
+                idle = self.idle_timeout is not None and now - partition.last_used > self.idle_timeout
+                if partition.refs == 0 and (over_limit or idle):
+                    del self._partitions[user_id]
+                    # 关闭期间持有该用户的打开锁，重新打开需等关闭完成
+                    lock = self._opening.setdefault(user_id, threading.Lock())
+                    lock.acquire()
+                    closing.append((partition.storage, lock))
+            self.evicted += len(closing)
+        for storage, lock in closing:
+            try:
+                self._retire(storage)
+            finally:
+                # 锁留在 _opening 中，由下一次打开该分区时移除
+                lock.release()
+
+    def _retire(self, storage: LocalStorageService):
+        """关闭分区，并把它的去重计数并入累计值"""
+        counts = storage.dedup_stats()
+        storage.close()
+        with self._lock:
+            self._closed_dedup.update(counts)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回分区打开/淘汰计数和全部分区累计的写入去重计数"""
+        with self._lock:
+            dedup = Counter(self._closed_dedup)
+            partitions = [partition.storage for partition in self._partitions.values()]
+            stats = {"open_partitions": len(partitions), "opened": self.opened, "evicted": self.evicted}
+        for storage in partitions:
+            dedup.update(storage.dedup_stats())
+        stats["dedup"] = {key: dedup[key] for key in ("checked", "skipped", "merged", "updated")}
+        return stats
+
+    def add(self, text: str, metadata: Metadata, user_id: Optional[str] = None) -> str:
+        """添加记忆到用户分区"""
+        with self.partition(user_id) as storage:
+            return storage.add(text, metadata)
+
+    def add_many(self, texts: List[str], metadatas: Union[Metadata, List[Metadata]],
+                 batch_size: int = 64, user_id: Optional[str] = None) -> str:
+        """批量添加记忆到用户分区"""
+        with self.partition(user_id) as storage:
+            return storage.add_many(texts, metadatas, batch_size)
+
+    def search(self, query_text: str, top_k: int = 5,
+               metadata_filter: Optional[Union[Metadata, Dict[str, Any]]] = None,
+               user_id: Optional[str] = None, **kwargs) -> List[RetriveResult]:
+        """在用户分区中搜索记忆"""
+        with self.partition(user_id) as storage:
+            return storage.search(query_text, top_k, metadata_filter, **kwargs)
+
+    def list(self, limit: int = 100, filters: Optional[Union[Metadata, Dict[str, Any]]] = None,
+             user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出用户分区中的记忆"""
+        with self.partition(user_id) as storage:
+            return storage.list(limit, filters)
+
+    def list_page(self, limit: int = 100, cursor: Optional[str] = None,
+                  filters: Optional[Union[Metadata, Dict[str, Any]]] = None,
+                  user_id: Optional[str] = None) -> MemoryPage:
+        """分页列出用户分区中的记忆"""
+        with self.partition(user_id) as storage:
+            return storage.list_page(limit, cursor, filters)
+
+    def iter_memories(self, page_size: int = 100, filters: Optional[Union[Metadata, Dict[str, Any]]] = None,
+                      user_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """逐页遍历用户分区中的记忆（每页单独借用分区，遍历期间分区仍可被淘汰）"""
+        cursor = None
+        while True:
+            page = self.list_page(page_size, cursor, filters, user_id)
+            yield from page.memories
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+
+    def upsert_many(self, entries: List[Dict[str, Any]], user_id: Optional[str] = None) -> int:
+        """按条目自带的ID写入或覆盖用户分区中的记忆"""
+        with self.partition(user_id) as storage:
+            return storage.upsert_many(entries)
+
+    def memory_ids(self, user_id: Optional[str] = None) -> List[str]:
+        """返回用户分区中的全部记忆ID"""
+        with self.partition(user_id) as storage:
+            return storage.memory_ids()
+
+    def delete(self, memory_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """从用户分区中删除记忆"""
+        with self.partition(user_id) as storage:
+            return storage.delete(memory_id)
+
+    def close(self):
+        """关闭全部分区、共享编码器和向量缓存"""
+        if self._encoder_thread is not None:
+            self._encoder_thread.join()
+        with self._lock:
+            partitions = [partition.storage for partition in self._partitions.values()]
+            self._partitions.clear()
+        for storage in partitions:
+            self._retire(storage)
+        if self.batching_encoder is not None:
+            self.batching_encoder.close()
+        if self.process_encoder is not None:
+            self.process_encoder.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
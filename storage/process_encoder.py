@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程池编码器
+在独立的工作进程中运行编码器（每个进程只加载一次模型），分词和前向计算不再占用主进程的 GIL；
+向量通过共享内存块传回，避免把大数组序列化后经管道传输。
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, List, Tuple
+
+import numpy as np
+
+# 工作进程内的编码器实例，由 _init_worker 创建
+_worker_encoder: Any = None
+
+
+def _init_worker(factory: Callable[..., Any], args: Tuple):
+    """工作进程初始化：加载一次编码器"""
+    global _worker_encoder
+    _worker_encoder = factory(*args)
+
+
+def _encode_to_shared_memory(texts: List[str]) -> Tuple[str, Tuple[int, ...]]:
+    """在工作进程中编码，把结果写入新建的共享内存块
+
+    返回:
+        Tuple[str, Tuple[int, ...]]: 共享内存块名称和向量形状，由主进程读取后负责释放
+    """
+    vectors = np.ascontiguousarray(_worker_encoder.encode(texts), dtype=np.float32)
+    block = shared_memory.SharedMemory(create=True, size=max(vectors.nbytes, 1))
+    np.ndarray(vectors.shape, dtype=np.float32, buffer=block.buf)[...] = vectors
+    block.close()
+    return block.name, vectors.shape
+
+
+class ProcessPoolEncoder:
+    """把 encode 调用分发到进程池的编码器，encode 接口与底层编码器一致"""
+
+    def __init__(self, factory: Callable[..., Any], args: Tuple = (), processes: int = 1):
+        """启动进程池
+
+        参数:
+            factory: 在工作进程中创建编码器的可序列化函数（模块级函数），例如 load_encoder
+            args: 传给 factory 的参数
+            processes: 工作进程数，每个进程各加载一份模型
+        """
+        # spawn：不继承父进程的线程和 PyTorch 状态
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(factory, args),
+        )
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """在工作进程中编码文本（调用线程等待期间释放 GIL）
+
+        参数:
+            texts: 文本列表
+
+        返回:
+            np.ndarray: 形状为 (len(texts), dim) 的向量
+        """
+        if len(texts) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        name, shape = self._executor.submit(_encode_to_shared_memory, list(texts)).result()
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            return np.ndarray(shape, dtype=np.float32, buffer=block.buf).copy()
+        finally:
+            block.close()
+            block.unlink()
+
+    def close(self, wait: bool = True):
+        """关闭进程池
+
+        参数:
+            wait: 是否等待进行中的编码完成
+        """
+        self._executor.shutdown(wait=wait)
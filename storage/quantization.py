@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量量化
+在内存中以 float16 或按向量缩放的 int8 保存向量的紧凑副本，用于粗打分；
+完整精度的 float32 向量留在向量存储（memmap 文件）中，只对粗排后的少量候选精确重打分。
+"""
+
+from typing import Optional
+
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8")
+
+
+class QuantizedVectors:
+    """按行号寻址的量化向量副本
+
+    int8 采用逐向量对称标量量化: code = round(v / scale), scale = max(|v|) / 127，
+    内积近似为 scale * (code · q)。
+    """
+
+    def __init__(self, precision: str, chunk_size: int = 16384):
+        """初始化
+
+        参数:
+            precision: "float16" 或 "int8"
+            chunk_size: 打分时每块反量化的行数，限制临时 float32 矩阵的大小
+        """
+        if precision not in ("float16", "int8"):
+            raise ValueError(f"不支持的量化精度: {precision}")
+        self.precision = precision
+        self.chunk_size = chunk_size
+        self.dim: Optional[int] = None
+        self._capacity = 0
+        self._codes: Optional[np.ndarray] = None
+        self._scales = np.zeros(0, dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        """量化副本占用的内存字节数"""
+        codes = self._codes.nbytes if self._codes is not None else 0
+        return codes + (self._scales.nbytes if self.precision == "int8" else 0)
+
+    def _ensure_rows(self, rows: int):
+        if rows <= self._capacity:
+            return
+        capacity = max(self._capacity, 1024)
+        while capacity < rows:
+            capacity *= 2
+        codes = np.zeros((capacity, self.dim), dtype=np.int8 if self.precision == "int8" else np.float16)
+        scales = np.zeros(capacity, dtype=np.float32)
+        if self._codes is not None:
+            codes[:self._capacity] = self._codes
+            scales[:self._capacity] = self._scales
+        self._codes = codes
+        self._scales = scales
+        self._capacity = capacity
+
+    def set_rows(self, rows: np.ndarray, vectors: np.ndarray):
+        """量化并写入若干行
+
+        参数:
+            rows: 行号数组
+            vectors: 对应的 float32 向量
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        self._ensure_rows(int(rows.max()) + 1)
+        if self.precision == "float16":
+            self._codes[rows] = vectors.astype(np.float16)
+            return
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        self._codes[rows] = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        self._scales[rows] = scales
+
+    def scores(self, query_vector: np.ndarray, size: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """在量化副本上计算近似内积
+
+        参数:
+            query_vector: 归一化的 float32 查询向量
+            size: 向量存储的总行数（rows 为空时对 [0, size) 打分）
+            rows: 若提供，只对这些行打分
+
+        返回:
+            np.ndarray: 近似内积
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        total = size if rows is None else len(rows)
+        out = np.zeros(total, dtype=np.float32)
+        if self._codes is None:
+            return out
+        self._ensure_rows(size)
+        for start in range(0, total, self.chunk_size):
+            end = min(start + self.chunk_size, total)
+            if rows is None:
+                block = self._codes[start:end]
+                scales = self._scales[start:end]
+            else:
+                block = self._codes[rows[start:end]]
+                scales = self._scales[rows[start:end]]
+            out[start:end] = block.astype(np.float32) @ query_vector
+            if self.precision == "int8":
+                out[start:end] *= scales
+        return out
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+时间衰减与访问频次加权打分
+在余弦相似度之外叠加两个先验：按半衰期指数衰减的新鲜度，以及对数归一化的被检索次数，
+三者的加权和作为排序分数。全部在索引的平行数组上以向量化方式计算。
+"""
+
+import math
+import time
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+
+def parse_timestamp(value: Optional[str]) -> float:
+    """把记忆条目中的 ISO 8601 时间戳转换为 Unix 秒
+
+    参数:
+        value: 时间戳字符串
+
+    返回:
+        float: Unix 秒，缺失或无法解析时为 NaN（不参与新鲜度加分）
+    """
+    if not value:
+        return math.nan
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class RecencyScorer:
+    """相似度、新鲜度与访问频次的加权打分器"""
+
+    def __init__(self, recency_weight: float = 0.2, importance_weight: float = 0.1,
+                 half_life_days: float = 30.0):
+        """初始化
+
+        参数:
+            recency_weight: 新鲜度的权重，新鲜度 = 0.5 ** (记忆年龄 / 半衰期)，取值 (0, 1]
+            importance_weight: 访问频次的权重，频次分 = log(1 + 次数) / log(1 + 最大次数)，取值 [0, 1]
+            half_life_days: 新鲜度减半所需的天数
+        """
+        if recency_weight < 0 or importance_weight < 0 or recency_weight + importance_weight > 1:
+            raise ValueError("recency_weight 与 importance_weight 须非负且之和不超过 1")
+        if half_life_days <= 0:
+            raise ValueError("half_life_days 须为正数")
+        self.recency_weight = recency_weight
+        self.importance_weight = importance_weight
+        self.similarity_weight = 1.0 - recency_weight - importance_weight
+        self.half_life = half_life_days * 86400.0
+
+    def blend(self, similarities: np.ndarray, timestamps: np.ndarray, access_counts: np.ndarray,
+              max_access: float, now: Optional[float] = None) -> np.ndarray:
+        """计算加权分数
+
+        参数:
+            similarities: 余弦相似度
+            timestamps: 与 similarities 对应的 Unix 秒（NaN 表示未知）
+            access_counts: 与 similarities 对应的被检索次数
+            max_access: 全部记忆中的最大被检索次数，用于归一化频次分
+            now: 当前时间，为空时使用 time.time()
+
+        返回:
+            np.ndarray: float32 加权分数
+        """
+        now = time.time() if now is None else now
+        age = np.maximum(now - timestamps, 0.0)
+        recency = np.nan_to_num(np.exp2(-age / self.half_life), nan=0.0)
+        scores = self.similarity_weight * similarities + self.recency_weight * recency
+        if max_access > 0:
+            scores = scores + self.importance_weight * (np.log1p(access_counts) / math.log1p(max_access))
+        return scores.astype(np.float32)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+降级写入回放
+Mem0 不可用期间的写入只落在本地存储。Mem0 恢复后，把这些记忆分批回放到 Mem0，
+并在 SQLite 中记录 本地ID -> Mem0 ID 的映射：回放前先标记为进行中，Mem0 返回记忆ID后才标记完成并删除本地副本。
+重复运行或进程崩溃后重跑都不会重复提交：已完成的跳过，进行中的先向 Mem0 查询是否已经写入。
+隐私记忆在本地保存的是原文，而 Mem0 只允许写入隐私摘要，因此不回放、保留在本地。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from storage.circuit_breaker import CircuitOpenError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS id_map (
+    local_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    mem0_ids TEXT NOT NULL DEFAULT '[]',
+    updated_at REAL NOT NULL
+);
+"""
+
+PENDING = "pending"
+DONE = "done"
+
+
+class FallbackReplayer:
+    """把本地存储中的降级写入回放到 Mem0"""
+
+    def __init__(self, local_storage: Any, submit: Callable[[Dict[str, Any]], List[str]],
+                 lookup: Optional[Callable[[Dict[str, Any]], List[str]]] = None,
+                 path: str = "./mem0_replay.db", batch_size: int = 32, max_concurrency: int = 4,
+                 sensitive_level: int = 3):
+        """初始化
+
+        参数:
+            local_storage: PartitionedLocalStorage
+            submit: 把一条本地记忆写入 Mem0 的函数，返回 Mem0 生成的记忆ID列表
+            lookup: 可选，查询某条本地记忆是否已写入 Mem0 的函数，返回对应的 Mem0 记忆ID（未写入时为空列表）；
+                    用于处理上次回放在提交后、记录映射前中断的条目
+            path: ID 映射数据库路径
+            batch_size: 每批回放的记忆数
+            max_concurrency: 一批内同时提交的记忆数
+            sensitive_level: 隐私级别不低于该值的记忆不回放
+        """
+        self.local_storage = local_storage
+        self.submit = submit
+        self.lookup = lookup
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.sensitive_level = sensitive_level
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def mem0_ids(self, local_id: str) -> Optional[List[str]]:
+        """查询已回放的本地记忆对应的 Mem0 记忆ID
+
+        参数:
+            local_id: 本地记忆ID
+
+        返回:
+            Optional[List[str]]: Mem0 记忆ID列表，未回放完成（或没有对应的 Mem0 记忆）时为空
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT mem0_ids FROM id_map WHERE local_id = ? AND status = ?",
+                                     (local_id, DONE)).fetchone()
+        mem0_ids = json.loads(row[0]) if row else None
+        return mem0_ids or None
+
+    def forget(self, local_id: str):
+        """删除一条本地记忆的映射（该记忆在回放完成前被删除时调用）
+
+        参数:
+            local_id: 本地记忆ID
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM id_map WHERE local_id = ? AND status = ?", (local_id, PENDING))
+
+    def _statuses(self, local_ids: List[str]) -> Dict[str, str]:
+        placeholders = ",".join("?" * len(local_ids))
+        with self._lock:
+            return dict(self._conn.execute(
+                f"SELECT local_id, status FROM id_map WHERE local_id IN ({placeholders})", local_ids
+            ))
+
+    def _record(self, rows: List[tuple]):
+        """在一个事务中写入映射，rows 为 (local_id, user_id, status, mem0_ids)"""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT INTO id_map (local_id, user_id, status, mem0_ids, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(local_id) DO UPDATE SET status = excluded.status, mem0_ids = excluded.mem0_ids, "
+                    "updated_at = excluded.updated_at",
+                    [(local_id, user_id, status, json.dumps(ids), now) for local_id, user_id, status, ids in rows]
+                )
+
+    def _replay_one(self, memory: Dict[str, Any], status: Optional[str]) -> List[str]:
+        """回放一条记忆；上次中断在提交之后的，先查询 Mem0 避免重复写入"""
+        if status == PENDING and self.lookup is not None:
+            existing = self.lookup(memory)
+            if existing:
+                return existing
+        return self.submit(memory)
+
+    def replay(self, user_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """回放本地存储中的记忆（同一时刻只运行一次，Mem0 再次熔断时提前结束）
+
+        参数:
+            user_ids: 要回放的用户，为空时回放磁盘上全部分区
+
+        返回:
+            Dict[str, int]: replayed（成功回放）、skipped_sensitive（隐私记忆未回放）、
+                            already_replayed（此前已回放完成）、failed（提交失败，下次重试）、
+                            unconfirmed（Mem0 未返回记忆ID，保留本地副本，下次重试）
+        """
+        counts: Counter = Counter()
+        if not self._run_lock.acquire(blocking=False):
+            return dict(counts)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="mem0-replay") as executor:
+                for user_id in user_ids if user_ids is not None else self.local_storage.user_ids():
+                    if not self._replay_user(user_id, executor, counts):
+                        print("Mem0 再次不可用，停止回放")
+                        break
+        finally:
+            self._run_lock.release()
+        if counts["replayed"]:
+            print(f"已回放 {counts['replayed']} 条本地记忆到 Mem0")
+        return {key: counts[key] for key in ("replayed", "skipped_sensitive", "already_replayed", "failed",
+                                             "unconfirmed")}
+
+    def _replay_user(self, user_id: str, executor: ThreadPoolExecutor, counts: Counter) -> bool:
+        """分批回放一个用户的记忆，返回 False 表示 Mem0 熔断需停止"""
+        cursor = None
+        while True:
+            page = self.local_storage.list_page(self.batch_size, cursor, user_id=user_id)
+            if not self._replay_batch(user_id, page.memories, executor, counts):
+                return False
+            if page.next_cursor is None:
+                return True
+            cursor = page.next_cursor
+
+    def _replay_batch(self, user_id: str, memories: List[Dict[str, Any]], executor: ThreadPoolExecutor,
+                      counts: Counter) -> bool:
+        batch = []
+        for memory in memories:
+            if memory.get("metadata", {}).get("privacy_level", 0) >= self.sensitive_level:
+                counts["skipped_sensitive"] += 1
+            else:
+                batch.append(memory)
+        if not batch:
+            return True
+        statuses = self._statuses([memory["id"] for memory in batch])
+        done = [memory for memory in batch if statuses.get(memory["id"]) == DONE]
+        todo = [memory for memory in batch if statuses.get(memory["id"]) != DONE]
+        counts["already_replayed"] += len(done)
+
+        # 先标记进行中，再提交
+        self._record([(memory["id"], user_id, PENDING, []) for memory in todo
+                      if statuses.get(memory["id"]) != PENDING])
+        futures = [(memory, executor.submit(self._replay_one, memory, statuses.get(memory["id"])))
+                   for memory in todo]
+        replayed, circuit_open = [], False
+        for memory, future in futures:
+            try:
+                mem0_ids = future.result()
+            except CircuitOpenError:
+                circuit_open = True
+                counts["failed"] += 1
+            except Exception as e:
+                print(f"回放记忆 {memory['id']} 失败: {e}")
+                counts["failed"] += 1
+            else:
+                if mem0_ids:
+                    replayed.append((memory["id"], user_id, DONE, mem0_ids))
+                else:
+                    # Mem0 未返回记忆ID（推理判定为无需新增或仍在异步处理）：保持进行中、保留本地副本，
+                    # 下次回放时先按本地ID查询 Mem0
+                    counts["unconfirmed"] += 1
+        self._record(replayed)
+        counts["replayed"] += len(replayed)
+
+        # 映射已持久化，删除本地副本（包括此前已回放但未删除的）
+        for local_id in [row[0] for row in replayed] + [memory["id"] for memory in done]:
+            self.local_storage.delete(local_id, user_id=user_id)
+        return not circuit_open
+
+    def close(self):
+        """关闭映射数据库"""
+        with self._lock:
+            self._conn.close()
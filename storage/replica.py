@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mem0 记忆的本地只读副本
+按用户把 Mem0 中的记忆同步到本地分区存储并在本地编码，检索时若副本在允许的陈旧时间内就直接在本地检索，
+省去 Mem0 的网络往返；超出陈旧界限或有尚未同步的写入时由调用方回退到 Mem0。
+增量同步只拉取 updated_at 不早于上次水位的记忆；Mem0 不返回删除记录，
+因此定期做一次全量同步，删除本地多出的记忆。只有最近检索过的用户会被后台同步：
+空闲超过 idle_ttl 的用户停止同步，被跟踪的用户数不超过 max_users（按最近检索时间淘汰）。
+Mem0 不可用时副本可作为热备继续提供检索。
+"""
+
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from schemas.common import Metadata, RetriveResult
+from schemas.privacy import PrivacyLevel
+from storage.recency import parse_timestamp
+
+
+class _UserState:
+    """一个用户副本的同步状态"""
+
+    def __init__(self, now: float):
+        self.last_access = now
+        self.synced_at: Optional[float] = None
+        self.full_synced_at: Optional[float] = None
+        self.watermark: Optional[float] = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+
+class Mem0Replica:
+    """Mem0 记忆的本地副本"""
+
+    def __init__(self, fetch_page: Callable[..., Dict[str, Any]], store: Any, max_staleness: float = 60.0,
+                 sync_interval: float = 15.0, full_sync_interval: float = 600.0, page_size: int = 100,
+                 idle_ttl: float = 900.0, max_users: int = 1000, clock: Callable[[], float] = time.monotonic):
+        """初始化
+
+        参数:
+            fetch_page: 拉取一页 Mem0 记忆的函数 fetch_page(user_id, updated_since, page, page_size)，
+                        updated_since 为 ISO 8601 时间或 None（全量），返回 {"results": [...], "next": ...}
+            store: 存放副本的 PartitionedLocalStorage（不要与降级写入使用同一个存储）
+            max_staleness: 距上次成功同步超过该秒数时副本不再用于检索
+            sync_interval: 后台线程对活跃用户的同步间隔秒数，应小于 max_staleness
+            full_sync_interval: 全量同步（清理已删除记忆）的间隔秒数
+            page_size: 每次拉取的记忆数
+            idle_ttl: 用户超过该秒数没有检索时停止同步并不再跟踪（副本数据保留，再次检索时重新同步）
+            max_users: 同时跟踪（后台同步）的用户数上限，超出时淘汰最久未检索的用户
+            clock: 单调时钟（测试时可替换）
+        """
+        self.fetch_page = fetch_page
+        self.store = store
+        self.max_staleness = max_staleness
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self.page_size = page_size
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        # 按最近检索时间排序，最久未检索的在前
+        self._users: "OrderedDict[str, _UserState]" = OrderedDict()
+        self._owners: Dict[str, str] = {}
+        self._counts: Counter = Counter()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def _state(self, user_id: str, access: bool = False) -> _UserState:
+        """取出（必要时登记）用户的同步状态；access 为 True 时刷新最近检索时间"""
+        now = self.clock()
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                state = self._users[user_id] = _UserState(now)
+                dropped = []
+                while len(self._users) > self.max_users:
+                    dropped.append(self._users.popitem(last=False)[0])
+                self._forget_owners(dropped)
+                # 新用户尽快同步一次
+                self._wakeup.set()
+            elif access:
+                state.last_access = now
+                self._users.move_to_end(user_id)
+            return state
+
+    def _forget_owners(self, user_ids: List[str]):
+        """不再跟踪的用户的记忆不再按ID就地删除，由其再次同步时的全量同步清理（需持有锁）"""
+        if user_ids:
+            dropped = set(user_ids)
+            self._owners = {memory_id: owner for memory_id, owner in self._owners.items() if owner not in dropped}
+
+    def _drop_idle_users(self):
+        """停止跟踪空闲超过 idle_ttl 的用户"""
+        deadline = self.clock() - self.idle_ttl
+        with self._lock:
+            idle = []
+            # 有序字典头部是最久未检索的用户
+            for user_id, state in self._users.items():
+                if state.last_access > deadline:
+                    break
+                idle.append(user_id)
+            for user_id in idle:
+                del self._users[user_id]
+            self._forget_owners(idle)
+
+    def is_fresh(self, user_id: str) -> bool:
+        """副本是否可用于检索：编码器就绪、没有未同步的写入且在陈旧界限内
+
+        参数:
+            user_id: 用户ID（首次查询的用户会被登记，由后台线程开始同步）
+
+        返回:
+            bool: 可以直接在副本上检索时为 True
+        """
+        state = self._state(user_id, access=True)
+        fresh = (self.store.encoder_ready and not state.dirty and state.synced_at is not None
+                 and self.clock() - state.synced_at <= self.max_staleness)
+        self._counts["fresh" if fresh else "stale"] += 1
+        return fresh
+
+    def invalidate(self, user_id: str):
+        """标记用户在 Mem0 中有新的写入：下次同步完成前副本不用于检索（未被跟踪的用户无需处理）
+
+        参数:
+            user_id: 用户ID
+        """
+        with self._lock:
+            state = self._users.get(user_id)
+        if state is not None:
+            state.dirty = True
+            self._wakeup.set()
+
+    def sync(self, user_id: str, full: Optional[bool] = None) -> Dict[str, int]:
+        """从 Mem0 同步一个用户的记忆
+
+        参数:
+            user_id: 用户ID
+            full: 是否全量同步，为空时按 full_sync_interval 自动决定
+
+        返回:
+            Dict[str, int]: fetched（拉取条数）、upserted（写入副本条数）、deleted（从副本删除条数）
+        """
+        state = self._state(user_id)
+        with state.lock:
+            started = self.clock()
+            # 同步开始后到达的写入仍会标记 dirty
+            state.dirty = False
+            if full is None:
+                full = state.full_synced_at is None or started - state.full_synced_at >= self.full_sync_interval
+            since = None
+            if not full and state.watermark is not None:
+                since = datetime.fromtimestamp(state.watermark, tz=timezone.utc).isoformat()
+            try:
+                fetched, upserted, seen, watermark = self._pull(user_id, since)
+            except Exception:
+                state.dirty = True
+                self._counts["sync_failures"] += 1
+                raise
+            deleted = 0
+            if full:
+                for memory_id in set(self.store.memory_ids(user_id)) - seen:
+                    self.store.delete(memory_id, user_id=user_id)
+                    with self._lock:
+                        self._owners.pop(memory_id, None)
+                    deleted += 1
+                state.full_synced_at = started
+            state.synced_at = started
+            if watermark is not None:
+                state.watermark = max(watermark, state.watermark or watermark)
+        self._counts["syncs"] += 1
+        self._counts["full_syncs" if full else "incremental_syncs"] += 1
+        return {"fetched": fetched, "upserted": upserted, "deleted": deleted}
+
+    def _pull(self, user_id: str, since: Optional[str]):
+        """分页拉取并写入副本，返回 (拉取条数, 写入条数, 拉取到的ID集合, 最新 updated_at)"""
+        fetched = upserted = 0
+        seen = set()
+        watermark = None
+        page = 1
+        while True:
+            response = self.fetch_page(user_id, since, page, self.page_size)
+            entries = []
+            for memory in response.get("results", []):
+                timestamp = memory.get("updated_at") or memory.get("created_at")
+                metadata = dict(memory.get("metadata") or {})
+                metadata.setdefault("privacy_level", PrivacyLevel.LEVEL_1_PUBLIC.value)
+                metadata.setdefault("source", "unknown")
+                entries.append({
+                    "id": memory["id"],
+                    "content": memory.get("memory", ""),
+                    "metadata": metadata,
+                    "timestamp": timestamp,
+                })
+                seen.add(memory["id"])
+                updated = parse_timestamp(timestamp)
+                if not math.isnan(updated) and (watermark is None or updated > watermark):
+                    watermark = updated
+            fetched += len(entries)
+            upserted += self.store.upsert_many(entries, user_id=user_id)
+            with self._lock:
+                for entry in entries:
+                    self._owners[entry["id"]] = user_id
+            if not response.get("next") or not entries:
+                return fetched, upserted, seen, watermark
+            page += 1
+
+    def search(self, query_text: str, top_k: int = 5, metadata_filter: Optional[Metadata] = None,
+               user_id: Optional[str] = None) -> List[RetriveResult]:
+        """在副本中检索
+
+        参数:
+            query_text: 查询文本
+            top_k: 返回结果数量
+            metadata_filter: 元数据过滤器
+            user_id: 用户ID
+
+        返回:
+            List[RetriveResult]: 检索结果
+        """
+        return self.store.search(query_text, top_k, metadata_filter, user_id=user_id)
+
+    def delete(self, memory_id: str):
+        """从副本中删除一条记忆（Mem0 删除成功后调用，避免等到下次全量同步）
+
+        参数:
+            memory_id: Mem0 记忆ID
+        """
+        with self._lock:
+            user_id = self._owners.pop(memory_id, None)
+        if user_id is not None:
+            self.store.delete(memory_id, user_id=user_id)
+
+    def start(self) -> threading.Thread:
+        """启动后台同步线程（重复调用无副作用）"""
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="mem0-replica-sync", daemon=True)
+            self._worker.start()
+        return self._worker
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._drop_idle_users()
+            with self._lock:
+                users = list(self._users.items())
+            for user_id, state in users:
+                if self._stop.is_set():
+                    return
+                due = state.dirty or state.synced_at is None or self.clock() - state.synced_at >= self.sync_interval
+                if not due:
+                    continue
+                try:
+                    self.sync(user_id)
+                except Exception as e:
+                    print(f"Mem0 副本同步失败 ({user_id}): {e}")
+            self._wakeup.wait(self.sync_interval)
+            self._wakeup.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回副本状态
+
+        返回:
+            Dict: 跟踪的用户数、其中尚未同步或超出陈旧界限的用户数、最大陈旧秒数，
+                  以及检索命中（fresh）/回退（stale）和同步次数
+        """
+        now = self.clock()
+        with self._lock:
+            staleness = [None if state.synced_at is None else now - state.synced_at
+                         for state in self._users.values()]
+        synced = [seconds for seconds in staleness if seconds is not None]
+        return {
+            "users": len(staleness),
+            "stale_users": sum(1 for seconds in staleness if seconds is None or seconds > self.max_staleness),
+            "max_staleness_seconds": max(synced) if synced else None,
+            "fresh": self._counts["fresh"],
+            "stale": self._counts["stale"],
+            "syncs": self._counts["syncs"],
+            "full_syncs": self._counts["full_syncs"],
+            "incremental_syncs": self._counts["incremental_syncs"],
+            "sync_failures": self._counts["sync_failures"],
+        }
+
+    def close(self):
+        """停止后台同步线程并关闭副本存储"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join()
+        self.store.close()
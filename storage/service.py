@@ -1,41 +1,331 @@
-from schemas.common import Metadata, RetriveResult, ListResult
+from schemas.common import Metadata, MemoryPage, RetriveResult, ListResult
 from schemas.privacy import PrivacyLevel  
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, TypeVar
 from storage.db import client
 from mem0 import MemoryClient
 import os
+import re
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from storage.circuit_breaker import CircuitBreaker, CircuitOpenError
+from storage.replay import FallbackReplayer
+from storage.replica import Mem0Replica
+from storage.write_queue import WriteBehindQueue
 from services.websocket import WebSocketManager
 from schemas.websocket import OperationResultPayload
 import uuid
 
+T = TypeVar("T")
+
 class  StorageService:
     """
     存储服务层
     职责：作为mem0库的直接封装，提供干净、类型化的数据访问接口。
-    支持自动降级到本地存储当 Mem0 API 不可用时。
+    支持自动降级到本地存储当 Mem0 API 不可用时：Mem0 调用经过熔断器，
+    失败率过高时熔断并直接使用本地存储，后台探活成功后自动切回 Mem0。
     """
-    def __init__(self,websocket_manager:WebSocketManager):
-        """初始化存储服务"""
-        self.storage = MemoryClient()
+    def __init__(self,websocket_manager:WebSocketManager, memory_client: Optional[Any] = None,
+                 max_concurrency: Optional[int] = None, write_behind: Optional[bool] = None,
+                 write_queue_path: Optional[str] = None, replica: Optional[bool] = None):
+        """初始化存储服务
+
+        Args:
+            websocket_manager: 与前端通信的 WebSocket 管理器（隐私记忆上链流程使用）。
+            memory_client: Mem0 客户端，为空时创建 MemoryClient。
+            max_concurrency: 异步接口中同时进行的 Mem0 / 本地存储调用数上限，
+                             为空时读取环境变量 MEM0_MAX_CONCURRENCY，默认 16。
+            write_behind: 非隐私记忆是否采用写后模式（入队即返回，后台批量提交到 Mem0），
+                          为空时读取环境变量 MEM0_WRITE_BEHIND，默认关闭。
+            write_queue_path: 写后队列的数据库路径，为空时读取环境变量 MEM0_WRITE_QUEUE_PATH。
+            replica: 是否维护 Mem0 记忆的本地副本，副本足够新时检索直接在本地完成，
+                     为空时读取环境变量 MEM0_REPLICA，默认关闭。
+        """
+        self.storage = memory_client or MemoryClient()
         self.websocket = websocket_manager
         self.DEFAULT_USER_ID = "adventureX"
         self.api_key = os.getenv("MEM0_API_KEY")
-        self.use_local_fallback = False
+        self.breaker = CircuitBreaker(
+            name="mem0",
+            window_size=int(os.getenv("MEM0_BREAKER_WINDOW", "20")),
+            failure_rate_threshold=float(os.getenv("MEM0_BREAKER_FAILURE_RATE", "0.5")),
+            min_calls=int(os.getenv("MEM0_BREAKER_MIN_CALLS", "5")),
+            open_timeout=float(os.getenv("MEM0_BREAKER_OPEN_SECONDS", "30")),
+            probe=self._probe_mem0,
+            probe_interval=float(os.getenv("MEM0_PROBE_INTERVAL", "10")),
+            on_state_change=self._on_breaker_state_change,
+            is_failure=self._is_mem0_outage,
+        )
         self.local_storage = None
+        # Mem0 恢复后把降级期间写入本地的记忆回放到 Mem0
+        self.replay_on_recovery = os.getenv("MEM0_REPLAY_ON_RECOVERY", "true").lower() in ("1", "true", "yes")
+        self.replayer: Optional[FallbackReplayer] = None
+        self._replay_thread: Optional[threading.Thread] = None
+        self._local_storage_lock = threading.Lock()
+        # 写入前查重：Mem0 中已有相似度不低于该阈值的记忆时跳过写入，未设置则不查重
+        threshold = os.getenv("MEM0_DEDUP_THRESHOLD")
+        self.dedup_threshold = float(threshold) if threshold else None
+        self.dedup_checked = 0
+        self.dedup_skipped = 0
+        # 查重计数在写后队列和批量写入的工作线程中更新
+        self._dedup_lock = threading.Lock()
+        # MemoryClient 是同步 HTTP 客户端：异步接口把调用放到有界线程池中执行，事件循环不被阻塞
+        max_concurrency = max_concurrency or int(os.getenv("MEM0_MAX_CONCURRENCY", "16"))
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="mem0")
+        if write_behind is None:
+            write_behind = os.getenv("MEM0_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+        self.write_queue: Optional[WriteBehindQueue] = None
+        if write_behind:
+            self.write_queue = WriteBehindQueue(
+                write_queue_path or os.getenv("MEM0_WRITE_QUEUE_PATH", "./mem0_write_queue.db"),
+                submit=self._submit_queued,
+                batch_size=int(os.getenv("MEM0_WRITE_BATCH_SIZE", "16")),
+                max_concurrency=int(os.getenv("MEM0_WRITE_CONCURRENCY", "4")),
+                max_attempts=int(os.getenv("MEM0_WRITE_MAX_ATTEMPTS", "5")),
+                on_dead=self._write_dead_to_local,
+            )
+            self.write_queue.start()
+        if replica is None:
+            replica = os.getenv("MEM0_REPLICA", "false").lower() in ("1", "true", "yes")
+        self.replica: Optional[Mem0Replica] = None
+        if replica:
+            from storage.partitioned_storage import PartitionedLocalStorage
+            # 副本与降级写入分开存放（回放只处理降级写入），编码器复用降级存储的
+            self.replica = Mem0Replica(
+                self._fetch_replica_page,
+                PartitionedLocalStorage(root_path=os.getenv("MEM0_REPLICA_PATH", "./mem0_replica"),
+                                        legacy_storage_path=None, embedding_cache_size=0,
+                                        encoder_source=self._get_local_storage()),
+                max_staleness=float(os.getenv("MEM0_REPLICA_MAX_STALENESS", "60")),
+                sync_interval=float(os.getenv("MEM0_REPLICA_SYNC_INTERVAL", "15")),
+                full_sync_interval=float(os.getenv("MEM0_REPLICA_FULL_SYNC_INTERVAL", "600")),
+                idle_ttl=float(os.getenv("MEM0_REPLICA_IDLE_TTL", "900")),
+                max_users=int(os.getenv("MEM0_REPLICA_MAX_USERS", "1000")),
+            )
+            self.replica.start()
+    
+    async def _run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """在有界线程池中执行阻塞调用并等待结果"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+    
+    @property
+    def use_local_fallback(self) -> bool:
+        """Mem0 熔断器处于打开状态时，请求直接走本地存储"""
+        return self.breaker.state == CircuitBreaker.OPEN
+
+    @use_local_fallback.setter
+    def use_local_fallback(self, value: bool):
+        if value:
+            self.breaker.force_open()
+        else:
+            self.breaker.reset()
+
+    def _probe_mem0(self):
+        """熔断期间的探活：取一条记忆，不抛异常即视为 Mem0 已恢复"""
+        self.storage.get_all(version="v2", filters={"AND": [{"user_id": self.DEFAULT_USER_ID}]},
+                             page=1, page_size=1)
+
+    def circuit_stats(self) -> Dict[str, Any]:
+        """
+        Mem0 熔断器的状态与转换计数。
+
+        Returns:
+            Dict: 见 CircuitBreaker.stats。
+        """
+        return self.breaker.stats()
+
+    def _submit_queued(self, entry: Dict[str, Any]):
+        """写后队列的投递函数：查重后经熔断器提交到 Mem0，异常交由队列重试"""
+        metadata = Metadata(privacy_level=PrivacyLevel(entry["metadata"]["privacy_level"]),
+                            source=entry["metadata"]["source"])
+        if self.dedup_threshold is not None and self._is_duplicate(entry["text"], metadata, entry["user_id"]):
+            with self._dedup_lock:
+                self.dedup_skipped += 1
+            return
+        self.breaker.call(
+            self.storage.add,
+            [{"role": "user", "content": entry["text"]}],
+            user_id=entry["user_id"],
+            output_format="v1.1",
+            metadata=entry["metadata"],
+            infer=True
+        )
+        self._mem0_written(entry["user_id"])
+
+    def _write_dead_to_local(self, entry: Dict[str, Any]):
+        """写后队列条目重试耗尽时写入本地存储，由降级回放在 Mem0 恢复后再次提交"""
+        metadata = Metadata(privacy_level=PrivacyLevel(entry["metadata"]["privacy_level"]),
+                            source=entry["metadata"]["source"])
+        result = self._get_local_storage().add(entry["text"], metadata, user_id=entry["user_id"])
+        if not result.startswith("ad-context记忆成功"):
+            raise RuntimeError(result)
+
+    def _fetch_replica_page(self, user_id: str, updated_since: Optional[str], page: int,
+                            page_size: int) -> Dict[str, Any]:
+        """副本同步：拉取一页 Mem0 记忆，updated_since 非空时只拉取此后更新的记忆"""
+        conditions: List[Dict[str, Any]] = [{"user_id": user_id}]
+        if updated_since:
+            conditions.append({"updated_at": {"gte": updated_since}})
+        return self.breaker.call(self.storage.get_all, version="v2", filters={"AND": conditions},
+                                 page=page, page_size=page_size)
+
+    def _mem0_written(self, user_id: str):
+        """Mem0 写入成功后使该用户的副本失效，保证随后的检索能读到这次写入"""
+        if self.replica is not None:
+            self.replica.invalidate(user_id)
+
+    def replica_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Mem0 本地副本的同步状态与命中计数。
+
+        Returns:
+            Optional[Dict]: 见 Mem0Replica.stats，未启用副本时为空。
+        """
+        return self.replica.stats() if self.replica is not None else None
+
+    def write_queue_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        写后队列的深度与时延。
+
+        Returns:
+            Optional[Dict]: 见 WriteBehindQueue.stats，未启用写后模式时为空。
+        """
+        return self.write_queue.stats() if self.write_queue is not None else None
+
+    def _on_breaker_state_change(self, previous: str, state: str):
+        """熔断器恢复闭合时在后台回放降级写入（在熔断器锁内调用，只启动线程）"""
+        if state == CircuitBreaker.CLOSED and self.replay_on_recovery and self.local_storage is not None:
+            self.replay_fallback_writes_in_background()
+
+    def _get_replayer(self) -> FallbackReplayer:
+        """获取降级写入回放器，首次调用时创建"""
+        local_storage = self._get_local_storage()
+        with self._local_storage_lock:
+            if self.replayer is None:
+                self.replayer = FallbackReplayer(
+                    local_storage,
+                    submit=self._replay_to_mem0,
+                    lookup=self._find_replayed,
+                    path=os.getenv("MEM0_REPLAY_DB_PATH", "./mem0_replay.db"),
+                    batch_size=int(os.getenv("MEM0_REPLAY_BATCH_SIZE", "32")),
+                    max_concurrency=int(os.getenv("MEM0_REPLAY_CONCURRENCY", "4")),
+                )
+            return self.replayer
+
+    def _replay_to_mem0(self, memory: Dict[str, Any]) -> List[str]:
+        """把一条本地记忆写入 Mem0，元数据中带上本地ID以便中断后查重"""
+        metadata = dict(memory.get("metadata", {}))
+        metadata["local_id"] = memory["id"]
+        result = self.breaker.call(
+            self.storage.add,
+            [{"role": "user", "content": memory["content"]}],
+            user_id=memory.get("user_id") or self.DEFAULT_USER_ID,
+            output_format="v1.1",
+            metadata=metadata,
+            infer=True
+        )
+        self._mem0_written(memory.get("user_id") or self.DEFAULT_USER_ID)
+        results = result.get("results", []) if isinstance(result, dict) else []
+        return [item["id"] for item in results if isinstance(item, dict) and "id" in item]
+
+    def _find_replayed(self, memory: Dict[str, Any]) -> List[str]:
+        """查询 Mem0 中由该本地记忆回放生成的记忆ID"""
+        response = self.breaker.call(
+            self.storage.get_all,
+            version="v2",
+            filters={"AND": [{"user_id": memory.get("user_id") or self.DEFAULT_USER_ID},
+                             {"metadata": {"local_id": memory["id"]}}]},
+            page=1,
+            page_size=100
+        )
+        return [item["id"] for item in response.get("results", [])]
+
+    def replay_fallback_writes(self, user_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        把降级期间只写入本地存储的记忆分批回放到 Mem0，成功后删除本地副本。
+        可重复执行：已回放的记忆不会重复提交。
+
+        Args:
+            user_ids: 要回放的用户，为空时回放全部本地分区。
+
+        Returns:
+            Dict[str, int]: 见 FallbackReplayer.replay。
+        """
+        if self.use_local_fallback:
+            return {"replayed": 0, "skipped_sensitive": 0, "already_replayed": 0, "failed": 0, "unconfirmed": 0}
+        return self._get_replayer().replay(user_ids)
+
+    def replay_fallback_writes_in_background(self) -> threading.Thread:
+        """
+        在后台线程中执行 replay_fallback_writes（已有回放在运行时返回该线程）。
+
+        Returns:
+            threading.Thread: 执行回放的后台线程。
+        """
+        def replay():
+            try:
+                self.replay_fallback_writes()
+            except Exception as e:
+                print(f"回放降级写入失败: {str(e)}")
+
+        with self._local_storage_lock:
+            if self._replay_thread is None or not self._replay_thread.is_alive():
+                self._replay_thread = threading.Thread(target=replay, name="mem0-replay", daemon=True)
+                self._replay_thread.start()
+            return self._replay_thread
+
+    def _get_local_storage(self):
+        """获取按用户分区的本地存储，首次调用时创建（编码器在后台线程加载，不阻塞调用方）"""
+        with self._local_storage_lock:
+            if self.local_storage is None:
+                from storage.partitioned_storage import PartitionedLocalStorage
+                self.local_storage = PartitionedLocalStorage()
+            return self.local_storage
+    
+    def prewarm_local_storage(self) -> threading.Thread:
+        """在后台线程中预先创建本地存储并加载编码器，使首次降级时无需等待模型加载
+        
+        Returns:
+            threading.Thread: 执行预热的后台线程。
+        """
+        def warm_up():
+            try:
+                self._get_local_storage().wait_for_encoder()
+                print("本地存储预热完成")
+            except Exception as e:
+                print(f"本地存储预热失败: {str(e)}")
+        
+        thread = threading.Thread(target=warm_up, name="local-storage-prewarm", daemon=True)
+        thread.start()
+        return thread
+    
+    @property
+    def local_storage_ready(self) -> bool:
+        """本地存储的向量检索是否就绪（未就绪时降级检索走关键词匹配）"""
+        return self.local_storage is not None and self.local_storage.encoder_ready
         
-    async def add(self, text: str , metadata: Metadata,privacy_brief:Optional[str] = None) -> str:
+    async def add(self, text: str , metadata: Metadata,privacy_brief:Optional[str] = None,
+                  user_id: Optional[str] = None) -> str:
         """
         向存储中添加一个上下文片段。
         优先使用 Mem0，如果不可用则使用本地存储。
+        启用写后模式时，非隐私片段持久化到写入队列后立即返回，由后台线程提交到 Mem0。
 
         Args:
             text: 需要存储的上下文片段。
             metadata: 元数据对象，包含隐私级别和来源信息。
+            user_id: 记忆所属用户，默认 DEFAULT_USER_ID。
 
         Returns:
             str: 存储后返回的操作结果消息。
         """
         
+        user_id = user_id or self.DEFAULT_USER_ID
+        # 熔断期间直接写入本地存储
+        if self.use_local_fallback:
+            return await self._run(self._get_local_storage().add, text, metadata, user_id=user_id)
         # 尝试使用 Mem0
         try:
             
@@ -45,6 +335,21 @@ class  StorageService:
             else:
                  messages = [{"role": "user", "content": text}]
             
+            if not is_privacy and self.write_queue is not None:
+                # 写后模式：持久化入队即确认，查重和提交由后台线程完成
+                await self._run(self.write_queue.enqueue, {
+                    "text": text,
+                    "metadata": {"privacy_level": metadata.privacy_level.value, "source": metadata.source},
+                    "user_id": user_id,
+                })
+                return "ad-context记忆成功: 已加入写入队列"
+
+            if self.dedup_threshold is not None and await self._run(
+                    self._is_duplicate, messages[0]["content"], metadata, user_id):
+                with self._dedup_lock:
+                    self.dedup_skipped += 1
+                return "ad-context记忆成功: 与已有记忆重复，已跳过"
+            
             # 将 Metadata 对象转换为字典格式
             
             metadata_dict = {
@@ -78,9 +383,11 @@ class  StorageService:
                     
                     metadata_dict["blockchain_data_id"] = blockchain_data_id
                     
-                    self.storage.add(
+                    await self._run(
+                        self.breaker.call,
+                        self.storage.add,
                         messages, 
-                        user_id=self.DEFAULT_USER_ID, 
+                        user_id=user_id, 
                         output_format="v1.1", 
                         metadata=metadata_dict, # 传递字典而不是对象
                         infer = False
@@ -88,52 +395,186 @@ class  StorageService:
                 messages = [{"role": "user", "content": privacy_brief}]
                     
             else:
-                result = self.storage.add(
+                result = await self._run(
+                    self.breaker.call,
+                    self.storage.add,
                     messages, 
-                    user_id=self.DEFAULT_USER_ID, 
+                    user_id=user_id, 
                     output_format="v1.1", 
                     metadata=metadata_dict, # 传递字典而不是对象
                     infer = True
                 )
             
+            self._mem0_written(user_id)
             msg = "ad-context记忆成功"
             return msg
         except Exception as e:
-            # Mem0 失败时，尝试降级到本地存储
+            # Mem0 失败（失败已计入熔断器）时，本次写入降级到本地存储
             print(f"Mem0 添加失败，尝试本地存储: {str(e)}")
-            if not self.use_local_fallback:
-                self.use_local_fallback = True
+            try:
+                return await self._run(self._get_local_storage().add, text, metadata, user_id=user_id)
+            except Exception as local_error:
+                return f"ad-context记忆失败: Mem0 和本地存储都不可用 - {str(local_error)}"
+
+    def _is_duplicate(self, text: Optional[str], metadata: Metadata, user_id: str) -> bool:
+        """
+        写入 Mem0 前查重：检索同一用户、同一隐私级别下最相似的记忆。
+        查重失败时不阻止写入。
+
+        Args:
+            text: 将要写入 Mem0 的内容。
+            metadata: 新记忆的元数据。
+            user_id: 记忆所属用户。
+
+        Returns:
+            bool: 是否存在相似度不低于 dedup_threshold 的记忆。
+        """
+        if not text:
+            return False
+        with self._dedup_lock:
+            self.dedup_checked += 1
+        try:
+            results = self.breaker.call(self.storage.search, text, version="v1", user_id=user_id, top_k=3)
+        except Exception as e:
+            print(f"Mem0 查重失败，继续写入: {str(e)}")
+            return False
+        for result in results if isinstance(results, list) else []:
+            if not isinstance(result, dict):
+                continue
+            result_metadata = result.get('metadata') or {}
+            if (result_metadata.get('privacy_level') == metadata.privacy_level.value
+                    and (result.get('score') or 0.0) >= self.dedup_threshold):
+                return True
+        return False
+
+    def dedup_stats(self) -> Dict[str, Any]:
+        """
+        写入去重计数。
+
+        Returns:
+            Dict: Mem0 写入前查重的次数与跳过次数，以及本地存储的去重计数（已创建时）。
+        """
+        stats: Dict[str, Any] = {"mem0": {"checked": self.dedup_checked, "skipped": self.dedup_skipped}}
+        if self.local_storage is not None:
+            stats["local"] = self.local_storage.stats()["dedup"]
+        return stats
+
+    async def add_many(self, texts: List[str], metadatas: List[Metadata],
+                       privacy_briefs: Optional[List[Optional[str]]] = None,
+                       max_concurrency: int = 8, user_id: Optional[str] = None) -> str:
+        """
+        批量向存储中添加上下文片段，用于导入大量聊天记录。
+        非隐私片段与 add 的处理一致：启用写后模式时持久化到写入队列后即确认，否则查重后以有界并发提交到 Mem0；
+        隐私片段仍走 add 的上链流程；提交失败的片段批量写入本地存储。
+
+        Args:
+            texts: 需要存储的上下文片段列表。
+            metadatas: 与 texts 一一对应的元数据列表。
+            privacy_briefs: 与 texts 一一对应的隐私摘要列表（隐私片段使用）。
+            max_concurrency: 同时进行的 Mem0 请求数上限。
+            user_id: 记忆所属用户，默认 DEFAULT_USER_ID。
+
+        Returns:
+            str: 存储后返回的操作结果消息。
+        """
+        if len(metadatas) != len(texts):
+            return "ad-context批量记忆失败: texts 与 metadatas 数量不一致"
+        privacy_briefs = privacy_briefs or [None] * len(texts)
+        user_id = user_id or self.DEFAULT_USER_ID
+
+        if self.use_local_fallback:
+            return await self._run(self._get_local_storage().add_many, texts, metadatas, user_id=user_id)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def submit(text: str, metadata: Metadata, brief: Optional[str]) -> bool:
+            async with semaphore:
+                if metadata.privacy_level.value >= 3:
+                    result = await self.add(text, metadata, brief, user_id=user_id)
+                    # 查重跳过、写入队列、本地合并/更新都是成功；失败的隐私片段不能再以原文写入本地
+                    return result.startswith("ad-context记忆成功")
                 try:
-                    from storage.local_storage import LocalStorageService
-                    self.local_storage = LocalStorageService()
-                    return self.local_storage.add(text, metadata)
-                except Exception as local_error:
-                    return f"ad-context记忆失败: Mem0 和本地存储都不可用 - {str(local_error)}"
-            return f"ad-context记忆失败: {str(e)}"
+                    if self.write_queue is not None:
+                        # 写后模式：查重和提交由后台线程完成
+                        await self._run(self.write_queue.enqueue, {
+                            "text": text,
+                            "metadata": {"privacy_level": metadata.privacy_level.value, "source": metadata.source},
+                            "user_id": user_id,
+                        })
+                        return True
+                    if self.dedup_threshold is not None and await self._run(
+                            self._is_duplicate, text, metadata, user_id):
+                        with self._dedup_lock:
+                            self.dedup_skipped += 1
+                        return True
+                    await self._run(
+                        self.breaker.call,
+                        self.storage.add,
+                        [{"role": "user", "content": text}],
+                        user_id=user_id,
+                        output_format="v1.1",
+                        metadata={
+                            "privacy_level": metadata.privacy_level.value,
+                            "source": metadata.source
+                        },
+                        infer=True
+                    )
+                    self._mem0_written(user_id)
+                    return True
+                except Exception as e:
+                    print(f"Mem0 批量添加失败: {str(e)}")
+                    return False
+
+        results = await asyncio.gather(*[
+            submit(text, metadata, brief) for text, metadata, brief in zip(texts, metadatas, privacy_briefs)
+        ])
+
+        failed = [i for i, ok in enumerate(results) if not ok]
+        if not failed:
+            return f"ad-context批量记忆成功: {len(texts)} 条"
 
-    def search(self, query_text: str, top_k: int = 5,metadata_filter: Optional[Metadata] = None,) -> List[RetriveResult]:
+        # 失败的片段批量降级到本地存储
+        try:
+            local_result = await self._run(
+                self._get_local_storage().add_many,
+                [texts[i] for i in failed], [metadatas[i] for i in failed], user_id=user_id
+            )
+            return f"ad-context批量记忆: Mem0 成功 {len(texts) - len(failed)} 条，本地存储 {local_result}"
+        except Exception as local_error:
+            return f"ad-context批量记忆部分失败: {len(failed)} 条未能存储 - {str(local_error)}"
+
+    def search(self, query_text: str, top_k: int = 5,metadata_filter: Optional[Metadata] = None,
+               user_id: Optional[str] = None) -> List[RetriveResult]:
         """
         在存储中进行搜索。
-        优先使用 Mem0，如果不可用则使用本地存储。
+        启用本地副本且副本在陈旧界限内时直接在副本中检索；否则优先使用 Mem0，如果不可用则使用本地存储。
 
         Args:
             query_text: 用于语义搜索的查询文本。
             top_k: 返回最相似结果的数量。
             metadata_filter: 用于元数据过滤的Metadata对象, e.g., 
                              {"privacy_level": "PUBLIC", "timestamp": {"gt": 808056}}.
+            user_id: 检索的用户，默认 DEFAULT_USER_ID。
 
         Returns:
             匹配到的上下文片段对象列表。
         """
-        # 如果启用了本地存储降级
-        if self.use_local_fallback and self.local_storage:
-            return self.local_storage.search(query_text, top_k, metadata_filter)
+        user_id = user_id or self.DEFAULT_USER_ID
+        # 熔断期间直接使用本地存储
+        if self.use_local_fallback:
+            return self._search_local(query_text, top_k, metadata_filter, user_id)
+        # 副本在陈旧界限内时直接在本地检索
+        if self.replica is not None and self.replica.is_fresh(user_id):
+            try:
+                return self.replica.search(query_text, top_k, metadata_filter, user_id)
+            except Exception as e:
+                print(f"副本检索失败，使用 Mem0: {str(e)}")
         
         # 尝试使用 Mem0
         try:
             # 准备查询参数
             kwargs = {
-                'user_id': self.DEFAULT_USER_ID,
+                'user_id': user_id,
                 'top_k': top_k
             }
             
@@ -142,7 +583,7 @@ class  StorageService:
                 kwargs['filters'] = metadata_filter
             
             # 调用mem0客户端的search方法
-            results = self.storage.search(query_text, version="v1", **kwargs)
+            results = self.breaker.call(self.storage.search, query_text, version="v1", **kwargs)
             
             # 检查results是否为None或空
             if results is None:
@@ -181,48 +622,212 @@ class  StorageService:
             return retrieve_results
             
         except Exception as e:
+            # Mem0 失败（失败已计入熔断器）时，本次检索降级到本地存储
             print(f"Mem0 搜索失败，尝试本地存储: {str(e)}")
-            # Mem0 失败时，尝试降级到本地存储
-            if not self.use_local_fallback:
-                self.use_local_fallback = True
-                try:
-                    from storage.local_storage import LocalStorageService
-                    self.local_storage = LocalStorageService()
-                    return self.local_storage.search(query_text, top_k, metadata_filter)
-                except Exception as local_error:
-                    print(f"本地存储搜索也失败: {str(local_error)}")
-                    return []
-            return []
+            return self._search_local(query_text, top_k, metadata_filter, user_id)
 
-    def list(self, limit: int = 100, filters: Optional[Metadata] = None) -> List[Dict[str, Any]]:
+    def _search_local(self, query_text: str, top_k: int, metadata_filter: Optional[Metadata],
+                      user_id: str) -> List[RetriveResult]:
+        """在本地存储中检索，启用副本时合并副本（热备）的结果，失败时返回空列表"""
+        try:
+            results = self._get_local_storage().search(query_text, top_k, metadata_filter, user_id=user_id)
+        except Exception as local_error:
+            print(f"本地存储搜索也失败: {str(local_error)}")
+            results = []
+        if self.replica is not None:
+            try:
+                results = results + self.replica.search(query_text, top_k, metadata_filter, user_id)
+            except Exception as replica_error:
+                print(f"副本检索失败: {str(replica_error)}")
+            results = sorted(results, key=lambda result: result.score, reverse=True)[:top_k]
+        return results
+
+    def list(self, limit: int = 100, filters: Optional[Metadata] = None,
+             user_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         列出所有记忆或根据过滤器列出。
 
         Args:
             limit: 返回结果的最大数量。
             filters: 应用于列表的额外过滤器。
+            user_id: 记忆所属用户，默认 DEFAULT_USER_ID。
 
         Returns:
             记忆列表。
         """
         try:
-            # 准备查询参数
-            kwargs = {
-                'user_id': self.DEFAULT_USER_ID,
-            }
-            
-            # 如果有过滤器，添加到参数中
-            if filters:
-                kwargs['filters'] = filters.dict()
-            
-            # 调用mem0客户端的get_all方法
-            memories = self.storage.get_all(version="v1", **kwargs)
-            return memories
+            # 只取一页，不再把全部记忆拉到内存中
+            return self.list_page(limit, filters=filters, user_id=user_id).memories
           
             
         except Exception as e:
             print(f"Error listing memories: {str(e)}")
             return []
+
+    def list_page(self, limit: int = 100, cursor: Optional[str] = None, filters: Optional[Metadata] = None,
+                  user_id: Optional[str] = None) -> MemoryPage:
+        """
+        按游标分页列出记忆。
+        本地存储降级时游标由本地存储生成；使用 Mem0 时游标为 v2 get_all 的页码。
+
+        Args:
+            limit: 每页数量。
+            cursor: 上一页返回的 next_cursor，为空时从第一页开始。
+            filters: 应用于列表的额外过滤器。
+            user_id: 记忆所属用户，默认 DEFAULT_USER_ID。
+
+        Returns:
+            MemoryPage: 本页记忆及下一页游标（没有更多记忆时为空）。
+        """
+        user_id = user_id or self.DEFAULT_USER_ID
+        if self.use_local_fallback:
+            return self._get_local_storage().list_page(limit, cursor, filters, user_id=user_id)
+
+        page = int(cursor) if cursor else 1
+        conditions: List[Dict[str, Any]] = [{"user_id": user_id}]
+        if filters:
+            conditions.append({"metadata": {"privacy_level": filters.privacy_level.value}})
+        try:
+            response = self.breaker.call(self.storage.get_all, version="v2", filters={"AND": conditions},
+                                         page=page, page_size=limit)
+        except CircuitOpenError:
+            # 半开状态下试探名额已被占用；Mem0 的页码游标对本地存储无效，只有首页能改走本地
+            if cursor:
+                raise
+            return self._get_local_storage().list_page(limit, None, filters, user_id=user_id)
+        return MemoryPage(
+            memories=response.get("results", []),
+            next_cursor=str(page + 1) if response.get("next") else None
+        )
+
+    async def iter_memories(self, page_size: int = 100, filters: Optional[Metadata] = None,
+                            user_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        逐页异步遍历全部记忆，同一时刻只持有一页；每页在线程池中获取，不阻塞事件循环。
+
+        Args:
+            page_size: 每页数量。
+            filters: 应用于列表的额外过滤器。
+            user_id: 记忆所属用户，默认 DEFAULT_USER_ID。
+
+        Yields:
+            Dict: 记忆条目。
+        """
+        cursor = None
+        while True:
+            page = await self._run(self.list_page, page_size, cursor, filters, user_id)
+            for memory in page.memories:
+                yield memory
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
             
-    def delete(self,memory_id)-> Dict[str, Any]:
-        return self.storage.delete(memory_id)
+    def delete(self, memory_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        删除一条记忆。
+        已回放到 Mem0 的本地记忆ID映射为对应的 Mem0 记忆；尚未回放的本地记忆只在本地删除。
+
+        Args:
+            memory_id: 记忆ID（Mem0 记忆ID或本地记忆ID）。
+            user_id: 记忆所属用户，默认 DEFAULT_USER_ID（用于定位本地分区）。
+
+        Returns:
+            Dict: 操作结果。
+        """
+        user_id = user_id or self.DEFAULT_USER_ID
+        mem0_ids = self.replayer.mem0_ids(memory_id) if self.replayer is not None else None
+        if not mem0_ids and self.local_storage is not None:
+            result = self.local_storage.delete(memory_id, user_id=user_id)
+            if result.get("deleted"):
+                if self.replayer is not None:
+                    self.replayer.forget(memory_id)
+                return result
+        results = [self.breaker.call(self.storage.delete, mem0_id) for mem0_id in mem0_ids or [memory_id]]
+        if self.replica is not None:
+            for mem0_id in mem0_ids or [memory_id]:
+                self.replica.delete(mem0_id)
+        return results[-1]
+
+    @staticmethod
+    def _is_mem0_outage(error: Exception) -> bool:
+        """
+        熔断器的异常分类：4xx 客户端错误（如记忆不存在、参数错误）说明 Mem0 可用，不计为失败；
+        超时 (408) 和限流 (429) 仍计为失败。
+
+        Args:
+            error: Mem0 调用抛出的异常。
+
+        Returns:
+            bool: 是否计为 Mem0 故障。
+        """
+        seen = set()
+        while error is not None and id(error) not in seen:
+            seen.add(id(error))
+            status = getattr(getattr(error, "response", None), "status_code", None)
+            if status is None:
+                match = re.fullmatch(r"HTTP_(\d{3})", str(getattr(error, "error_code", "")))
+                status = int(match.group(1)) if match else None
+            if isinstance(status, int):
+                return not (400 <= status < 500 and status not in (408, 429))
+            error = error.__cause__ or error.__context__
+        return True
+
+    async def search_async(self, query_text: str, top_k: int = 5, metadata_filter: Optional[Metadata] = None,
+                           user_id: Optional[str] = None) -> List[RetriveResult]:
+        """
+        search 的异步版本：在有界线程池中执行，等待 Mem0 响应期间不阻塞事件循环。
+
+        Args:
+            query_text: 用于语义搜索的查询文本。
+            top_k: 返回最相似结果的数量。
+            metadata_filter: 用于元数据过滤的Metadata对象。
+            user_id: 检索的用户，默认 DEFAULT_USER_ID。
+
+        Returns:
+            匹配到的上下文片段对象列表。
+        """
+        return await self._run(self.search, query_text, top_k, metadata_filter, user_id)
+
+    async def list_async(self, limit: int = 100, filters: Optional[Metadata] = None,
+                         user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        list 的异步版本。
+
+        Args:
+            limit: 返回结果的最大数量。
+            filters: 应用于列表的额外过滤器。
+            user_id: 记忆所属用户，默认 DEFAULT_USER_ID。
+
+        Returns:
+            记忆列表。
+        """
+        return await self._run(self.list, limit, filters, user_id)
+
+    async def list_page_async(self, limit: int = 100, cursor: Optional[str] = None,
+                              filters: Optional[Metadata] = None, user_id: Optional[str] = None) -> MemoryPage:
+        """
+        list_page 的异步版本。
+
+        Args:
+            limit: 每页数量。
+            cursor: 上一页返回的 next_cursor，为空时从第一页开始。
+            filters: 应用于列表的额外过滤器。
+            user_id: 记忆所属用户，默认 DEFAULT_USER_ID。
+
+        Returns:
+            MemoryPage: 本页记忆及下一页游标。
+        """
+        return await self._run(self.list_page, limit, cursor, filters, user_id)
+
+    async def delete_async(self, memory_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        delete 的异步版本。
+
+        Args:
+            memory_id: 记忆ID。
+            user_id: 记忆所属用户，默认 DEFAULT_USER_ID。
+
+        Returns:
+            Dict: 操作结果。
+        """
+        return await self._run(self.delete, memory_id, user_id)
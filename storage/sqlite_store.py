@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite 记忆存储
+与 MemoryJournal 接口一致的记录存储：记忆正文和元数据保存在 WAL 模式的 SQLite 中，
+常用元数据列建立索引，使元数据过滤可以下推到 SQL，只有通过过滤的候选才参与向量打分。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from storage.filters import Condition, to_sql
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    privacy_level INTEGER,
+    source TEXT,
+    timestamp TEXT,
+    user_id TEXT,
+    blockchain_data_id TEXT,
+    embedding_row INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_memories_privacy_timestamp ON memories (privacy_level, timestamp);
+CREATE INDEX IF NOT EXISTS idx_memories_timestamp ON memories (timestamp);
+CREATE INDEX IF NOT EXISTS idx_memories_source ON memories (source);
+CREATE INDEX IF NOT EXISTS idx_memories_user_id ON memories (user_id);
+CREATE INDEX IF NOT EXISTS idx_memories_blockchain_data_id ON memories (blockchain_data_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SQLiteMemoryStore:
+    """SQLite 记忆存储
+
+    replay / append_add / append_delete / compact 与 MemoryJournal 语义相同，
+    额外提供 query 用于把元数据过滤下推到 SQL。
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        """打开（或创建）数据库
+
+        参数:
+            path: 数据库文件路径
+            fsync: 为 True 时使用 synchronous=FULL，否则使用 NORMAL
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.compaction_lock = threading.RLock()
+        self.meta: Dict[str, Any] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self._conn.executescript(SCHEMA)
+
+    @property
+    def record_count(self) -> int:
+        """存储中的记忆条数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+
+    def replay(self) -> Dict[str, Dict[str, Any]]:
+        """加载全部记忆
+
+        返回:
+            Dict[str, Dict]: 按写入顺序排列的 记忆ID -> 记忆条目
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, data FROM memories ORDER BY seq").fetchall()
+            self.meta = {key: json.loads(value) for key, value in self._conn.execute("SELECT key, value FROM meta")}
+        memories = {}
+        for seq, data in rows:
+            memory = json.loads(data)
+            # 旧版本写入的记忆没有写入序号，沿用行序号
+            memory.setdefault("seq", seq)
+            memories[memory["id"]] = memory
+        return memories
+
+    @staticmethod
+    def _row(memory: Dict[str, Any]) -> tuple:
+        metadata = memory.get("metadata", {})
+        return (
+            memory.get("seq"),
+            memory["id"],
+            metadata.get("privacy_level"),
+            metadata.get("source"),
+            memory.get("timestamp"),
+            memory.get("user_id"),
+            metadata.get("blockchain_data_id"),
+            memory.get("embedding_row"),
+            json.dumps(memory, ensure_ascii=False, separators=(",", ":")),
+        )
+
+    def append_add(self, memory: Dict[str, Any]):
+        """新增或覆盖一条记忆
+
+        参数:
+            memory: 记忆条目
+        """
+        self.add_many([memory])
+
+    def add_many(self, memories: List[Dict[str, Any]]):
+        """在一个事务中新增或覆盖多条记忆
+
+        参数:
+            memories: 记忆条目列表
+        """
+        self._write(memories)
+
+    def _write(self, memories: List[Dict[str, Any]], replace_all: bool = False,
+               meta: Optional[Dict[str, Any]] = None):
+        """在一个事务中写入记忆，replace_all 为 True 时先清空表，meta 非空时同时替换元数据"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                if meta is not None:
+                    self._conn.execute("DELETE FROM meta")
+                    self._conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                           [(key, json.dumps(value)) for key, value in meta.items()])
+                if replace_all:
+                    self._conn.execute("DELETE FROM memories")
+                # 行序号使用记忆自带的写入序号（压缩重写后不变）；覆盖已有记忆时原地更新，保留写入顺序
+                self._conn.executemany(
+                    "INSERT INTO memories (seq, id, privacy_level, source, timestamp, user_id, "
+                    "blockchain_data_id, embedding_row, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET privacy_level = excluded.privacy_level, "
+                    "source = excluded.source, timestamp = excluded.timestamp, user_id = excluded.user_id, "
+                    "blockchain_data_id = excluded.blockchain_data_id, "
+                    "embedding_row = excluded.embedding_row, data = excluded.data",
+                    [self._row(memory) for memory in memories]
+                )
+
+    def save_meta(self, meta: Dict[str, Any]):
+        """替换存储级元数据
+
+        参数:
+            meta: 新的存储级元数据
+        """
+        self._write([], meta=meta)
+        self.meta = meta
+
+    def append_delete(self, memory_id: str):
+        """删除一条记忆
+
+        参数:
+            memory_id: 记忆ID
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM memories WHERE id = ?", (memory_id,))
+
+    def query(self, conditions: List[Condition], columns: str = "id",
+              limit: Optional[int] = None, after: Optional[Tuple[str, int]] = None) -> List[tuple]:
+        """按条件查询记忆（条件在 SQL 中求值，可命中元数据索引）
+
+        参数:
+            conditions: normalize_filter 返回的条件列表
+            columns: 要返回的列
+            limit: 最多返回的行数
+            after: 分页游标 (记忆ID, 写入序号)，只返回序号更大（之后写入）的行
+
+        返回:
+            List[tuple]: 查询结果行
+        """
+        where, params = to_sql(conditions)
+        if after is not None:
+            where += " AND seq > ?"
+            params.append(after[1])
+        sql = f"SELECT {columns} FROM memories WHERE {where} ORDER BY seq"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def maybe_compact(self, live_count: int, snapshot: Callable[[], List[Dict[str, Any]]]):
+        """SQLite 原地删除，无需压缩"""
+
+    def compact(self, snapshot: Callable[[], List[Dict[str, Any]]], meta: Optional[Dict[str, Any]] = None):
+        """用快照整体重写存储（用于从旧格式迁移和向量文件压缩）
+
+        参数:
+            snapshot: 返回当前全部存活记忆的回调
+            meta: 新的存储级元数据，为空时保持不变；与记忆在同一事务中写入
+        """
+        with self.compaction_lock:
+            self._write(snapshot(), replace_all=True, meta=meta)
+            if meta is not None:
+                self.meta = meta
+
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """与 MemoryJournal 接口保持一致"""
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
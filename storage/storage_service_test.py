@@ -0,0 +1,305 @@
+import asyncio
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from schemas.common import Metadata
+from schemas.privacy import PrivacyLevel
+from storage.service import StorageService
+
+
+def make_metadata(level: PrivacyLevel = PrivacyLevel.LEVEL_1_PUBLIC) -> Metadata:
+    return Metadata(privacy_level=level, source="test")
+
+
+@pytest.fixture
+def mem0_client():
+    with patch("storage.service.MemoryClient") as mock_client_class:
+        client = MagicMock()
+        mock_client_class.return_value = client
+        yield client
+
+
+@pytest.fixture
+def service(mem0_client):
+    return StorageService(MagicMock())
+
+
+class TestStorageService:
+    """StorageService测试类"""
+
+    def test_add_many_submits_to_mem0(self, service, mem0_client):
+        texts = [f"记忆 {i}" for i in range(5)]
+
+        result = asyncio.run(service.add_many(texts, [make_metadata()] * 5, max_concurrency=2))
+
+        assert result == "ad-context批量记忆成功: 5 条"
+        assert mem0_client.add.call_count == 5
+
+    def test_add_many_falls_back_to_local_for_failures(self, service, mem0_client):
+        mem0_client.add.side_effect = [None, Exception("boom")]
+        service.local_storage = MagicMock()
+        service.local_storage.add_many.return_value = "ad-context批量记忆成功: 1 条"
+
+        result = asyncio.run(service.add_many(["a", "b"], [make_metadata()] * 2, max_concurrency=1))
+
+        assert "Mem0 成功 1 条" in result
+        local_texts = service.local_storage.add_many.call_args[0][0]
+        assert local_texts == ["b"]
+
+    def test_prewarm_creates_local_storage_once(self, service):
+        with patch("storage.partitioned_storage.PartitionedLocalStorage") as local_class:
+            local_class.return_value.encoder_ready = True
+
+            service.prewarm_local_storage().join(timeout=5)
+            service._get_local_storage()
+
+        assert local_class.call_count == 1
+        assert service.local_storage_ready
+
+    def test_search_passes_user_id_to_local_partition(self, service):
+        service.use_local_fallback = True
+        service.local_storage = MagicMock()
+
+        service.search("咖啡", top_k=3, user_id="alice")
+
+        assert service.local_storage.search.call_args[1]["user_id"] == "alice"
+
+    def test_list_page_uses_mem0_pages(self, service, mem0_client):
+        mem0_client.get_all.return_value = {"results": [{"id": "a"}], "next": "https://api/page=2"}
+
+        page = service.list_page(limit=1, cursor="1", user_id="alice")
+
+        assert page.memories == [{"id": "a"}]
+        assert page.next_cursor == "2"
+        kwargs = mem0_client.get_all.call_args[1]
+        assert kwargs["page"] == 1 and kwargs["page_size"] == 1
+        assert kwargs["filters"] == {"AND": [{"user_id": "alice"}]}
+
+    def test_iter_memories_streams_pages(self, service, mem0_client):
+        mem0_client.get_all.side_effect = [
+            {"results": [{"id": "a"}, {"id": "b"}], "next": "page=2"},
+            {"results": [{"id": "c"}], "next": None},
+        ]
+
+        async def collect():
+            return [memory["id"] async for memory in service.iter_memories(page_size=2)]
+
+        assert asyncio.run(collect()) == ["a", "b", "c"]
+        assert mem0_client.get_all.call_count == 2
+
+    def test_add_skips_near_duplicate_in_mem0(self, service, mem0_client):
+        service.dedup_threshold = 0.9
+        mem0_client.search.return_value = [
+            {"memory": "用户喜欢咖啡", "score": 0.95, "metadata": {"privacy_level": 1}},
+        ]
+
+        result = asyncio.run(service.add("用户很喜欢咖啡", make_metadata()))
+
+        assert result == "ad-context记忆成功: 与已有记忆重复，已跳过"
+        mem0_client.add.assert_not_called()
+        assert service.dedup_stats()["mem0"] == {"checked": 1, "skipped": 1}
+
+    def test_add_writes_when_neighbor_has_other_privacy_level(self, service, mem0_client):
+        service.dedup_threshold = 0.9
+        mem0_client.search.return_value = [
+            {"memory": "用户喜欢咖啡", "score": 0.99, "metadata": {"privacy_level": 2}},
+        ]
+
+        asyncio.run(service.add("用户喜欢咖啡", make_metadata()))
+
+        assert mem0_client.add.call_count == 1
+
+    def test_add_many_skips_near_duplicates_like_add(self, service, mem0_client):
+        service.dedup_threshold = 0.9
+        mem0_client.search.return_value = [
+            {"memory": "用户喜欢咖啡", "score": 0.95, "metadata": {"privacy_level": 1}},
+        ]
+        service.local_storage = MagicMock()
+
+        result = asyncio.run(service.add_many(["用户很喜欢咖啡"], [make_metadata()]))
+
+        assert result == "ad-context批量记忆成功: 1 条"
+        mem0_client.add.assert_not_called()
+        service.local_storage.add_many.assert_not_called()
+        assert service.dedup_stats()["mem0"] == {"checked": 1, "skipped": 1}
+
+    def test_add_many_uses_write_behind_queue(self, mem0_client, tmp_path):
+        service = StorageService(MagicMock(), write_behind=True, write_queue_path=str(tmp_path / "queue.db"))
+
+        result = asyncio.run(service.add_many(["a", "b"], [make_metadata()] * 2, user_id="alice"))
+        assert service.write_queue.flush(timeout=5)
+        stats = service.write_queue_stats()
+        service.write_queue.close()
+
+        assert result == "ad-context批量记忆成功: 2 条"
+        assert stats["enqueued"] == 2 and stats["submitted"] == 2
+        assert {call[1]["user_id"] for call in mem0_client.add.call_args_list} == {"alice"}
+
+    def test_add_many_does_not_rewrite_deduplicated_private_item_locally(self, service, mem0_client):
+        service.dedup_threshold = 0.9
+        mem0_client.search.return_value = [
+            {"memory": "隐私摘要", "score": 0.95, "metadata": {"privacy_level": 3}},
+        ]
+        service.local_storage = MagicMock()
+
+        result = asyncio.run(service.add_many(
+            ["my secret"], [make_metadata(PrivacyLevel.LEVEL_3_RESTRICTED)], privacy_briefs=["隐私摘要"]
+        ))
+
+        assert result == "ad-context批量记忆成功: 1 条"
+        service.local_storage.add_many.assert_not_called()
+        mem0_client.add.assert_not_called()
+
+    def test_search_async_does_not_block_event_loop(self, mem0_client):
+        release = threading.Event()
+
+        def slow_search(query, **kwargs):
+            release.wait(timeout=5)
+            return [{"memory": query, "score": 0.9, "metadata": {"privacy_level": 1, "source": "test"}}]
+
+        mem0_client.search.side_effect = slow_search
+        service = StorageService(MagicMock(), max_concurrency=4)
+
+        async def scenario():
+            searches = [asyncio.create_task(service.search_async(f"q{i}")) for i in range(3)]
+            await asyncio.sleep(0.05)
+            # 三个检索都在等待 Mem0 时事件循环仍然可以调度其他协程
+            assert not any(task.done() for task in searches)
+            release.set()
+            return await asyncio.gather(*searches)
+
+        results = asyncio.run(scenario())
+
+        assert [r[0].context for r in results] == ["q0", "q1", "q2"]
+
+    def test_single_mem0_failure_falls_back_without_opening_circuit(self, service, mem0_client):
+        mem0_client.search.side_effect = Exception("timeout")
+        service.local_storage = MagicMock()
+        service.local_storage.search.return_value = []
+
+        service.search("咖啡")
+
+        assert service.local_storage.search.call_count == 1
+        assert not service.use_local_fallback
+        assert service.circuit_stats()["state"] == "closed"
+
+    def test_repeated_failures_open_circuit_and_skip_mem0(self, service, mem0_client):
+        mem0_client.search.side_effect = Exception("timeout")
+        service.local_storage = MagicMock()
+        service.local_storage.search.return_value = []
+        for _ in range(service.breaker.min_calls):
+            service.search("咖啡")
+        calls = mem0_client.search.call_count
+
+        service.search("咖啡")
+        service.breaker.close()
+
+        assert service.use_local_fallback
+        assert mem0_client.search.call_count == calls
+        assert service.local_storage.search.call_count == service.breaker.min_calls + 1
+
+    def test_write_behind_acknowledges_before_mem0_submission(self, mem0_client, tmp_path):
+        service = StorageService(MagicMock(), write_behind=True, write_queue_path=str(tmp_path / "queue.db"))
+
+        result = asyncio.run(service.add("喜欢手冲咖啡", make_metadata(), user_id="alice"))
+        assert result == "ad-context记忆成功: 已加入写入队列"
+        assert service.write_queue.flush(timeout=5)
+        stats = service.write_queue_stats()
+        service.write_queue.close()
+
+        kwargs = mem0_client.add.call_args[1]
+        assert mem0_client.add.call_args[0][0] == [{"role": "user", "content": "喜欢手冲咖啡"}]
+        assert kwargs["user_id"] == "alice"
+        assert kwargs["infer"] is True
+        assert stats["depth"] == 0
+        assert stats["submitted"] == 1
+
+    def test_exhausted_write_behind_entry_moves_to_local_storage(self, mem0_client, tmp_path, monkeypatch):
+        monkeypatch.setenv("MEM0_WRITE_MAX_ATTEMPTS", "1")
+        mem0_client.add.side_effect = Exception("bad gateway")
+        service = StorageService(MagicMock(), write_behind=True, write_queue_path=str(tmp_path / "queue.db"))
+        service.local_storage = MagicMock()
+        service.local_storage.add.return_value = "ad-context记忆成功"
+
+        asyncio.run(service.add("喜欢手冲咖啡", make_metadata(), user_id="alice"))
+        assert service.write_queue.flush(timeout=5)
+        stats = service.write_queue_stats()
+        service.write_queue.close()
+
+        assert service.local_storage.add.call_args[0][0] == "喜欢手冲咖啡"
+        assert service.local_storage.add.call_args[1]["user_id"] == "alice"
+        assert stats["dead"] == 0 and stats["handed_off"] == 1
+
+    def test_replay_tags_mem0_writes_with_local_id(self, service, mem0_client):
+        mem0_client.add.return_value = {"results": [{"id": "m1", "memory": "喜欢咖啡", "event": "ADD"}]}
+        memory = {"id": "local-1", "content": "喜欢咖啡", "user_id": "alice",
+                  "metadata": {"privacy_level": 1, "source": "test"}}
+
+        assert service._replay_to_mem0(memory) == ["m1"]
+        kwargs = mem0_client.add.call_args[1]
+        assert kwargs["user_id"] == "alice"
+        assert kwargs["metadata"]["local_id"] == "local-1"
+
+    def test_delete_maps_replayed_local_id_to_mem0(self, service, mem0_client):
+        service.replayer = MagicMock()
+        service.replayer.mem0_ids.return_value = ["m1", "m2"]
+
+        service.delete("local-1")
+
+        assert [call[0][0] for call in mem0_client.delete.call_args_list] == ["m1", "m2"]
+
+    def test_delete_unreplayed_local_id_stays_local(self, service, mem0_client):
+        service.replayer = MagicMock()
+        service.replayer.mem0_ids.return_value = None
+        service.local_storage = MagicMock()
+        service.local_storage.delete.return_value = {"message": "记忆删除成功", "deleted": True}
+
+        result = service.delete("local-1", user_id="alice")
+
+        assert result["deleted"]
+        assert service.local_storage.delete.call_args[1]["user_id"] == "alice"
+        service.replayer.forget.assert_called_once_with("local-1")
+        mem0_client.delete.assert_not_called()
+
+    def test_mem0_not_found_does_not_count_against_breaker(self, service, mem0_client):
+        class NotFound(Exception):
+            error_code = "HTTP_404"
+
+        mem0_client.delete.side_effect = NotFound("memory not found")
+        for _ in range(service.breaker.min_calls + 1):
+            with pytest.raises(NotFound):
+                service.delete("missing")
+
+        assert service.circuit_stats()["failures"] == 0
+        assert not service.use_local_fallback
+
+    def test_fresh_replica_answers_search_without_mem0(self, service, mem0_client):
+        service.replica = MagicMock()
+        service.replica.is_fresh.return_value = True
+        service.replica.search.return_value = []
+
+        service.search("咖啡", user_id="alice")
+
+        assert mem0_client.search.call_count == 0
+        assert service.replica.search.call_args[0][3] == "alice"
+
+    def test_mem0_write_invalidates_replica(self, service, mem0_client):
+        service.replica = MagicMock()
+
+        asyncio.run(service.add("喜欢咖啡", make_metadata(), user_id="alice"))
+
+        service.replica.invalidate.assert_called_once_with("alice")
+
+    def test_local_encoder_processes_setting_reaches_shared_encoder(self, service, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv("LOCAL_ENCODER_PROCESSES", "2")
+        with patch("storage.partitioned_storage.ProcessPoolEncoder") as pool_class:
+            local_storage = service._get_local_storage()
+            assert local_storage.wait_for_encoder(timeout=5)
+            local_storage.close()
+
+        assert pool_class.call_args[0][2] == 2
+        pool_class.return_value.encode.assert_called_once_with(["warm up"])
+        pool_class.return_value.close.assert_called_once()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻内存的向量索引
+为本地存储提供预归一化的 float32 向量矩阵，一次矩阵-向量乘法完成全部相似度计算
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from storage.embedding_store import InMemoryVectorStore
+from storage.quantization import PRECISIONS, QuantizedVectors
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按行做 L2 归一化
+
+    参数:
+        vectors: 一维或二维向量数组
+
+    返回:
+        np.ndarray: 归一化后的 float32 数组，零向量保持为零
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """从分数数组中选出分数最高的 top_k 个下标（按分数降序）
+
+    使用 argpartition 做 O(N) 选择，只对选中的 top_k 个元素排序。
+
+    参数:
+        scores: 一维分数数组
+        top_k: 需要的结果数量
+
+    返回:
+        np.ndarray: 按分数降序排列的下标
+    """
+    n = scores.shape[0]
+    if top_k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < n:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class VectorIndex:
+    """常驻内存的精确向量索引
+
+    向量按行保存在向量存储中（内存或 memmap 文件），索引维护与之平行的
+    id / 存活标记 / 隐私级别 / 写入时间 / 被检索次数数组，在 add / remove 时保持同步，
+    搜索时只需一次矩阵-向量乘法加 argpartition。删除只清除存活标记，行号保持稳定。
+    """
+
+    def __init__(self, store: Optional[Any] = None, ann: Optional[Any] = None,
+                 precision: str = "float32", rescore_factor: int = 4):
+        """初始化向量索引
+
+        参数:
+            store: 向量存储（InMemoryVectorStore 或 EmbeddingStore），为空时使用内存存储
+            ann: 可选的近似最近邻索引（IVFIndex），向量数达到其训练阈值后用于搜索
+            precision: 打分精度，"float32" 直接在存储上精确打分；"float16" / "int8" 在内存中的
+                       量化副本上粗打分，再从存储中读取 top_k * rescore_factor 个候选精确重打分
+            rescore_factor: 量化粗排时保留的候选倍数
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"不支持的向量精度: {precision}")
+        self.store = store if store is not None else InMemoryVectorStore()
+        self.ann = ann
+        self.precision = precision
+        self.rescore_factor = rescore_factor
+        self.quantized = QuantizedVectors(precision) if precision != "float32" else None
+        self._ann_lock = threading.Lock()
+        self._ann_thread: Optional[threading.Thread] = None
+        self._capacity = 0
+        self._alive = np.zeros(0, dtype=bool)
+        self._privacy = np.zeros(0, dtype=np.int8)
+        self._timestamps = np.zeros(0, dtype=np.float64)
+        self._access = np.zeros(0, dtype=np.float32)
+        self._ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.store.dim
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, memory_id: str) -> bool:
+        return memory_id in self._rows
+
+    @property
+    def dead_count(self) -> int:
+        """向量存储中已删除（墓碑）的行数"""
+        return len(self.store) - len(self._rows)
+
+    def live_rows(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """返回全部存活行（按行号升序），用于压缩时重建索引
+
+        返回:
+            Tuple: (记忆ID列表, 行号数组, 隐私级别数组)
+        """
+        items = sorted(self._rows.items(), key=lambda item: item[1])
+        rows = np.asarray([row for _, row in items], dtype=np.int64)
+        privacy = self._privacy[rows] if len(rows) else np.zeros(0, dtype=np.int8)
+        return [memory_id for memory_id, _ in items], rows, privacy
+
+    def signals(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """返回若干行的写入时间和被检索次数（压缩时随向量一起拷贝）
+
+        返回:
+            Tuple: (Unix 秒数组, 被检索次数数组)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        return self._timestamps[rows], self._access[rows]
+
+    def touch(self, memory_id: str, timestamp: float):
+        """更新一条记忆的写入时间（例如合并了重复写入）"""
+        row = self._rows.get(memory_id)
+        if row is not None:
+            self._timestamps[row] = timestamp
+
+    def record_access(self, memory_ids: Sequence[str]):
+        """为被检索返回的记忆累加一次访问计数"""
+        rows = [row for row in map(self._rows.get, memory_ids) if row is not None]
+        if rows:
+            np.add.at(self._access, np.asarray(rows, dtype=np.int64), 1.0)
+
+    def id_at(self, row: int) -> Optional[str]:
+        """返回某一行对应的存活记忆ID，已删除时为 None"""
+        return self._ids[row] if row < len(self._ids) else None
+
+    def _ensure_rows(self, rows: int):
+        """确保平行数组至少覆盖 rows 行，不足时按倍数扩容"""
+        if len(self._ids) < rows:
+            self._ids.extend([None] * (rows - len(self._ids)))
+        if rows <= self._capacity:
+            return
+        capacity = max(self._capacity, 1024)
+        while capacity < rows:
+            capacity *= 2
+        alive = np.zeros(capacity, dtype=bool)
+        privacy = np.zeros(capacity, dtype=np.int8)
+        timestamps = np.full(capacity, np.nan, dtype=np.float64)
+        access = np.zeros(capacity, dtype=np.float32)
+        alive[:self._capacity] = self._alive
+        privacy[:self._capacity] = self._privacy
+        timestamps[:self._capacity] = self._timestamps
+        access[:self._capacity] = self._access
+        self._alive = alive
+        self._privacy = privacy
+        self._timestamps = timestamps
+        self._access = access
+        self._capacity = capacity
+
+    def row_of(self, memory_id: str) -> Optional[int]:
+        """返回记忆在向量存储中的行号"""
+        return self._rows.get(memory_id)
+
+    def vector(self, memory_id: str) -> Optional[np.ndarray]:
+        """返回记忆的归一化向量"""
+        row = self._rows.get(memory_id)
+        return None if row is None else np.asarray(self.store.matrix[row])
+
+    def add(self, memory_id: str, embedding: Sequence[float], privacy_level: int) -> int:
+        """添加一条向量（写入时间记为当前时间）
+
+        参数:
+            memory_id: 记忆ID
+            embedding: 原始（未归一化）向量
+            privacy_level: 隐私级别数值
+
+        返回:
+            int: 向量在存储中的行号
+        """
+        return self.add_batch([memory_id], np.asarray([embedding]), [privacy_level])[0]
+
+    def add_batch(self, memory_ids: Sequence[str], embeddings: np.ndarray,
+                  privacy_levels: Sequence[int], normalized: bool = False,
+                  timestamps: Optional[Sequence[float]] = None,
+                  access_counts: Optional[Sequence[float]] = None) -> List[int]:
+        """批量添加向量：归一化后追加到向量存储
+
+        参数:
+            memory_ids: 记忆ID列表
+            embeddings: 形状为 (n, dim) 的原始向量
+            privacy_levels: 与 memory_ids 对应的隐私级别数值
+            normalized: 向量已归一化（例如从另一个向量存储拷贝）时跳过归一化
+            timestamps: 记忆写入时间（Unix 秒），为空时记为当前时间
+            access_counts: 记忆被检索次数，为空时为 0
+
+        返回:
+            List[int]: 每条向量在存储中的行号
+        """
+        if len(memory_ids) == 0:
+            return []
+        vectors = np.atleast_2d(embeddings) if normalized else normalize_rows(np.atleast_2d(embeddings))
+        vectors = np.asarray(vectors, dtype=np.float32)
+        start = self.store.append(vectors)
+        rows = list(range(start, start + len(memory_ids)))
+        if self.quantized is not None:
+            self.quantized.set_rows(np.asarray(rows), vectors)
+        if timestamps is None:
+            timestamps = np.full(len(memory_ids), time.time())
+        self.attach_batch(memory_ids, rows, privacy_levels, quantize=False, timestamps=timestamps,
+                          access_counts=access_counts)
+        if self.ann is not None:
+            with self._ann_lock:
+                if self.ann.trained:
+                    self.ann.add(np.asarray(rows), vectors)
+            self.maybe_train_ann()
+        return rows
+
+    def attach_batch(self, memory_ids: Sequence[str], rows: Sequence[int], privacy_levels: Sequence[int],
+                     quantize: bool = True, timestamps: Optional[Sequence[float]] = None,
+                     access_counts: Optional[Sequence[float]] = None):
+        """将向量存储中已有的行登记到索引（启动时从持久化的行号重建索引）
+
+        参数:
+            memory_ids: 记忆ID列表
+            rows: 对应的行号
+            privacy_levels: 对应的隐私级别数值
+            quantize: 启用量化时，是否从存储中读取这些行生成量化副本
+            timestamps: 记忆写入时间（Unix 秒），为空时视为未知（不参与新鲜度加分）
+            access_counts: 记忆被检索次数，为空时为 0
+        """
+        if len(memory_ids) == 0:
+            return
+        # 已存在的ID先移除，保证 id 与行一一对应
+        for memory_id in memory_ids:
+            self.remove(memory_id)
+        rows_array = np.asarray(rows, dtype=np.int64)
+        self._ensure_rows(int(rows_array.max()) + 1)
+        self._alive[rows_array] = True
+        self._privacy[rows_array] = np.asarray(privacy_levels, dtype=np.int8)
+        self._timestamps[rows_array] = np.nan if timestamps is None else np.asarray(timestamps, dtype=np.float64)
+        self._access[rows_array] = 0.0 if access_counts is None else np.asarray(access_counts, dtype=np.float32)
+        for memory_id, row in zip(memory_ids, rows):
+            self._ids[row] = memory_id
+            self._rows[memory_id] = row
+        if quantize and self.quantized is not None:
+            matrix = self.store.matrix
+            for start in range(0, len(rows_array), self.quantized.chunk_size):
+                chunk = rows_array[start:start + self.quantized.chunk_size]
+                self.quantized.set_rows(chunk, matrix[chunk])
+
+    def maybe_train_ann(self, background: bool = True):
+        """向量数达到阈值且 ANN 索引未训练时，训练 ANN 索引
+
+        训练期间搜索继续使用精确路径；训练完成后补齐训练期间新增的行再切换。
+
+        参数:
+            background: 是否在后台线程中训练
+        """
+        ann = self.ann
+        if ann is None or ann.trained or len(self) < ann.min_train_size:
+            return
+        if self._ann_thread is not None and self._ann_thread.is_alive():
+            return
+        if background:
+            self._ann_thread = threading.Thread(target=self._train_ann, daemon=True)
+            self._ann_thread.start()
+        else:
+            self._train_ann()
+
+    def _train_ann(self):
+        try:
+            rows = np.asarray(sorted(self._rows.values()), dtype=np.int64)
+            matrix = self.store.matrix
+            trained = self.ann.untrained_copy()
+            trained.train(matrix, rows)
+            with self._ann_lock:
+                self._catch_up_ann(trained)
+                self.ann = trained
+        except Exception as e:
+            print(f"训练 ANN 索引失败，继续使用精确搜索: {e}")
+
+    def _catch_up_ann(self, ann: Any):
+        """把 ANN 索引尚未覆盖的行（训练或加载之后新增的行）补充进去"""
+        matrix = self.store.matrix
+        start = ann.row_count
+        if start < matrix.shape[0]:
+            ann.add(np.arange(start, matrix.shape[0]), matrix[start:])
+
+    def attach_ann(self, ann: Any):
+        """挂载一个已训练（例如从磁盘加载）的 ANN 索引，并补齐其后新增的行"""
+        with self._ann_lock:
+            self._catch_up_ann(ann)
+            self.ann = ann
+
+    def wait_for_ann(self, timeout: Optional[float] = None):
+        """等待后台 ANN 训练完成（主要用于测试和基准测试）"""
+        thread = self._ann_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def remove(self, memory_id: str) -> bool:
+        """移除一条向量（清除存活标记，行保留在存储中）
+
+        参数:
+            memory_id: 记忆ID
+
+        返回:
+            bool: 是否找到并移除
+        """
+        row = self._rows.pop(memory_id, None)
+        if row is None:
+            return False
+        self._alive[row] = False
+        self._access[row] = 0.0
+        self._ids[row] = None
+        return True
+
+    def search(self, query: Sequence[float], top_k: int = 5, privacy_level: Optional[int] = None,
+               nprobe: Optional[int] = None, exact: bool = False,
+               rows: Optional[np.ndarray] = None, scorer: Optional[Any] = None) -> List[Tuple[str, float]]:
+        """搜索与查询向量最相似的记忆
+
+        参数:
+            query: 原始查询向量
+            top_k: 返回结果数量
+            privacy_level: 若提供，只返回该隐私级别的记忆
+            nprobe: ANN 搜索时探查的倒排列表数，为空时使用 ANN 索引的默认值
+            exact: 为 True 时忽略 ANN 索引，强制精确搜索
+            rows: 若提供，只对这些行（例如元数据过滤后的候选）精确打分
+            scorer: 可选的 RecencyScorer，在相似度上叠加新鲜度与访问频次（量化粗排同样使用加权分数）
+
+        返回:
+            List[Tuple[str, float]]: (记忆ID, 分数) 列表，按分数降序；分数为余弦相似度或 scorer 的加权分数
+        """
+        if not self._rows or top_k <= 0:
+            return []
+        matrix = self.store.matrix
+        size = matrix.shape[0]
+        self._ensure_rows(size)
+        query_vector = normalize_rows(query)
+        if scorer is not None:
+            now = time.time()
+            max_access = float(self._access[:size].max()) if size else 0.0
+
+            def blend(scores: np.ndarray, score_rows: Optional[np.ndarray]) -> np.ndarray:
+                if score_rows is None:
+                    return scorer.blend(scores, self._timestamps[:size], self._access[:size], max_access, now)
+                return scorer.blend(scores, self._timestamps[score_rows], self._access[score_rows], max_access, now)
+
+        ann = self.ann
+        if rows is None and not exact and ann is not None and ann.trained:
+            # 近似搜索：只对最近的几个倒排列表中的候选行打分
+            rows = ann.candidates(query_vector, nprobe)
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            rows = rows[rows < size]
+            mask = self._alive[rows]
+            if privacy_level is not None:
+                mask &= self._privacy[rows] == privacy_level
+            rows = rows[mask]
+        else:
+            mask = self._alive[:size]
+            if privacy_level is not None:
+                mask = mask & (self._privacy[:size] == privacy_level)
+            rows = np.flatnonzero(mask) if self.quantized is not None else None
+
+        if self.quantized is not None and not exact:
+            # 量化粗排：在紧凑副本上打分，只对少量候选读取 float32 向量精确重打分
+            coarse = self.quantized.scores(query_vector, size, rows)
+            if scorer is not None:
+                coarse = blend(coarse, rows)
+            keep = top_k_indices(coarse, top_k * self.rescore_factor)
+            rows = rows[keep]
+
+        if rows is not None:
+            # 行号排序后读取，memmap 上的访问更连续
+            rows = np.sort(rows)
+            scores = matrix[rows] @ query_vector
+            if scorer is not None:
+                scores = blend(scores, rows)
+            indices = top_k_indices(scores, top_k)
+            return [(self._ids[rows[i]], float(scores[i])) for i in indices]
+
+        scores = matrix @ query_vector
+        if scorer is not None:
+            scores = blend(scores, None)
+        scores = np.where(mask, scores, -np.inf)
+        indices = top_k_indices(scores, top_k)
+        return [
+            (self._ids[i], float(scores[i]))
+            for i in indices
+            if np.isfinite(scores[i])
+        ]
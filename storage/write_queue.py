@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+写后队列 (write-behind)
+写入请求先持久化到本地 SQLite 队列即向调用方确认，后台线程按批取出，
+以有限并发提交到远端（Mem0），失败按指数退避重试。超过重试次数的条目交给 on_dead（如本地降级存储）
+接管后删除；没有 on_dead 或接管失败时标记为 dead 保留在队列中，可通过 redrive 重新投递。
+进程崩溃后未确认提交的条目在重启时继续投递（至少一次语义）。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from storage.circuit_breaker import CircuitOpenError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS write_queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_write_queue_status_next ON write_queue (status, next_attempt_at);
+"""
+
+Entry = Tuple[int, Dict[str, Any], int]
+
+
+class WriteBehindQueue:
+    """持久化的写后队列及其后台投递线程"""
+
+    def __init__(self, path: str, submit: Callable[[Dict[str, Any]], Any], batch_size: int = 16,
+                 max_concurrency: int = 4, max_attempts: int = 5, retry_base_delay: float = 1.0,
+                 retry_max_delay: float = 300.0, poll_interval: float = 0.5, fsync: bool = True,
+                 on_dead: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        """初始化
+
+        参数:
+            path: 队列数据库文件路径
+            submit: 提交一个条目到远端的函数，抛出异常表示失败；抛出 CircuitOpenError 时不计入重试次数
+            batch_size: 每批取出的条目数
+            max_concurrency: 一批内同时提交的条目数
+            max_attempts: 单个条目最多提交次数，超过后交给 on_dead 或标记为 dead
+            retry_base_delay: 首次重试的等待秒数，之后每次翻倍
+            retry_max_delay: 重试等待的上限秒数
+            poll_interval: 队列为空时的轮询间隔秒数
+            fsync: 为 True 时使用 synchronous=FULL，保证已确认的入队在掉电后不丢失
+            on_dead: 可选，接管超过重试次数的条目的函数（如写入本地存储），成功返回后条目从队列删除，
+                     抛出异常时条目保留为 dead
+        """
+        self.path = path
+        self.submit = submit
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.poll_interval = poll_interval
+        self.on_dead = on_dead
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self._conn.executescript(SCHEMA)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="write-behind")
+        self._counts: Counter = Counter()
+        self._last_lag = 0.0
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def enqueue(self, entry: Dict[str, Any]) -> int:
+        """持久化一个待提交条目并唤醒投递线程
+
+        参数:
+            entry: 可 JSON 序列化的条目
+
+        返回:
+            int: 条目序号
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO write_queue (enqueued_at, next_attempt_at, data) VALUES (?, ?, ?)",
+                (now, now, json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+            )
+            self._counts["enqueued"] += 1
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def _claim(self, limit: int) -> List[Entry]:
+        """取出已到重试时间的待提交条目（按入队顺序）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, data, attempts FROM write_queue WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY seq LIMIT ?", (time.time(), limit)
+            ).fetchall()
+        return [(seq, json.loads(data), attempts) for seq, data, attempts in rows]
+
+    def _ack(self, seqs: List[int]):
+        """删除已成功提交的条目，并记录本批中最早入队条目的排队时延"""
+        if not seqs:
+            return
+        placeholders = ",".join("?" * len(seqs))
+        with self._lock:
+            oldest = self._conn.execute(
+                f"SELECT MIN(enqueued_at) FROM write_queue WHERE seq IN ({placeholders})", seqs
+            ).fetchone()[0]
+            self._conn.execute(f"DELETE FROM write_queue WHERE seq IN ({placeholders})", seqs)
+            self._counts["submitted"] += len(seqs)
+            if oldest is not None:
+                self._last_lag = time.time() - oldest
+
+    def _retry(self, seq: int, entry: Dict[str, Any], attempts: int, error: Exception, count_attempt: bool = True):
+        """安排条目稍后重试，超过重试次数时交给 on_dead 或标记为 dead"""
+        if count_attempt:
+            attempts += 1
+        delay = min(self.retry_base_delay * (2 ** max(attempts - 1, 0)), self.retry_max_delay)
+        status = "dead" if attempts >= self.max_attempts else "pending"
+        if status == "dead" and self._hand_off(seq, entry, attempts, error):
+            return
+        with self._lock:
+            self._conn.execute(
+                "UPDATE write_queue SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE seq = ?",
+                (status, attempts, time.time() + delay, str(error), seq)
+            )
+            self._counts["dead" if status == "dead" else "retried"] += 1
+        if status == "dead":
+            print(f"写后队列条目 {seq} 重试 {attempts} 次仍失败，保留为 dead 等待重新投递: {error}")
+
+    def _hand_off(self, seq: int, entry: Dict[str, Any], attempts: int, error: Exception) -> bool:
+        """把超过重试次数的条目交给 on_dead，成功后从队列删除"""
+        if self.on_dead is None:
+            return False
+        try:
+            self.on_dead(entry)
+        except Exception as e:
+            print(f"写后队列条目 {seq} 转交失败: {e}")
+            return False
+        with self._lock:
+            self._conn.execute("DELETE FROM write_queue WHERE seq = ?", (seq,))
+            self._counts["handed_off"] += 1
+        print(f"写后队列条目 {seq} 重试 {attempts} 次仍失败，已转交: {error}")
+        return True
+
+    def redrive(self, limit: Optional[int] = None) -> int:
+        """把 dead 条目重新放回队列，重置重试次数并立即投递
+
+        参数:
+            limit: 最多重新投递的条目数（按入队顺序），为空时全部
+
+        返回:
+            int: 重新投递的条目数
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE write_queue SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE seq IN "
+                "(SELECT seq FROM write_queue WHERE status = 'dead' ORDER BY seq LIMIT ?)",
+                (time.time(), -1 if limit is None else limit)
+            )
+            self._counts["redriven"] += cursor.rowcount
+        self._wakeup.set()
+        return cursor.rowcount
+
+    def drain_once(self) -> int:
+        """取出一批条目并提交
+
+        返回:
+            int: 本批取出的条目数
+        """
+        batch = self._claim(self.batch_size)
+        futures = [(seq, entry, attempts, self._executor.submit(self.submit, entry))
+                   for seq, entry, attempts in batch]
+        succeeded = []
+        for seq, entry, attempts, future in futures:
+            try:
+                future.result()
+            except CircuitOpenError as e:
+                # 远端熔断中：不消耗重试次数，等待恢复
+                self._retry(seq, entry, attempts, e, count_attempt=False)
+            except Exception as e:
+                self._retry(seq, entry, attempts, e)
+            else:
+                succeeded.append(seq)
+        self._ack(succeeded)
+        return len(batch)
+
+    def start(self) -> threading.Thread:
+        """启动后台投递线程（重复调用无副作用）"""
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="write-behind-worker", daemon=True)
+            self._worker.start()
+        return self._worker
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                drained = self.drain_once()
+            except Exception as e:
+                print(f"写后队列投递失败: {e}")
+                drained = 0
+            if drained < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待当前可投递的条目全部提交或进入重试等待
+
+        参数:
+            timeout: 最长等待秒数，为空时一直等待
+
+        返回:
+            bool: 是否在超时前完成
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._claimable():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            self._wakeup.set()
+            time.sleep(0.01)
+        return True
+
+    def _claimable(self) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM write_queue WHERE status = 'pending' AND next_attempt_at <= ? LIMIT 1",
+                (time.time(),)
+            ).fetchone() is not None
+
+    def stats(self) -> Dict[str, Any]:
+        """返回队列深度与时延
+
+        返回:
+            Dict: depth（待提交条目数）、dead（等待重新投递的条目数）、lag_seconds（最早待提交条目已等待的秒数）、
+                  last_lag_seconds（最近一批提交中最早入队条目从入队到提交的秒数）以及各类计数
+                  （handed_off 为超过重试次数后转交 on_dead 的条目数）
+        """
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM write_queue GROUP BY status"))
+            oldest = self._conn.execute(
+                "SELECT MIN(enqueued_at) FROM write_queue WHERE status = 'pending'"
+            ).fetchone()[0]
+            return {
+                "depth": counts.get("pending", 0),
+                "dead": counts.get("dead", 0),
+                "lag_seconds": time.time() - oldest if oldest is not None else 0.0,
+                "last_lag_seconds": self._last_lag,
+                "enqueued": self._counts["enqueued"],
+                "submitted": self._counts["submitted"],
+                "retried": self._counts["retried"],
+                "handed_off": self._counts["handed_off"],
+                "redriven": self._counts["redriven"],
+            }
+
+    def close(self):
+        """停止投递线程并关闭数据库（未提交的条目保留，下次启动时继续投递）"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join()
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()